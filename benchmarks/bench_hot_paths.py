@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the Python hot paths on synthetic inputs.
+
+Covers preamble insertion and detection, loading and normalizing IQ files
+in the transmitter, the real time transmit loop's scheduling (against
+:class:`fixtures.StubTransmitterFlowgraph`), ground truth offsetting and
+modulation translation, unpacking the compressed engine output and the
+energy broadcaster's publish rate. Inputs are generated in a temporary
+directory at the chosen scale. Results are written as JSON, compare two
+runs with ``benchmarks/compare.py``.
+
+Run from the repository root with::
+
+    python benchmarks/bench_hot_paths.py --scale small --out results.json
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import fixtures  # noqa: E402
+import harness  # noqa: E402
+
+BENCHMARKS = {}
+
+
+class SkipBenchmark(Exception):
+    """Raised by a benchmark setup when an optional dependency is missing"""
+
+
+def benchmark(name):
+    """
+    Register a benchmark. The decorated function gets the context and
+    returns the benchmark body and the number of items it processes.
+    """
+
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+class Context:
+    """Scale and working directory of a run, fixtures are generated on first use"""
+
+    def __init__(self, scale: fixtures.Scale, work_dir: str):
+        self.scale = scale
+        self.work_dir = work_dir
+        self._cache = {}
+
+    def get(self, key, make):
+        if key not in self._cache:
+            self._cache[key] = make()
+        return self._cache[key]
+
+    def path(self, name):
+        return os.path.join(self.work_dir, name)
+
+    def dir(self, name):
+        path = os.path.join(self.work_dir, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @property
+    def tx_config(self):
+        return self.get("tx_config", lambda: fixtures.make_tx_config(self.dir("tx"), self.scale))
+
+    @property
+    def ground_truth(self):
+        return self.get("ground_truth", lambda: fixtures.make_ground_truth(self.path("gt.json"), self.scale))
+
+
+def _make_preamble(ctx):
+    from rfsynth.otatestbed.preamble import Preamble
+
+    fs = 1e6
+    # 10 ms of preamble at 1 MHz, 5000 symbols
+    return Preamble(preamble_on_time_ms=10, fs=fs, tx_rx_id=(0, 0, 0, 0))
+
+
+@benchmark("preamble_insert")
+def bench_preamble_insert(ctx):
+    preamble = _make_preamble(ctx)
+    samples = fixtures.make_iq(ctx.scale.preamble_samples)
+    return (lambda: preamble.insert(samples)), len(samples)
+
+
+@benchmark("preamble_remove")
+def bench_preamble_remove(ctx):
+    preamble = _make_preamble(ctx)
+    samples = fixtures.make_iq(ctx.scale.preamble_samples)
+    padded = preamble.insert(samples)
+    # Delayed and noisy, the way the receiver captures it
+    rng = np.random.default_rng(1)
+    delay = len(padded) // 8
+    received = np.zeros(len(padded) + 2 * delay, dtype=np.complex64)
+    received[delay : delay + len(padded)] = padded
+    received += (0.05 * (rng.standard_normal(len(received)) + 1j * rng.standard_normal(len(received)))).astype(
+        np.complex64
+    )
+
+    def body():
+        if preamble.remove(received) is None:
+            raise RuntimeError("Preamble was not detected")
+
+    return body, len(received)
+
+
+def _make_transmitter(ctx, **radio_options):
+    from rfsynth.otatestbed.config_model import load_config
+    from rfsynth.otatestbed.transmitter import Transmitter
+
+    if radio_options:
+        config_path = fixtures.make_tx_config(ctx.dir("tx_options"), ctx.scale, **radio_options)
+    else:
+        config_path = ctx.tx_config
+    radio_config = load_config(config_path).radios[0]
+    return Transmitter(radio_config, flowgraph=fixtures.StubTransmitterFlowgraph)
+
+
+@benchmark("transmitter_load_files")
+def bench_transmitter_load_files(ctx):
+    transmitter = _make_transmitter(ctx)
+    df = transmitter.read_meta_file(transmitter.metadata_files[0])
+    iq_files = list(dict.fromkeys(df.iq_filename))
+
+    def body():
+        for iq_filename in iq_files:
+            transmitter.set_single_channel_data_from_file(iq_filename, 0)
+
+    return body, len(iq_files) * ctx.scale.burst_samples
+
+
+@benchmark("real_time_transmit_loop")
+def bench_real_time_transmit_loop(ctx):
+    transmitter = _make_transmitter(ctx)
+
+    def body():
+        transmitter.real_time_transmit_loop(0, 0, time.time())
+
+    return body, ctx.scale.num_bursts
+
+
+@benchmark("real_time_transmit_loop_streaming")
+def bench_real_time_transmit_loop_streaming(ctx):
+    transmitter = _make_transmitter(ctx, streaming=True)
+
+    def body():
+        transmitter.real_time_transmit_loop(0, 0, time.time())
+
+    return body, ctx.scale.num_bursts
+
+
+@benchmark("offset_ground_truth")
+def bench_offset_ground_truth(ctx):
+    from rfsynth.otatestbed.report_utils import offset_ground_truth
+
+    gt_path = ctx.ground_truth
+    return (lambda: offset_ground_truth(gt_path, 1.7e9)), ctx.scale.num_reports
+
+
+@benchmark("translate_modulation")
+def bench_translate_modulation(ctx):
+    from rfsynth.otatestbed.report_utils import offset_ground_truth, translate_modulation
+
+    gt_path = ctx.ground_truth
+    # Translation rewrites the reports, start from the file every run
+    return (lambda: translate_modulation(offset_ground_truth(gt_path, 0.0))), ctx.scale.num_reports
+
+
+@benchmark("setup_compressedE")
+def bench_setup_compressed(ctx):
+    from rfsynth.utils import setup_compressedE
+
+    zip_path = fixtures.make_compressed_package(ctx.path("package.zip"), ctx.dir("package"), ctx.scale)
+    # setup_compressedE expects a trailing separator
+    out_dir = ctx.dir("unpacked") + os.sep
+
+    def body():
+        with contextlib.redirect_stdout(io.StringIO()):
+            setup_compressedE(zip_path, out_dir)
+
+    return body, ctx.scale.num_iq_files
+
+
+@benchmark("energy_broadcaster")
+def bench_energy_broadcaster(ctx):
+    from rfsynth.otatestbed.report_utils import offset_ground_truth
+
+    try:
+        from rfsynth.rfsynth_tx import energy_broadcaster
+    except ImportError as e:
+        raise SkipBenchmark(str(e)) from e
+
+    # Start times in the past, so reports are published as fast as possible
+    gt_dict = offset_ground_truth(ctx.ground_truth, 0.0)
+    return (lambda: energy_broadcaster(gt_dict)), ctx.scale.num_reports
+
+
+def run(names=None, scale_name: str = "small", repeat: int = 5, warmup: int = 1, work_dir: str = None):
+    """
+    Run benchmarks
+
+    :param names: Benchmarks to run, all by default
+    :type names: list or None
+
+    :param scale_name: One of fixtures.SCALES
+    :type scale_name: str
+
+    :param repeat: Timed runs per benchmark
+    :type repeat: int
+
+    :param warmup: Untimed runs per benchmark
+    :type warmup: int
+
+    :param work_dir: Directory for the generated inputs, a temporary one by default
+    :type work_dir: str or None
+
+    :return: Results by benchmark name
+    :rtype: dict
+    """
+    scale = fixtures.SCALES[scale_name]
+    results = {}
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        ctx = Context(scale, tmp_dir)
+        for name in names or BENCHMARKS:
+            try:
+                body, num_items = BENCHMARKS[name](ctx)
+            except SkipBenchmark as e:
+                results[name] = {"skipped": str(e)}
+                print(f"{name}: skipped ({e})")
+                continue
+            results[name] = harness.measure(body, repeat, warmup, num_items)
+            print(format_result(name, results[name]))
+    return results
+
+
+def format_result(name, result):
+    line = f"{name}: median {result['median_s'] * 1e3:.2f} ms, peak {result['peak_bytes'] / 2**20:.1f} MiB"
+    if result["items_per_s"]:
+        line += f", {result['items_per_s']:.3g} items/s"
+    return line
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the rfsynth hot paths on synthetic inputs")
+    parser.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run, out of {', '.join(BENCHMARKS)}")
+    parser.add_argument("--scale", type=str, default="small", choices=list(fixtures.SCALES))
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs per benchmark")
+    parser.add_argument("--work-dir", type=str, default=None, help="Where to generate the inputs")
+    parser.add_argument("--out", type=str, default=None, help="Write the results to this JSON file")
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks {unknown}")
+    # Per burst warnings would dominate the timings
+    logging.getLogger("rfsynth").setLevel(logging.ERROR)
+    results = run(args.benchmarks, args.scale, args.repeat, args.warmup, args.work_dir)
+    if args.out:
+        meta = harness.new_meta(REPO_ROOT, scale=args.scale, scale_params=vars(fixtures.SCALES[args.scale]))
+        harness.write_results(args.out, results, meta)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Import time budgets of the rfsynth entry points.
+
+Every process pool worker and every CLI call imports these modules from
+scratch, so heavy dependencies (GNU Radio, scipy, pandas, matplotlib) must
+only load on the paths that use them. Each module is imported in a fresh
+interpreter with ``-X importtime``. The best total over a few runs is checked
+against its budget, and the modules it must not pull in are checked against
+``sys.modules``.
+
+Run from the repository root with::
+
+    python benchmarks/bench_import_time.py --repeat 5
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("gnuradio", "scipy", "pandas", "matplotlib", "absl")
+
+# module: (budget in ms, modules it must not import)
+BUDGETS = {
+    "rfsynth.otatestbed.report_utils": (80, HEAVY_MODULES + ("numpy",)),
+    "rfsynth.otatestbed.config_model": (250, HEAVY_MODULES),
+    "rfsynth.utils": (300, HEAVY_MODULES),
+    "rfsynth.otatestbed.transmitter": (350, HEAVY_MODULES),
+    "rfsynth.otatestbed.realTimeTestbed": (350, HEAVY_MODULES),
+    "rfsynth.rfsynth_tx": (400, HEAVY_MODULES),
+}
+
+PROBE = "import json, sys; import {module}; print(json.dumps(sorted(m for m in {forbidden!r} if m in sys.modules)))"
+
+
+def parse_importtime(stderr: str):
+    """
+    Total import time from -X importtime output, the sum of the cumulative
+    times of the top level imports
+
+    :return: Total in milliseconds
+    :rtype: float
+    """
+    total_us = 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Nested imports are indented under their parent
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative)
+    return total_us / 1000
+
+
+def measure_import(module: str, forbidden=()):
+    """
+    Import a module in a fresh interpreter
+
+    :return: Import time in ms and the forbidden modules that got imported
+    :rtype: tuple[float, list]
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, forbidden=tuple(forbidden))],
+        capture_output=True,
+        text=True,
+        cwd=REPO_ROOT,
+        env=env,
+    )
+    if proc.returncode != 0:
+        raise ImportError(proc.stderr.strip().splitlines()[-1])
+    return parse_importtime(proc.stderr), json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run(modules=None, repeat: int = 3, budget_scale: float = 1.0):
+    """
+    Check the import budgets
+
+    :param modules: Modules to check, all of BUDGETS by default
+    :type modules: list or None
+
+    :param repeat: Fresh imports per module, the fastest one counts
+    :type repeat: int
+
+    :param budget_scale: Factor applied to every budget, for slower machines
+    :type budget_scale: float
+
+    :return: One result per module
+    :rtype: list[dict]
+    """
+    results = []
+    for module in modules or BUDGETS:
+        budget_ms, forbidden = BUDGETS.get(module, (None, HEAVY_MODULES))
+        result = {"module": module, "budget_ms": budget_ms and budget_ms * budget_scale}
+        try:
+            times = []
+            for _ in range(repeat):
+                import_ms, loaded = measure_import(module, forbidden)
+                times.append(import_ms)
+        except ImportError as e:
+            # Missing optional or system dependencies are reported, not failed
+            result.update(status="skipped", reason=str(e))
+            results.append(result)
+            continue
+        result.update(import_ms=min(times), heavy_imports=loaded)
+        over_budget = result["budget_ms"] is not None and result["import_ms"] > result["budget_ms"]
+        result["status"] = "fail" if over_budget or loaded else "ok"
+        results.append(result)
+    return results
+
+
+def format_results(results):
+    lines = []
+    for r in results:
+        if r["status"] == "skipped":
+            lines.append(f"SKIP {r['module']}: {r['reason']}")
+            continue
+        line = f"{r['status'].upper():4} {r['module']}: {r['import_ms']:.1f} ms (budget {r['budget_ms']} ms)"
+        if r["heavy_imports"]:
+            line += f", imports {', '.join(r['heavy_imports'])}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Check import time budgets of the rfsynth entry points")
+    parser.add_argument("modules", nargs="*", help="Modules to check, all budgeted modules by default")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh imports per module")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Factor applied to every budget")
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this file")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    results = run(args.modules, args.repeat, args.budget_scale)
+    print(format_results(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+    return 1 if any(r["status"] == "fail" for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
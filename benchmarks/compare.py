@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Compare two benchmark result files, e.g. of two commits.
+
+The fastest time and the peak memory of every benchmark present in both
+files are compared. Exits with 1 if any of them got worse by more than the
+threshold::
+
+    python benchmarks/compare.py base.json new.json --threshold 0.1
+"""
+
+import argparse
+import sys
+
+import harness
+
+# The fastest run is the least disturbed by other load on the machine
+METRICS = (("min_s", "time"), ("peak_bytes", "memory"))
+
+
+def compare(base: dict, new: dict, threshold: float = 0.1, memory_threshold: float = None):
+    """
+    Compare benchmark results
+
+    :param base: Results of the reference run, from harness.read_results
+    :type base: dict
+
+    :param new: Results of the run to check
+    :type new: dict
+
+    :param threshold: Relative increase of the fastest time counted as a regression
+    :type threshold: float
+
+    :param memory_threshold: Relative increase of the peak memory counted as a
+        regression, threshold by default
+    :type memory_threshold: float or None
+
+    :return: One row per benchmark and metric
+    :rtype: list[dict]
+    """
+    thresholds = {"time": threshold, "memory": threshold if memory_threshold is None else memory_threshold}
+    rows = []
+    for name, new_result in new["results"].items():
+        base_result = base["results"].get(name)
+        if base_result is None or "skipped" in base_result or "skipped" in new_result:
+            continue
+        for key, metric in METRICS:
+            before, after = base_result[key], new_result[key]
+            change = (after - before) / before if before else 0.0
+            rows.append(
+                {
+                    "benchmark": name,
+                    "metric": metric,
+                    "base": before,
+                    "new": after,
+                    "change": change,
+                    "regression": change > thresholds[metric],
+                }
+            )
+    return rows
+
+
+def format_rows(rows):
+    lines = [f"{'benchmark':36} {'metric':7} {'base':>12} {'new':>12} {'change':>8}"]
+    for row in rows:
+        if row["metric"] == "time":
+            base, new = f"{row['base'] * 1e3:.3f} ms", f"{row['new'] * 1e3:.3f} ms"
+        else:
+            base, new = f"{row['base'] / 2**20:.2f} MiB", f"{row['new'] / 2**20:.2f} MiB"
+        flag = "  REGRESSION" if row["regression"] else ""
+        lines.append(f"{row['benchmark']:36} {row['metric']:7} {base:>12} {new:>12} {row['change']:+8.1%}{flag}")
+    return "\n".join(lines)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("base", type=str, help="Results of the reference run")
+    parser.add_argument("new", type=str, help="Results of the run to check")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Allowed relative slowdown")
+    parser.add_argument("--memory-threshold", type=float, default=None, help="Allowed relative memory increase")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    base, new = harness.read_results(args.base), harness.read_results(args.new)
+    if base["meta"].get("scale") != new["meta"].get("scale"):
+        print(f"Warning: comparing scale {base['meta'].get('scale')} with {new['meta'].get('scale')}")
+    print(f"base {base['meta'].get('commit')}, new {new['meta'].get('commit')}")
+    rows = compare(base, new, args.threshold, args.memory_threshold)
+    print(format_rows(rows))
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
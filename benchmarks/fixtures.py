@@ -0,0 +1,280 @@
+"""
+Synthetic inputs for the benchmarks.
+
+Generates what the compressed engine and the testbed configs would provide,
+at a configurable scale: complex64 IQ files, energy metadata CSVs, ground
+truth JSON reports, the zip package unpacked by ``setup_compressedE`` and a
+transmit radio config. :class:`StubTransmitterFlowgraph` stands in for the
+GNU Radio flowgraph so the transmitter's scheduling can run without a radio.
+"""
+
+from dataclasses import dataclass
+import json
+import os
+import time
+import zipfile
+
+import numpy as np
+
+from rfsynth.otatestbed.clock_discipline import SimulatedDriftingClock
+
+SAMPLE_RATE = 100e6
+BASE_FREQ = 2.4e9
+
+MODULATIONS = ["qpsk", "bpsk", "qam16", "qam64", "fm", "am", "ofdm", "fsk2", "ssb"]
+
+
+@dataclass
+class Scale:
+    """Size of the generated inputs"""
+
+    num_bursts: int = 200  # energies per radio
+    burst_samples: int = 1 << 14  # samples per IQ file
+    num_iq_files: int = 8  # distinct IQ files the bursts cycle through
+    num_radios: int = 1
+    num_reports: int = 2000  # ground truth reports
+    preamble_samples: int = 1 << 18  # length of the sequences given to Preamble
+
+
+SCALES = {
+    "small": Scale(num_bursts=50, burst_samples=1 << 12, num_iq_files=4, num_reports=500, preamble_samples=1 << 16),
+    "medium": Scale(),
+    "large": Scale(
+        num_bursts=2000,
+        burst_samples=1 << 18,
+        num_iq_files=32,
+        num_radios=4,
+        num_reports=20000,
+        preamble_samples=1 << 21,
+    ),
+}
+
+
+def make_iq(num_samples: int, seed: int = 0):
+    """Band limited complex noise with a random amplitude"""
+    rng = np.random.default_rng(seed)
+    samples = rng.standard_normal(num_samples) + 1j * rng.standard_normal(num_samples)
+    # Short moving average, so the bursts are not white
+    samples = np.convolve(samples, np.ones(8) / 8, mode="same")
+    return (samples * rng.uniform(0.1, 2.0)).astype(np.complex64)
+
+
+def make_iq_files(out_dir: str, scale: Scale, prefix: str = "synthetic", seed: int = 0):
+    """
+    Write scale.num_iq_files complex64 IQ files
+
+    :return: Paths of the files
+    :rtype: list[str]
+    """
+    paths = []
+    for file_idx in range(scale.num_iq_files):
+        path = os.path.join(out_dir, f"{prefix}_{file_idx}.32cf")
+        make_iq(scale.burst_samples, seed + file_idx).tofile(path)
+        paths.append(path)
+    return paths
+
+
+def make_energy_rows(iq_paths, scale: Scale, sample_rate: float = SAMPLE_RATE, seed: int = 0):
+    """
+    Energy metadata rows in the compressed engine's CSV layout, for every radio
+
+    :return: Rows as dictionaries
+    :rtype: list[dict]
+    """
+    rng = np.random.default_rng(seed)
+    time_length = scale.burst_samples / sample_rate
+    rows = []
+    for radio_idx in range(scale.num_radios):
+        time_start = 0.0
+        for burst_idx in range(scale.num_bursts):
+            bandwidth = float(rng.choice([1e6, 5e6, 20e6]))
+            freq_lo = BASE_FREQ + float(rng.integers(0, 80)) * 1e6
+            rows.append(
+                {
+                    "report_type": "energy",
+                    "instance_name": f"synthetic_{burst_idx} T_{radio_idx + 1}",
+                    "time_start": round(time_start, 9),
+                    "time_stop": round(time_start + time_length, 9),
+                    "freq_lo": freq_lo,
+                    "freq_hi": freq_lo + bandwidth,
+                    "timeLength_s": time_length,
+                    "bandwidth_Hz": bandwidth,
+                    "signal_index": burst_idx,
+                    "tx_radio": radio_idx + 1,
+                    "iq_filename": iq_paths[burst_idx % len(iq_paths)],
+                }
+            )
+            # Gaps of one to five burst lengths, now and then too short for the guard interval
+            time_start += time_length * float(rng.uniform(1.0, 5.0))
+    return rows
+
+
+def write_energy_csv(path: str, rows):
+    import pandas as pd
+
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return path
+
+
+def make_ground_truth(path: str, scale: Scale, seed: int = 0):
+    """
+    Write a ground truth report file with signal and energy reports
+
+    :return: path
+    :rtype: str
+    """
+    rng = np.random.default_rng(seed)
+    reports = []
+    for report_idx in range(scale.num_reports):
+        time_start = report_idx * 1e-3
+        report = {
+            "report_type": "signal" if report_idx % 2 == 0 else "energy",
+            "instance_name": f"synthetic_{report_idx}",
+            "time_start": time_start,
+            "time_stop": time_start + 5e-4,
+            "freq_lo": BASE_FREQ,
+            "freq_hi": BASE_FREQ + 1e6,
+        }
+        if report["report_type"] == "signal":
+            report["reference_time"] = time_start
+            report["modulation"] = MODULATIONS[int(rng.integers(len(MODULATIONS)))]
+            report["protocol"] = "synthetic"
+        reports.append(report)
+    with open(path, "w") as f:
+        json.dump({"reports": reports}, f)
+    return path
+
+
+def make_compressed_package(zip_path: str, work_dir: str, scale: Scale, seed: int = 0):
+    """
+    Write a zip like the compressed engine output: IQ files, an energy CSV
+    and a ground truth JSON
+
+    :return: zip_path
+    :rtype: str
+    """
+    iq_paths = make_iq_files(work_dir, scale, "package", seed)
+    csv_path = write_energy_csv(
+        os.path.join(work_dir, "package_energy_meta.csv"), make_energy_rows(iq_paths, scale, seed=seed)
+    )
+    gt_path = make_ground_truth(os.path.join(work_dir, "package_scoring.json"), scale, seed)
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as zip_file:
+        for path in iq_paths + [csv_path, gt_path]:
+            zip_file.write(path, os.path.basename(path))
+    return zip_path
+
+
+def make_tx_config(out_dir: str, scale: Scale, seed: int = 0, **radio_options):
+    """
+    Write IQ files, an energy CSV and a transmit config for scale.num_radios radios
+
+    :param radio_options: Extra keys of every radio, e.g. retunePolicy or streaming
+    :type radio_options: dict
+
+    :return: Path of the config file
+    :rtype: str
+    """
+    iq_paths = make_iq_files(out_dir, scale, seed=seed)
+    meta_path = write_energy_csv(
+        os.path.join(out_dir, "synthetic_energy_meta.csv"), make_energy_rows(iq_paths, scale, seed=seed)
+    )
+    radios = []
+    for radio_idx in range(scale.num_radios):
+        radio = {
+            "model": "USRP_X410",
+            "name": f"R{radio_idx}",
+            "addrs": [f"addr=192.168.{radio_idx}.2"],
+            "sampleRate": SAMPLE_RATE,
+            "masterClockRate": 2 * SAMPLE_RATE,
+            "subdevSpec": "A:0",
+            "channels": [
+                {
+                    "name": "CH0",
+                    "antenna": "TX/RX",
+                    "gain": 0.8,
+                    "IQSTREAM_Params": {"frequency": BASE_FREQ, "file": iq_paths[0], "metadata": meta_path},
+                }
+            ],
+        }
+        radio.update(radio_options)
+        radios.append(radio)
+    config_path = os.path.join(out_dir, "synthetic_tx_config.json")
+    with open(config_path, "w") as f:
+        json.dump({"radios": radios}, f, indent=4)
+    return config_path
+
+
+class StubTransmitterFlowgraph:
+    """
+    Stand-in for transmitter_flowgraph without GNU Radio or a radio. Every
+    call returns at once; data, commands and start times are counted so the
+    benchmark can check the transmitter did the expected work.
+    """
+
+    def __init__(
+        self,
+        address,
+        clock_rate,
+        sample_rate,
+        num_channels,
+        subdev_spec,
+        streaming=False,
+        cpu_format="fc32",
+    ):
+        self.sample_rate = sample_rate
+        self.num_channels = num_channels
+        self.streaming = streaming
+        self.device_clock = SimulatedDriftingClock(offset_s=1e-3, drift_ppm=2.0, jitter_s=5e-6, seed=0)
+        self.samples_set = 0
+        self.num_starts = 0
+        self.num_tune_commands = 0
+
+    def configure_channel(self, antenna, gain, center_freq, channel_num):
+        pass
+
+    def set_vector_source_data(self, data, channel_num):
+        self.samples_set += len(data)
+
+    def set_stream_segment(
+        self, filepath, channel_num, sample_offset=0, length=None, scale=1.0, offset_hz=0.0, impairments=None
+    ):
+        self.samples_set += length or 0
+
+    def get_stream_stats(self, channel_num):
+        return {}
+
+    def reset_flowgraph(self):
+        pass
+
+    def set_time_now(self):
+        return time.time()
+
+    def get_time_difference(self):
+        return 0.0
+
+    def get_time_pair(self):
+        return self.device_clock.get_time_pair()
+
+    def timed_start(self, time_start):
+        self.num_starts += 1
+
+    def timed_tune_channel(self, center_freq, cmd_time, channel_idx, lo_freq=None):
+        self.num_tune_commands += 1
+
+    def timed_tune_batch(self, commands, channel_idx):
+        self.num_tune_commands += len(commands)
+
+    def start(self):
+        pass
+
+    def wait(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def print_radio_settings(self):
+        pass
+
+    def print_channel_settings(self, channel_num):
+        pass
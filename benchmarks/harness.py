@@ -0,0 +1,114 @@
+"""
+Timing, memory measurement and result files of the benchmarks.
+
+Every benchmark is timed over a number of runs after a warmup run, then run
+once more under tracemalloc for its peak allocation (numpy reports its
+buffers to tracemalloc). Results are written as JSON together with the
+commit and environment they were measured on, so runs of two commits can be
+compared with ``benchmarks/compare.py``.
+"""
+
+from datetime import datetime, timezone
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+
+def measure(func, repeat: int = 5, warmup: int = 1, num_items: int = None):
+    """
+    Time func and measure its peak memory
+
+    :param func: Benchmark body, called without arguments
+    :type func: callable
+
+    :param repeat: Timed runs
+    :type repeat: int
+
+    :param warmup: Untimed runs before the timed ones
+    :type warmup: int
+
+    :param num_items: Items processed per run, for the throughput
+    :type num_items: int or None
+
+    :return: Timing statistics in seconds, throughput and peak memory in bytes
+    :rtype: dict
+    """
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(times)
+    return {
+        "repeat": repeat,
+        "min_s": min(times),
+        "median_s": median,
+        "mean_s": statistics.fmean(times),
+        "max_s": max(times),
+        "num_items": num_items,
+        "items_per_s": num_items / median if num_items and median > 0 else None,
+        "peak_bytes": peak_bytes,
+    }
+
+
+def get_commit(repo_dir: str = None):
+    """Commit checked out in repo_dir, with a + suffix if the tree has changes"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=repo_dir, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            cwd=repo_dir,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("+" if dirty else "")
+
+
+def get_environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+def write_results(path: str, results: dict, meta: dict):
+    with open(path, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=4)
+    return path
+
+
+def read_results(path: str):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def new_meta(repo_dir: str = None, **extra):
+    meta = {
+        "commit": get_commit(repo_dir),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        **get_environment(),
+    }
+    meta.update(extra)
+    return meta
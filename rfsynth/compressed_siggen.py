@@ -0,0 +1,621 @@
+#!/usr/bin/env python
+"""
+Compressed signal generator, the Python counterpart of the MATLAB
+``auto_compressed_siggen``/``CompressedEngine``.
+
+Reads the same ``compressed_config.yml`` schema (generationParameters,
+rxConfig, txConfig, signals) and writes the zip that ``setup_compressedE``
+and ``real_time_transmit_loop`` consume: one ``.32cf`` burst per signal at
+the sample rate of the transmitter it is assigned to,
+``<prefix>_energy_meta.csv`` with one row per transmission,
+``<prefix>_signal_meta.txt`` and the ground truth ``<prefix>_scoring.json``.
+
+Transmission times follow ``Traffic.m`` (periodic, poisson, uniformVar,
+customArray, with burst mode), drawn in one batch per signal. Bursts are
+simple vectorized stand-ins for the MATLAB toolbox waveforms: OFDM for
+WlanNonHT80211g, GMSK for Bluetooth, spread PSK for Ds3 and complex noise
+for WidebandThermalWgn. Signals are assigned to transmitters start time
+first, like ``mapSignalsToTxandSource``. Several scenario configs are
+generated in parallel worker processes::
+
+    python -m rfsynth.compressed_siggen scenario1.yml scenario2.yml --seed 7
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import io
+import json
+import logging
+import os
+import re
+import time
+import zipfile
+
+import numpy as np
+
+from rfsynth.otatestbed import log_queue
+from rfsynth.otatestbed.resampler import resample
+
+logger = logging.getLogger(__name__)
+
+# Receiver input SNR the MATLAB engine records for every signal
+RX_INPUT_SNR_DB = -5
+BOLTZMANN = 1.380649e-23
+ENERGY_COLUMNS = (
+    "report_type",
+    "instance_name",
+    "time_start",
+    "time_stop",
+    "freq_lo",
+    "freq_hi",
+    "timeLength_s",
+    "bandwidth_Hz",
+    "signal_index",
+    "energy_index",
+    "tx_radio",
+    "iq_filename",
+)
+SIGNAL_COLUMNS = (
+    "report_type",
+    "instance_name",
+    "protocol",
+    "modality",
+    "modulation",
+    "activity_type",
+    "time_start",
+    "time_stop",
+    "freq_lo",
+    "freq_hi",
+    "reference_time",
+    "reference_freq",
+    "timeLength_s",
+    "bandwidth_Hz",
+)
+TRAFFIC_KEYS = {
+    "type",
+    "startTime",
+    "stopTime",
+    "arrivalArray",
+    "varRange",
+    "transmissionPerSec",
+    "burst_tog",
+    "energies_per_burst",
+    "time_per_energy",
+    "timeOn",
+}
+# Arguments every signal type takes, see Signal.m
+SIGNAL_KEYS = {
+    "trafficType",
+    "centerFreq_Hz",
+    "bandwidth_Hz",
+    "txPower_db",
+    "transmissionRate_Hz",
+    "protocol",
+    "modality",
+    "modulation",
+}
+
+
+class Traffic:
+    """
+    Transmission timing of a signal, as in Traffic.m
+
+    :param traffic_d: The trafficType entry of a signal
+    :type traffic_d: dict
+    """
+
+    def __init__(self, traffic_d: dict):
+        unknown = set(traffic_d) - TRAFFIC_KEYS
+        if unknown:
+            raise ValueError(f"Unknown trafficType keys {sorted(unknown)}")
+        self.traffic_type = traffic_d.get("type", "periodic")
+        self.start_time = float(traffic_d.get("startTime", 0.0))
+        self.stop_time = float(traffic_d.get("stopTime", np.inf))
+        self.transmission_per_sec = traffic_d.get("transmissionPerSec")
+        self.var_range = traffic_d.get("varRange")
+        self.arrival_array = np.asarray(traffic_d.get("arrivalArray", []), dtype=np.float64)
+        time_on = traffic_d.get("timeOn", self.stop_time - self.start_time)
+        if len(self.arrival_array):
+            self.start_time = float(self.arrival_array.min())
+            self.stop_time = float(self.arrival_array.max() + time_on)
+        self.burst = bool(traffic_d.get("burst_tog", False))
+        self.energies_per_burst = int(traffic_d.get("energies_per_burst", 1))
+        self.time_per_energy = float(traffic_d.get("time_per_energy", 0.0))
+        self.time_bet_energy = 1e-3
+        if self.transmission_per_sec is None and self.traffic_type != "customArray":
+            raise ValueError(f"transmissionPerSec is not set for {self.traffic_type} traffic")
+
+    def interval(self, time_stop: float):
+        """Time the signal may be active in, clipped to [0, time_stop]"""
+        return max(0.0, self.start_time), min(time_stop, self.stop_time)
+
+    def _burst_times(self, start_times):
+        # Every arrival becomes energies_per_burst energies, spaced by an energy and a gap
+        if not self.burst:
+            return start_times
+        offsets = np.arange(1, self.energies_per_burst + 1) * (self.time_per_energy + self.time_bet_energy)
+        return (start_times[:, None] + offsets[None, :]).ravel()
+
+    def transmission_times(self, time_stop: float, time_start: float = 0.0, rng=None):
+        """
+        Start times of all transmissions within [time_start, time_stop]
+
+        :param time_stop: End of the generated time span
+        :type time_stop: float
+
+        :param time_start: Start of the generated time span
+        :type time_start: float
+
+        :param rng: Random generator of the random traffic types
+        :type rng: np.random.Generator or None
+
+        :return: Start times
+        :rtype: np.ndarray
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        lo, hi = max(time_start, self.start_time), min(time_stop, self.stop_time)
+        if lo > hi:
+            return np.zeros(0)
+        rate = self.transmission_per_sec
+        span = time_stop - self.start_time
+        if self.traffic_type == "periodic":
+            times = np.arange(int(np.ceil(span * rate))) / rate
+            times = self._burst_times(times) + self.start_time
+        elif self.traffic_type == "poisson":
+            # Exponential interarrival times, four times the average count so the span is covered
+            times = np.cumsum(rng.exponential(1 / rate, 4 * int(np.floor(span * rate)))) + self.start_time
+            times = self._burst_times(times[times < time_stop])
+        elif self.traffic_type == "uniformVar":
+            var = 0.075 / rate if self.var_range is None else self.var_range
+            intervals = 1 / rate + rng.uniform(-var, var, 2 * int(np.ceil(span * rate)))
+            times = np.cumsum(intervals) + self.start_time
+            times = self._burst_times(times[times < time_stop])
+        elif self.traffic_type == "customArray":
+            times = self.arrival_array
+        else:
+            raise ValueError(f"Unknown traffic type {self.traffic_type}")
+        return times[(times >= lo) & (times <= hi)]
+
+
+def _psk(rng, num_symbols: int, mod_order: int):
+    # pskmod with an initial phase of pi/M, the mapping does not matter for random data
+    symbols = rng.integers(mod_order, size=num_symbols)
+    return np.exp(1j * (np.pi / mod_order + 2 * np.pi * symbols / mod_order))
+
+
+def wlan_ofdm_burst(rng, psdu_length: int = 100):
+    """
+    802.11g non-HT like OFDM burst at 20 MHz: 52 BPSK subcarriers out of 64,
+    16 sample cyclic prefix, four training symbols and the 6 Mb/s data symbols
+    of a psdu_length byte PSDU
+    """
+    num_symbols = 4 + int(np.ceil((16 + 8 * psdu_length + 6) / 24))
+    used = np.r_[-26:0, 1:27] % 64
+    grid = np.zeros((num_symbols, 64), dtype=np.complex128)
+    grid[:, used] = 2.0 * rng.integers(2, size=(num_symbols, len(used))) - 1
+    symbols = np.fft.ifft(grid, axis=1)
+    return np.concatenate((symbols[:, -16:], symbols), axis=1).ravel()
+
+
+def gmsk_burst(rng, num_bits: int, samples_per_symbol: int = 8, bt: float = 0.5, mod_index: float = 0.5):
+    """Gaussian filtered frequency shift keyed burst, BLE LE1M by default"""
+    nrz = np.repeat(2.0 * rng.integers(2, size=num_bits) - 1, samples_per_symbol)
+    t = np.arange(-2 * samples_per_symbol, 2 * samples_per_symbol + 1) / samples_per_symbol
+    gaussian = np.exp(-2 * np.pi**2 * bt**2 * t**2 / np.log(2))
+    freq = np.convolve(nrz, gaussian / gaussian.sum(), mode="same")
+    return np.exp(1j * np.pi * mod_index * np.cumsum(freq) / samples_per_symbol)
+
+
+def dsss_burst(rng, num_symbols: int, chips_per_symbol: int, mod_order: int, samples_per_chip: int, spread_type: int):
+    """PSK symbols spread by +-1 chips, one code for all symbols (type 1) or one per symbol (type 2)"""
+    symbols = _psk(rng, num_symbols, mod_order)
+    if spread_type == 1:
+        codes = 2.0 * rng.integers(2, size=(1, chips_per_symbol)) - 1
+    elif spread_type == 2:
+        codes = 2.0 * rng.integers(2, size=(num_symbols, chips_per_symbol)) - 1
+    else:
+        raise ValueError(f"Unknown spread type {spread_type}")
+    return np.repeat((symbols[:, None] * codes).ravel(), samples_per_chip)
+
+
+def complex_noise(rng, num_samples: int):
+    return (rng.standard_normal(num_samples) + 1j * rng.standard_normal(num_samples)) / np.sqrt(2)
+
+
+class SignalSpec:
+    """
+    One entry of the signals list: metadata, traffic and a burst generator
+
+    :param signal_type: Name of the MATLAB atomic signal class
+    :type signal_type: str
+
+    :param args: Arguments of the signal
+    :type args: dict
+
+    :param rng: Random generator for the instance name and the burst
+    :type rng: np.random.Generator
+    """
+
+    def __init__(self, signal_type: str, args: dict, rng):
+        if signal_type not in SIGNAL_TYPES:
+            raise ValueError(f"Unknown signal type {signal_type}. Should be one of {sorted(SIGNAL_TYPES)}")
+        self.signal_type = signal_type
+        self.rng = rng
+        self.instance_name = f"atomic.{signal_type}_{rng.integers(16**8):08x}"
+        self.protocol = args.get("protocol", "unknown")
+        self.modality = args.get("modality", "unknown")
+        self.modulation = args.get("modulation", "unknown")
+        self.center_freq = args.get("centerFreq_Hz")
+        if self.center_freq is None:
+            raise ValueError(f"{signal_type}: centerFreq_Hz is not provided")
+        self.tx_power_db = args.get("txPower_db", 0.0)
+        self.traffic = Traffic(args.get("trafficType", {"type": "periodic"}))
+        self._args = args
+        self._used = set(SIGNAL_KEYS)
+        SIGNAL_TYPES[signal_type](self, args)
+        self.transmission_rate = args.get("transmissionRate_Hz", self.transmission_rate)
+        unused = set(args) - self._used
+        if unused:
+            logger.warning("%s ignores arguments %s", signal_type, sorted(unused))
+
+    def arg(self, key, default=None):
+        self._used.add(key)
+        return self._args.get(key, default)
+
+    @property
+    def freq_lo(self):
+        return self.center_freq - self.bandwidth / 2
+
+    @property
+    def freq_hi(self):
+        return self.center_freq + self.bandwidth / 2
+
+    def generate_burst(self):
+        """One transmission, scaled to an RMS of txPower_db like scaleTxPower"""
+        samples = self._make_burst()
+        rms = np.sqrt(np.mean(np.abs(samples) ** 2))
+        if rms > 0 and self.tx_power_db is not None:
+            samples = samples * (10 ** (self.tx_power_db / 20) / rms)
+        return samples
+
+
+def _wlan(spec, args):
+    spec.bandwidth = 16.8e6
+    spec.transmission_rate = 20e6
+    spec.protocol = args.get("protocol", "wlan_wwan")
+    spec.modality = args.get("modality", "multi_carrier")
+    spec.modulation = args.get("modulation", "ofdm")
+    psdu_length = spec.arg("psduLength", 100)
+    spec._make_burst = lambda: wlan_ofdm_burst(spec.rng, psdu_length)
+
+
+def _bluetooth(spec, args):
+    samples_per_symbol = spec.arg("samplesPerSymbol", 8)
+    message_bits = spec.arg("messageLength", 640)
+    spec.bandwidth = 1.255e6
+    spec.transmission_rate = 1e6 * samples_per_symbol
+    spec.modality = args.get("modality", "single_carrier")
+    spec.modulation = args.get("modulation", "gmsk")
+    # Preamble, access address, PDU and CRC
+    num_bits = 8 + 32 + message_bits + 24
+    spec._make_burst = lambda: gmsk_burst(spec.rng, num_bits, samples_per_symbol)
+
+
+def _ds3(spec, args):
+    spec.bandwidth = args.get("bandwidth_Hz")
+    if spec.bandwidth is None:
+        raise ValueError("Ds3: bandwidth_Hz must be provided")
+    chips_per_symbol = spec.arg("chipsPerSymbol", 1024)
+    mod_order = spec.arg("modOrder", 2)
+    samples_per_chip = spec.arg("samplesPerChip", 2)
+    spread_type = spec.arg("spreadType", 1)
+    if np.log2(mod_order) % 1:
+        raise ValueError("Ds3: modOrder must be a power of 2")
+    symbol_rate = spec.bandwidth / (2 * chips_per_symbol)
+    total_time = spec.arg("transmissionTotTime")
+    num_symbols = 100 if total_time is None else max(1, int(round(total_time * symbol_rate)))
+    spec.transmission_rate = symbol_rate * chips_per_symbol * samples_per_chip
+    spec.modality = args.get("modality", "direct_sequence")
+    spec.modulation = args.get("modulation", {2: "bpsk", 4: "qpsk"}.get(mod_order, f"psk{mod_order}"))
+    spec._make_burst = lambda: dsss_burst(
+        spec.rng, num_symbols, chips_per_symbol, mod_order, samples_per_chip, spread_type
+    )
+
+
+def _wideband_noise(spec, args):
+    spec.bandwidth = args.get("bandwidth_Hz")
+    if spec.bandwidth is None:
+        raise ValueError("WidebandThermalWgn: bandwidth_Hz must be provided")
+    temperature = spec.arg("temperature_K", 290)
+    total_time = spec.arg("transmissionTotTime", 1e-3)
+    spec.transmission_rate = spec.bandwidth
+    # Thermal noise power of the band, in dBm like the MATLAB class
+    spec.tx_power_db = 10 * np.log10(BOLTZMANN * temperature * spec.bandwidth) + 30
+    spec.is_noise = True
+    if "trafficType" not in args:
+        # Back to back bursts cover the whole span
+        spec.traffic = Traffic({"type": "periodic", "transmissionPerSec": 1 / total_time})
+    num_samples = int(round(total_time * spec.transmission_rate))
+    spec._make_burst = lambda: complex_noise(spec.rng, num_samples)
+
+
+SIGNAL_TYPES = {
+    "WlanNonHT80211g": _wlan,
+    "Bluetooth": _bluetooth,
+    "Ds3": _ds3,
+    "WidebandThermalWgn": _wideband_noise,
+}
+
+
+def assign_transmitters(intervals, num_tx: int):
+    """
+    Start time first assignment of signals to transmitters: in order of start
+    time, every signal goes to the transmitter that has been free the longest
+
+    :param intervals: (start, stop) of every signal
+    :type intervals: list[tuple]
+
+    :param num_tx: Number of transmitters
+    :type num_tx: int
+
+    :return: Transmitter index, from 0, of every signal
+    :rtype: list[int]
+    """
+    if num_tx < 1:
+        raise ValueError("No transmitters configured, cannot continue")
+    end_times = np.zeros(num_tx)
+    tx_indices = [0] * len(intervals)
+    for signal_idx in sorted(range(len(intervals)), key=lambda idx: tuple(intervals[idx])):
+        start, stop = intervals[signal_idx]
+        tx_idx = int(np.argmin(end_times))
+        if end_times[tx_idx] > start:
+            raise ValueError(
+                f"Failed to assign signal {signal_idx} starting at {start} s, "
+                f"more simultaneous signals than the {num_tx} transmitters"
+            )
+        tx_indices[signal_idx] = tx_idx
+        end_times[tx_idx] = stop
+    return tx_indices
+
+
+def _zip_info(name: str):
+    # Current time and rw-r--r--, like the files the MATLAB engine zips up
+    info = zipfile.ZipInfo(name, time.localtime()[:6])
+    info.external_attr = 0o644 << 16
+    return info
+
+
+def _csv_text(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, columns, extrasaction="ignore", lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def _scoring_report(sources, rx_report):
+    # Frequencies and bandwidths in MHz, like parseMetadataForScoring
+    reports = []
+    for source in sources:
+        for signal in source["signals"]:
+            if signal.get("is_noise"):
+                continue
+            for energy in signal["energies"]:
+                report = {key: energy[key] for key in ENERGY_COLUMNS[:8]}
+                for key in ("freq_lo", "freq_hi", "bandwidth_Hz"):
+                    report[key] = report[key] / 1e6
+                reports.append(report)
+            report = {key: signal["report"][key] for key in SIGNAL_COLUMNS}
+            for key in ("freq_lo", "freq_hi", "reference_freq", "bandwidth_Hz"):
+                report[key] = report[key] / 1e6
+            report["rx_center_freq"] = {"rx1": rx_report["freqCenter_Hz"]}
+            report["rx_sample_rate"] = {"rx1": rx_report["sampleRate_Hz"]}
+            report["rx_input_snr"] = {"rx1": RX_INPUT_SNR_DB}
+            report["energy_set"] = [energy["instance_name"] for energy in signal["energies"]]
+            reports.append(report)
+        reports.append({key: value for key, value in source.items() if key != "signals"})
+    rx = dict(rx_report)
+    rx["freqCenter_Hz"] = rx["freqCenter_Hz"] / 1e6
+    rx["sampleRate_Hz"] = rx["sampleRate_Hz"] / 1e6
+    reports.append(rx)
+    return {"reports": reports}
+
+
+def load_config(config_filename: str):
+    """
+    Read a scenario file. Exponent notation without a dot or sign (1e6,
+    1.2288e8) is read as a number like MATLAB's yaml reader does, where plain
+    YAML 1.1 reads it as a string.
+
+    :param config_filename: compressed_config.yml style scenario file
+    :type config_filename: str
+
+    :rtype: dict
+    """
+    import yaml
+
+    class ScenarioLoader(yaml.SafeLoader):
+        pass
+
+    ScenarioLoader.add_implicit_resolver(
+        "tag:yaml.org,2002:float",
+        re.compile(r"^[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)[eE][-+]?[0-9]+$"),
+        list("-+.0123456789"),
+    )
+    with open(config_filename, "r") as f:
+        return yaml.load(f, Loader=ScenarioLoader)
+
+
+def generate_package(config_filename: str, seed: int = None, output_folder: str = None):
+    """
+    Generate the compressed data package of one scenario
+
+    :param config_filename: compressed_config.yml style scenario file
+    :type config_filename: str
+
+    :param seed: Seed of all random draws, generationParameters.seed or random when None
+    :type seed: int or None
+
+    :param output_folder: Overrides generationParameters.outputFolder
+    :type output_folder: str or None
+
+    :return: Path of the zip file
+    :rtype: str
+    """
+    config = load_config(config_filename)
+    params = config["generationParameters"]
+    tot_time = float(params["tot_time"])
+    folder = output_folder or params.get("outputFolder", "/tmp")
+    prefix = params.get("filePrefix", "default_data")
+    output_samples = params.get("flagOutputIqSamples", True)
+    rng = np.random.default_rng(params.get("seed") if seed is None else seed)
+
+    rx_d = config["rxConfig"]
+    rx_rate = float(rx_d["rxSampleRate_Hz"])
+    rx_center = float(rx_d["centerFreq_Hz"])
+    tx_list = config["txConfig"]
+    if isinstance(tx_list, dict):
+        tx_list = [tx_list]
+
+    specs = [SignalSpec(signal_d["type"], signal_d.get("args", {}), rng) for signal_d in config["signals"]]
+    for spec in specs:
+        if spec.freq_lo < rx_center - rx_rate / 2 or spec.freq_hi > rx_center + rx_rate / 2:
+            raise ValueError(f"{spec.instance_name} does not fit within the receiver bandwidth")
+    tx_indices = assign_transmitters([spec.traffic.interval(tot_time) for spec in specs], len(tx_list))
+
+    sources = [
+        {
+            "report_type": "source",
+            "instance_name": f"default{tx_idx}",
+            "device_origin": "default_source_device",
+            "locationXYZ_m": tx_d.get("location", [0, 0, 0]),
+            "outputSamplingRate_Hz": float(tx_d["sampleRate_Hz"]),
+            "channelModel": "IDENTITY",
+            "signal_set": [],
+            "signals": [],
+        }
+        for tx_idx, tx_d in enumerate(tx_list)
+    ]
+    os.makedirs(folder, exist_ok=True)
+    zip_path = os.path.join(folder, f"{prefix}.zip")
+    energies = []
+    # Entries are stored uncompressed, IQ floats barely deflate and unzip runs before every transmission
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as zip_file:
+        for signal_idx, (spec, tx_idx) in enumerate(zip(specs, tx_indices)):
+            source = sources[tx_idx]
+            times = spec.traffic.transmission_times(tot_time, 0.0, rng)
+            if len(times) == 0:
+                raise ValueError(f"{spec.instance_name} does not exist in the generated time span")
+            burst = spec.generate_burst()
+            time_length = len(burst) / spec.transmission_rate
+            iq_name = f"{prefix}_{spec.instance_name}.32cf"
+            if output_samples:
+                samples = resample(burst, spec.transmission_rate, source["outputSamplingRate_Hz"])
+                with zip_file.open(_zip_info(iq_name), "w") as f:
+                    f.write(np.ascontiguousarray(samples, dtype=np.complex64).tobytes())
+
+            signal_energies = [
+                {
+                    "report_type": "energy",
+                    "instance_name": f"{spec.instance_name} T_{energy_idx + 1}",
+                    "time_start": float(time_start),
+                    "time_stop": float(time_start + time_length),
+                    "freq_lo": spec.freq_lo,
+                    "freq_hi": spec.freq_hi,
+                    "timeLength_s": time_length,
+                    "bandwidth_Hz": spec.bandwidth,
+                    "signal_index": signal_idx + 1,
+                    "energy_index": energy_idx + 1,
+                    "tx_radio": tx_idx + 1,
+                    "iq_filename": os.path.join(folder, iq_name),
+                }
+                for energy_idx, time_start in enumerate(times)
+            ]
+            energies.extend(signal_energies)
+            time_start, time_stop = float(times.min()), float(times.max() + time_length)
+            report = {
+                "report_type": "signal",
+                "instance_name": spec.instance_name,
+                "protocol": spec.protocol,
+                "modality": spec.modality,
+                "modulation": spec.modulation,
+                "activity_type": "overt_baseline",
+                "time_start": time_start,
+                "time_stop": time_stop,
+                "freq_lo": spec.freq_lo,
+                "freq_hi": spec.freq_hi,
+                "reference_time": (time_start + time_stop) / 2,
+                "reference_freq": spec.center_freq,
+                "timeLength_s": time_stop - time_start,
+                "bandwidth_Hz": spec.bandwidth,
+            }
+            source["signal_set"].append(spec.instance_name)
+            source["signals"].append(
+                {"report": report, "energies": signal_energies, "is_noise": getattr(spec, "is_noise", False)}
+            )
+            logger.info(
+                "%s: %d transmissions of %.6f s on Tx %d", spec.instance_name, len(times), time_length, tx_idx + 1
+            )
+
+        energies.sort(key=lambda energy: energy["time_start"])
+        zip_file.writestr(_zip_info(f"{prefix}_energy_meta.csv"), _csv_text(ENERGY_COLUMNS, energies))
+        signal_rows = [signal["report"] for source in sources for signal in source["signals"]]
+        zip_file.writestr(_zip_info(f"{prefix}_signal_meta.txt"), _csv_text(SIGNAL_COLUMNS, signal_rows))
+        rx_report = {
+            "report_type": "receiver",
+            "instance_name": rx_d.get("name", "rx1"),
+            "sampleRate_Hz": rx_rate,
+            "freqCenter_Hz": rx_center,
+            "location": rx_d.get("location", [0, 0, 0]),
+        }
+        scoring = _scoring_report(sources, rx_report)
+        zip_file.writestr(_zip_info(f"{prefix}_scoring.json"), json.dumps(scoring, indent=4) + "\n")
+
+    logger.info("Wrote %d energies of %d signals to %s", len(energies), len(specs), zip_path)
+    return zip_path
+
+
+def generate_packages(config_filenames, seed: int = None, max_workers: int = None):
+    """
+    Generate the packages of several scenarios in parallel worker processes
+
+    :param config_filenames: Scenario files
+    :type config_filenames: list[str]
+
+    :param seed: Base seed, scenario i uses an independent stream spawned from it
+    :type seed: int or None
+
+    :param max_workers: Worker processes, one per CPU by default
+    :type max_workers: int or None
+
+    :return: Zip path of every scenario, in order
+    :rtype: list[str]
+    """
+    seeds = [None] * len(config_filenames)
+    if seed is not None:
+        seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(len(seeds))]
+    if len(config_filenames) == 1:
+        return [generate_package(config_filenames[0], seeds[0])]
+    with ProcessPoolExecutor(max_workers=max_workers, **log_queue.executor_kwargs()) as executor:
+        futures = [executor.submit(generate_package, *args) for args in zip(config_filenames, seeds)]
+        return [future.result() for future in futures]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Generate compressed data packages from compressed_config.yml files")
+    parser.add_argument("configs", nargs="+", type=str, help="Scenario config files")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of all random draws")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for several scenarios")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(level=logging.INFO)
+    for zip_path in generate_packages(args.configs, args.seed, args.workers):
+        print(zip_path)
+
+
+if __name__ == "__main__":
+    main()
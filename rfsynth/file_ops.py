@@ -0,0 +1,254 @@
+"""
+In-process file operations around a scenario run.
+
+Packages are extracted with :mod:`zipfile`, files are moved with
+``os.replace`` and copied by reflink, hard link or kernel copy
+(``copy_file_range``/``sendfile``) instead of running ``unzip``, ``mv``,
+``cp`` or ``rm`` subprocesses. Files other processes read, like the
+published ground truth, are written to a temporary file in the same
+directory and renamed into place, so a reader sees the old file or the
+complete new one, never a partial write. Deletion of bulk IQ data is
+handed to a background thread with :func:`unlink_later`, keeping it off the
+path between scenarios.
+"""
+
+import atexit
+import errno
+import fcntl
+import json
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# FICLONE from linux/fs.h, a copy on write clone of a whole file
+FICLONE = 0x40049409
+COPY_CHUNK_BYTES = 1 << 30
+
+
+def extract_zip(zip_path: str, folder: str):
+    """
+    Extract a zip file, overwriting existing files like ``unzip -o``
+
+    :param zip_path: Zip file
+    :type zip_path: str
+
+    :param folder: Destination directory, created if needed
+    :type folder: str
+
+    :return: Paths of the extracted files
+    :rtype: list[str]
+    """
+    os.makedirs(folder, exist_ok=True)
+    extracted = []
+    with zipfile.ZipFile(zip_path) as zip_file:
+        for info in zip_file.infolist():
+            path = zip_file.extract(info, folder)
+            if not info.is_dir():
+                extracted.append(path)
+    return extracted
+
+
+def _temp_path(path: str):
+    # Temporary file next to the destination, renaming it is atomic
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", dir=os.path.dirname(path) or ".")
+    os.close(fd)
+    return tmp_path
+
+
+def _copy_contents(src_f, dst_f, size: int):
+    try:
+        fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+        return "reflink"
+    except OSError:
+        pass
+    copied = 0
+    try:
+        copy = os.copy_file_range if hasattr(os, "copy_file_range") else None
+        while copied < size:
+            if copy is not None:
+                count = copy(src_f.fileno(), dst_f.fileno(), min(COPY_CHUNK_BYTES, size - copied))
+            else:
+                count = os.sendfile(dst_f.fileno(), src_f.fileno(), copied, min(COPY_CHUNK_BYTES, size - copied))
+            if count == 0:
+                break
+            copied += count
+        return "kernel copy"
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+            raise
+    # Neither is supported between these files, finish in user space
+    src_f.seek(copied)
+    dst_f.seek(copied)
+    shutil.copyfileobj(src_f, dst_f)
+    return "copy"
+
+
+def copy_file(src: str, dst: str, link: bool = False):
+    """
+    Copy a file and rename the copy into place atomically
+
+    :param src: Source file
+    :type src: str
+
+    :param dst: Destination file, replaced if it exists
+    :type dst: str
+
+    :param link: Hard link instead of copying when possible. Only for files
+        that are replaced, never modified in place, afterwards.
+    :type link: bool
+
+    :return: How the file was copied
+    :rtype: str
+    """
+    tmp_path = _temp_path(dst)
+    try:
+        if link:
+            try:
+                os.unlink(tmp_path)
+                os.link(src, tmp_path)
+                os.replace(tmp_path, dst)
+                return "link"
+            except OSError:
+                # Another file system, copy instead
+                open(tmp_path, "wb").close()
+        with open(src, "rb") as src_f, open(tmp_path, "wb") as dst_f:
+            method = _copy_contents(src_f, dst_f, os.fstat(src_f.fileno()).st_size)
+        shutil.copymode(src, tmp_path)
+        os.replace(tmp_path, dst)
+        return method
+    except BaseException:
+        if os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def move_file(src: str, dst: str):
+    """
+    Move a file with ``os.replace``, copying it across file systems
+
+    :param src: Source file
+    :type src: str
+
+    :param dst: Destination file, replaced if it exists
+    :type dst: str
+    """
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        copy_file(src, dst)
+        os.unlink(src)
+
+
+def atomic_write_json(path: str, obj, **kwargs):
+    """
+    Write JSON to a temporary file and rename it into place
+
+    :param path: Output file
+    :type path: str
+
+    :param obj: Object to write
+    :type obj: dict or list
+
+    :param kwargs: Passed to json.dump
+    """
+    tmp_path = _temp_path(path)
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(obj, f, **kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class BackgroundUnlinker:
+    """
+    Deletes files and directory trees on a background thread. Pending
+    deletions are finished when the process exits.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+        # A forked child has no unlinker thread, it starts its own
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _run(self):
+        while True:
+            paths = self._queue.get()
+            if paths is None:
+                return
+            for path in paths:
+                try:
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning("Cannot remove %s: %s", path, e)
+            self._queue.task_done()
+
+    def unlink(self, paths):
+        """
+        Queue files or directories for deletion
+
+        :param paths: Paths to delete
+        :type paths: iterable of str
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="unlinker", daemon=True)
+                self._thread.start()
+        self._queue.put(list(paths))
+
+    def wait(self):
+        """Block until the queued deletions are done"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+_unlinker = BackgroundUnlinker()
+
+
+def unlink_later(paths):
+    """
+    Delete files or directory trees on the shared background thread
+
+    :param paths: Paths to delete
+    :type paths: iterable of str
+    """
+    _unlinker.unlink(paths)
+
+
+def wait_unlinked():
+    """Block until every deletion queued with unlink_later is done"""
+    _unlinker.wait()
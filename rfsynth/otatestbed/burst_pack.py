@@ -0,0 +1,303 @@
+"""
+Burst pack: many IQ bursts in one file with an offset index.
+
+The compressed engine writes one small ``.32cf`` file per signal instance
+plus an energy CSV, and the transmitter opens and reads a file every time
+``iq_filename`` changes. A burst pack holds all of them in one file::
+
+    header      PACK_HEADER, padded to ALIGN_BYTES
+    data        complex64 bursts, each starting on an ALIGN_BYTES boundary
+    index       INDEX_DTYPE record per burst
+    names       JSON list with the name of every burst
+
+Offsets in the index count complex64 samples from the start of the file, so
+the whole file can be memory mapped as complex64 once and any burst sliced in
+O(1). The same offsets go into the ``iq_offset``/``iq_length`` columns of the
+rewritten energy CSV, which the transmitter understands for any IQ file.
+
+Convert a compressed engine output with::
+
+    python -m rfsynth.otatestbed.burst_pack output.zip /tmp/scenario.bpk --sample-rate 100e6
+"""
+
+import argparse
+import io
+import json
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+PACK_EXTENSION = ".bpk"
+PACK_MAGIC = b"RFSBPACK"
+PACK_VERSION = 1
+# magic, version, reserved, num_bursts, index offset, names offset, names length, sample rate
+PACK_HEADER = struct.Struct("<8sIIQQQQd")
+ALIGN_BYTES = 4096
+SAMPLE_BYTES = np.dtype(np.complex64).itemsize
+COPY_CHUNK_BYTES = 1 << 24
+
+INDEX_DTYPE = np.dtype(
+    [
+        ("burst_id", np.int64),
+        ("offset", np.int64),  # complex64 samples from the start of the file
+        ("length", np.int64),
+        ("peak", np.float32),
+        ("center_freq", np.float64),
+        ("bandwidth", np.float64),
+    ]
+)
+
+
+def is_burst_pack(filepath: str):
+    return str(filepath).endswith(PACK_EXTENSION)
+
+
+def _align(num_bytes):
+    return -(-num_bytes // ALIGN_BYTES) * ALIGN_BYTES
+
+
+class BurstPackWriter:
+    """
+    Writes a burst pack one burst at a time. The pack is written to a
+    temporary file and moved into place on close.
+
+    :param pack_path: Output file
+    :type pack_path: str
+
+    :param sample_rate: Sample rate of the bursts
+    :type sample_rate: float
+    """
+
+    def __init__(self, pack_path: str, sample_rate: float):
+        self.pack_path = pack_path
+        self.sample_rate = sample_rate
+        self._tmp_path = f"{pack_path}.{os.getpid()}.tmp"
+        self._f = open(self._tmp_path, "wb")
+        self._f.truncate(ALIGN_BYTES)
+        self._f.seek(ALIGN_BYTES)
+        self._records = []
+        self.names = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._f.close()
+            os.remove(self._tmp_path)
+
+    def add(self, name: str, chunks, center_freq: float = 0.0, bandwidth: float = 0.0):
+        """
+        Append a burst
+
+        :param name: Name of the burst, usually its original IQ file name
+        :type name: str
+
+        :param chunks: Samples of the burst, an array or an iterable of arrays
+        :type chunks: np.ndarray or iterable
+
+        :param center_freq: Center frequency of the burst
+        :type center_freq: float
+
+        :param bandwidth: Bandwidth of the burst
+        :type bandwidth: float
+
+        :return: Index record of the burst
+        :rtype: tuple
+        """
+        if isinstance(chunks, np.ndarray):
+            chunks = [chunks]
+        start = self._f.tell()
+        length = 0
+        peak = 0.0
+        for chunk in chunks:
+            chunk = np.asarray(chunk, dtype=np.complex64)
+            if len(chunk):
+                peak = max(peak, float(np.max(np.abs(chunk))))
+            chunk.tofile(self._f)
+            length += len(chunk)
+        # Next burst starts on an aligned boundary
+        self._f.seek(_align(self._f.tell()))
+
+        record = (len(self._records), start // SAMPLE_BYTES, length, peak, center_freq, bandwidth)
+        self._records.append(record)
+        self.names.append(name)
+        return record
+
+    def close(self):
+        index = np.array(self._records, dtype=INDEX_DTYPE)
+        index_offset = self._f.tell()
+        self._f.truncate(index_offset)
+        index.tofile(self._f)
+        names = json.dumps(self.names).encode()
+        names_offset = self._f.tell()
+        self._f.write(names)
+        # Whole number of samples, so the file can be mapped as complex64
+        self._f.write(b"\0" * (-self._f.tell() % SAMPLE_BYTES))
+
+        self._f.seek(0)
+        self._f.write(
+            PACK_HEADER.pack(
+                PACK_MAGIC,
+                PACK_VERSION,
+                0,
+                len(index),
+                index_offset,
+                names_offset,
+                len(names),
+                self.sample_rate,
+            )
+        )
+        self._f.close()
+        os.replace(self._tmp_path, self.pack_path)
+
+
+class BurstPack:
+    """
+    Read access to a burst pack, memory mapped once
+
+    :param pack_path: Burst pack file
+    :type pack_path: str
+    """
+
+    def __init__(self, pack_path: str):
+        self.pack_path = pack_path
+        with open(pack_path, "rb") as f:
+            header = PACK_HEADER.unpack(f.read(PACK_HEADER.size))
+            (magic, version, _, num_bursts, index_offset, names_offset, names_len, sample_rate) = header
+            if magic != PACK_MAGIC:
+                raise ValueError(f"{pack_path} is not a burst pack")
+            if version != PACK_VERSION:
+                raise ValueError(f"{pack_path} has unsupported burst pack version {version}")
+            f.seek(names_offset)
+            self.names = json.loads(f.read(names_len).decode())
+        self.sample_rate = sample_rate
+        self.index = np.fromfile(pack_path, dtype=INDEX_DTYPE, count=num_bursts, offset=index_offset)
+        self._data = np.memmap(pack_path, dtype=np.complex64, mode="r")
+        self._ids_by_name = {name: burst_id for burst_id, name in enumerate(self.names)}
+        # Offsets are increasing, which find relies on
+        self._offsets = self.index["offset"]
+
+    def __len__(self):
+        return len(self.index)
+
+    def burst_id(self, burst):
+        """Id of a burst given by id or name"""
+        if isinstance(burst, str):
+            if burst not in self._ids_by_name:
+                # Accept the full original path as well as the stored name
+                burst = os.path.basename(burst)
+            return self._ids_by_name[burst]
+        return int(burst)
+
+    def __getitem__(self, burst):
+        """Read-only view of the samples of a burst, by id or name"""
+        record = self.index[self.burst_id(burst)]
+        return self.read(record["offset"], record["length"])
+
+    def read(self, sample_offset: int, num_samples: int = None):
+        """Read-only view of num_samples samples from sample_offset"""
+        stop = None if num_samples is None else sample_offset + num_samples
+        return self._data[sample_offset:stop]
+
+    def find(self, sample_offset: int):
+        """
+        Burst starting at sample_offset
+
+        :return: Index record of the burst, None if no burst starts there
+        :rtype: np.void or None
+        """
+        pos = np.searchsorted(self._offsets, sample_offset)
+        if pos < len(self._offsets) and self._offsets[pos] == sample_offset:
+            return self.index[pos]
+        return None
+
+
+def _read_zip_member(zip_file, member, chunk_bytes=COPY_CHUNK_BYTES):
+    # Chunks of complex64 samples, a sample may straddle two reads
+    with zip_file.open(member) as f:
+        leftover = b""
+        while True:
+            data = f.read(chunk_bytes)
+            if not data:
+                break
+            data = leftover + data
+            usable = len(data) - len(data) % SAMPLE_BYTES
+            leftover = data[usable:]
+            yield np.frombuffer(data[:usable], dtype=np.complex64)
+
+
+def convert_compressed_output(zip_path: str, pack_path: str, sample_rate: float, csv_path: str = None):
+    """
+    Convert the zip output of the compressed engine (IQ files and an energy
+    CSV) into a burst pack and an energy CSV pointing into it
+
+    :param zip_path: Compressed engine output
+    :type zip_path: str
+
+    :param pack_path: Output burst pack
+    :type pack_path: str
+
+    :param sample_rate: Sample rate of the IQ files
+    :type sample_rate: float
+
+    :param csv_path: Output energy CSV, next to the pack by default
+    :type csv_path: str or None
+
+    :return: Path of the rewritten energy CSV
+    :rtype: str
+    """
+    import pandas as pd
+
+    with zipfile.ZipFile(zip_path) as zip_file:
+        members = {os.path.basename(m): m for m in zip_file.namelist() if not m.endswith("/")}
+        csv_members = [m for m in members if m.endswith(".csv")]
+        if len(csv_members) != 1:
+            raise ValueError(f"{zip_path} should hold exactly one energy CSV, found {csv_members}")
+        with zip_file.open(members[csv_members[0]]) as f:
+            df = pd.read_csv(io.TextIOWrapper(f))
+
+        offsets = {}
+        with BurstPackWriter(pack_path, sample_rate) as writer:
+            for iq_filename, rows in df.groupby("iq_filename", sort=False):
+                name = os.path.basename(iq_filename)
+                if name not in members:
+                    raise ValueError(f"{zip_path} does not hold {name} from the energy CSV")
+                first = rows.iloc[0]
+                if "bandwidth_Hz" in rows.columns:
+                    bandwidth = first.bandwidth_Hz
+                else:
+                    bandwidth = first.freq_hi - first.freq_lo
+                record = writer.add(
+                    name,
+                    _read_zip_member(zip_file, members[name]),
+                    (first.freq_lo + first.freq_hi) / 2,
+                    bandwidth,
+                )
+                offsets[iq_filename] = record[1:3]
+
+    df["iq_offset"] = df.iq_filename.map(lambda name: offsets[name][0])
+    df["iq_length"] = df.iq_filename.map(lambda name: offsets[name][1])
+    df["iq_filename"] = os.path.abspath(pack_path)
+    if csv_path is None:
+        csv_path = os.path.splitext(pack_path)[0] + "_energy_meta.csv"
+    df.to_csv(csv_path, index=False)
+    return csv_path
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Convert compressed engine output into a burst pack")
+    parser.add_argument("zip", type=str, help="Compressed engine output")
+    parser.add_argument("pack", type=str, help="Output burst pack")
+    parser.add_argument("--sample-rate", type=float, required=True, help="Sample rate of the IQ files")
+    parser.add_argument("--csv", type=str, default=None, help="Output energy CSV")
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    print(convert_compressed_output(args.zip, args.pack, args.sample_rate, args.csv))
@@ -0,0 +1,569 @@
+"""
+Software RF channel for running the testbed without radios.
+
+:class:`ChannelEmulator` stands in for the air between the transmit and
+receive radios. Its :meth:`~ChannelEmulator.transmitter_flowgraph` and
+:meth:`~ChannelEmulator.receiver_flowgraph` build objects with the
+interface of ``transmitter_flowgraph`` and ``receiver_flowgraph``, to be
+passed to :class:`~rfsynth.otatestbed.transmitter.Transmitter` and
+:class:`~rfsynth.otatestbed.receiver.Receiver` (or to
+:class:`~rfsynth.otatestbed.otaTestbed.OtaTestbed` as a whole). Every
+transmitter start is recorded with its host time; a receiver's capture is
+rendered when its samples are read, by passing every emission through its
+link and adding receiver noise.
+
+A link, from a transmit channel to a receive channel, has a delay, a path
+loss, a carrier frequency offset, a sample rate offset and optional
+multipath taps (:class:`LinkParams`). The difference between the transmit
+and receive center frequencies is added to the CFO. Links are rendered
+chunk by chunk with NumPy: sample rate offset and fractional delay by
+linear interpolation, taps by convolution with the tail carried across
+chunks, CFO by a mixer at the absolute capture index. Emulated radios
+finish at once, so a collection runs as fast as the rendering.
+
+What each link did is kept by :meth:`~ChannelEmulator.ground_truth`, and
+:meth:`~ChannelEmulator.score_detections` compares it with the preamble
+detections of a collection.
+
+The emulator is built from a dictionary (or JSON file) like::
+
+    {
+        "seed": 0,
+        "noisePowerDb": -60,
+        "default": {"delayS": 1e-6, "pathLossDb": 20, "cfoHz": 0, "sroPpm": 0},
+        "links": [
+            {"tx": [0, 0], "rx": [0, 0], "cfoHz": 1200, "sroPpm": 2, "taps": [[1, 0], [0, 0], [0.3, 0.1]]}
+        ]
+    }
+"""
+
+from dataclasses import dataclass, field, replace
+import json
+import logging
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from rfsynth.otatestbed.sample_format import CPU_FC32, CPU_SC16, SC16_FULL_SCALE, to_sc16
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+DEFAULT_NOISE_POWER_DB = -60.0
+# Links further off the receiver's center than this fraction of its rate are out of band
+MAX_OFFSET_FRACTION = 0.5
+
+
+@dataclass(slots=True)
+class LinkParams:
+    delay_s: float = 0.0
+    path_loss_db: float = 0.0
+    cfo_hz: float = 0.0
+    sro_ppm: float = 0.0  # transmitter sample clock error relative to the receiver's
+    taps: Optional[np.ndarray] = None  # complex multipath taps at the receiver's rate
+
+    @classmethod
+    def from_dict(cls, link_d: dict, base=None):
+        """
+        Build link parameters from their JSON dictionary
+
+        :param link_d: Link dictionary, keys that are missing come from base
+        :type link_d: dict
+
+        :param base: Defaults of the link
+        :type base: LinkParams or None
+
+        :return: The link parameters
+        :rtype: LinkParams
+        """
+        params = replace(base) if base is not None else cls()
+        params.delay_s = link_d.get("delayS", params.delay_s)
+        params.path_loss_db = link_d.get("pathLossDb", params.path_loss_db)
+        params.cfo_hz = link_d.get("cfoHz", params.cfo_hz)
+        params.sro_ppm = link_d.get("sroPpm", params.sro_ppm)
+        if "taps" in link_d:
+            taps = np.asarray(link_d["taps"], dtype=np.float64)
+            # Taps are given as [re, im] pairs or as real numbers
+            params.taps = taps[:, 0] + 1j * taps[:, 1] if taps.ndim == 2 else taps.astype(np.complex128)
+        return params
+
+    @property
+    def gain(self):
+        return 10 ** (-self.path_loss_db / 20)
+
+
+@dataclass(slots=True)
+class Emission:
+    """Samples played by one transmit channel, from a host time on"""
+
+    tx_idx: int
+    channel_num: int
+    host_time: float
+    samples: np.ndarray
+    sample_rate: float
+    center_freq: float
+
+
+@dataclass(slots=True)
+class _Capture:
+    rx_idx: int
+    channel_num: int
+    host_time: float
+    num_samples: int
+    sample_rate: float
+    center_freq: float
+    data: Optional[np.ndarray] = None
+    truth: List[dict] = field(default_factory=list)
+
+
+def render_link(
+    capture,
+    samples,
+    arrival: float,
+    step: float,
+    params: LinkParams,
+    offset_hz: float,
+    sample_rate: float,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+):
+    """
+    Add transmitted samples, as received over a link, into a capture
+
+    :param capture: Received samples, added to in place
+    :type capture: np.ndarray
+
+    :param samples: Transmitted samples
+    :type samples: np.ndarray
+
+    :param arrival: Capture index, fractional, at which the first sample arrives
+    :type arrival: float
+
+    :param step: Transmitted samples per captured sample
+    :type step: float
+
+    :param params: Link parameters
+    :type params: LinkParams
+
+    :param offset_hz: Frequency offset of the link, CFO included
+    :type offset_hz: float
+
+    :param sample_rate: Sample rate of the capture
+    :type sample_rate: float
+
+    :param chunk_size: Captured samples rendered per step
+    :type chunk_size: int
+    """
+    samples = np.asarray(samples)
+    if len(samples) == 0:
+        return capture
+    taps = params.taps
+    num_taps = 0 if taps is None else len(taps)
+    first = max(0, int(np.ceil(arrival)))
+    stop = min(len(capture), int(np.floor(arrival + (len(samples) - 1) / step)) + 1 + max(0, num_taps - 1))
+    tail = np.zeros(max(0, num_taps - 1), dtype=np.complex128)
+    cycles_per_sample = offset_hz / sample_rate
+    for start in range(first, stop, chunk_size):
+        chunk_stop = min(start + chunk_size, stop)
+        idx = np.arange(start, chunk_stop, dtype=np.float64)
+        # Sample rate offset and fractional delay, by linear interpolation
+        pos = (idx - arrival) * step
+        valid = (pos >= 0) & (pos <= len(samples) - 1)
+        base = np.clip(pos.astype(np.int64), 0, len(samples) - 1)
+        nxt = np.minimum(base + 1, len(samples) - 1)
+        frac = pos - base
+        chunk = np.where(valid, samples[base] * (1 - frac) + samples[nxt] * frac, 0)
+        if num_taps:
+            full = np.convolve(chunk, taps)
+            full[: len(tail)] += tail
+            tail = full[len(chunk) :]
+            chunk = full[: len(chunk)]
+        if cycles_per_sample:
+            # Mixer phase at the absolute capture index, wrapped in float64
+            chunk = chunk * np.exp(2j * np.pi * ((idx * cycles_per_sample) % 1.0))
+        capture[start:chunk_stop] += params.gain * chunk
+    return capture
+
+
+class ChannelEmulator:
+    """
+    Emulated air between the transmit and receive radios
+
+    :param links: Parameters per (tx radio, tx channel, rx radio, rx channel)
+    :type links: dict or None
+
+    :param default_link: Parameters of the links not listed
+    :type default_link: LinkParams or None
+
+    :param noise_power_db: Receiver noise power per sample, in dB full scale
+    :type noise_power_db: float
+
+    :param seed: Seed of the receiver noise
+    :type seed: int
+
+    :param chunk_size: Captured samples rendered per step
+    :type chunk_size: int
+    """
+
+    def __init__(
+        self,
+        links=None,
+        default_link: LinkParams = None,
+        noise_power_db: float = DEFAULT_NOISE_POWER_DB,
+        seed: int = 0,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ):
+        self.links = dict(links or {})
+        self.default_link = default_link or LinkParams()
+        self.noise_power_db = noise_power_db
+        self.chunk_size = chunk_size
+        self.rng = np.random.default_rng(seed)
+        self.emissions = []
+        self._num_transmitters = 0
+        self._num_receivers = 0
+        self._captures = {}
+
+    @classmethod
+    def from_dict(cls, config_d: dict):
+        """
+        Build an emulator from its JSON dictionary, see the module docstring
+
+        :rtype: ChannelEmulator
+        """
+        default_link = LinkParams.from_dict(config_d.get("default", {}))
+        links = {}
+        for link_d in config_d.get("links", []):
+            key = tuple(link_d["tx"]) + tuple(link_d["rx"])
+            links[key] = LinkParams.from_dict(link_d, default_link)
+        return cls(
+            links,
+            default_link,
+            noise_power_db=config_d.get("noisePowerDb", DEFAULT_NOISE_POWER_DB),
+            seed=config_d.get("seed", 0),
+            chunk_size=config_d.get("chunkSize", DEFAULT_CHUNK_SIZE),
+        )
+
+    @classmethod
+    def from_file(cls, config_filename: str):
+        with open(config_filename, "r") as f:
+            return cls.from_dict(json.load(f))
+
+    def link(self, tx_idx, tx_channel, rx_idx, rx_channel):
+        return self.links.get((tx_idx, tx_channel, rx_idx, rx_channel), self.default_link)
+
+    def transmitter_flowgraph(self, **kwargs):
+        """Flowgraph of the next transmit radio, takes the arguments of transmitter_flowgraph"""
+        flowgraph = EmulatedTransmitterFlowgraph(self, self._num_transmitters, **kwargs)
+        self._num_transmitters += 1
+        return flowgraph
+
+    def receiver_flowgraph(self, **kwargs):
+        """Flowgraph of the next receive radio, takes the arguments of receiver_flowgraph"""
+        flowgraph = EmulatedReceiverFlowgraph(self, self._num_receivers, **kwargs)
+        self._num_receivers += 1
+        return flowgraph
+
+    def emit(self, emission: Emission):
+        self.emissions.append(emission)
+        # Captures rendered before this emission no longer hold everything that was sent
+        for capture in self._captures.values():
+            capture.data = None
+
+    def start_capture(self, rx_idx, channel_num, host_time, num_samples, sample_rate, center_freq):
+        self._captures[(rx_idx, channel_num)] = _Capture(
+            rx_idx, channel_num, host_time, num_samples, sample_rate, center_freq
+        )
+
+    def get_capture(self, rx_idx, channel_num):
+        """
+        Samples received by a receive channel, rendered on first access
+
+        :return: complex64 samples
+        :rtype: np.ndarray
+        """
+        capture = self._captures[(rx_idx, channel_num)]
+        if capture.data is None:
+            self._render(capture)
+        return capture.data
+
+    def _render(self, capture):
+        noise_std = np.sqrt(10 ** (self.noise_power_db / 10) / 2)
+        data = np.empty(capture.num_samples, dtype=np.complex128)
+        # Noise is drawn chunk by chunk to bound the temporaries
+        for start in range(0, capture.num_samples, self.chunk_size):
+            stop = min(start + self.chunk_size, capture.num_samples)
+            data[start:stop].real = self.rng.standard_normal(stop - start) * noise_std
+            data[start:stop].imag = self.rng.standard_normal(stop - start) * noise_std
+
+        capture.truth = []
+        for emission in self.emissions:
+            params = self.link(emission.tx_idx, emission.channel_num, capture.rx_idx, capture.channel_num)
+            offset_hz = emission.center_freq - capture.center_freq + params.cfo_hz
+            if abs(offset_hz) >= MAX_OFFSET_FRACTION * capture.sample_rate:
+                continue
+            arrival = (emission.host_time - capture.host_time + params.delay_s) * capture.sample_rate
+            step = emission.sample_rate * (1 + params.sro_ppm * 1e-6) / capture.sample_rate
+            render_link(
+                data, emission.samples, arrival, step, params, offset_hz, capture.sample_rate, self.chunk_size
+            )
+            capture.truth.append(
+                {
+                    "tx": [emission.tx_idx, emission.channel_num],
+                    "rx": [capture.rx_idx, capture.channel_num],
+                    "arrival_idx": arrival,
+                    "arrival_s": arrival / capture.sample_rate,
+                    "num_samples": len(emission.samples),
+                    "delay_s": params.delay_s,
+                    "path_loss_db": params.path_loss_db,
+                    "offset_hz": offset_hz,
+                    "sro_ppm": params.sro_ppm,
+                    "num_taps": 0 if params.taps is None else len(params.taps),
+                }
+            )
+        capture.data = data.astype(np.complex64)
+        logger.debug(
+            "Rendered Rx %d:%d, %d samples from %d emissions",
+            capture.rx_idx,
+            capture.channel_num,
+            capture.num_samples,
+            len(capture.truth),
+        )
+
+    def ground_truth(self):
+        """
+        What every link delivered to the captures rendered so far
+
+        :return: One record per emission and receive channel
+        :rtype: list[dict]
+        """
+        return [truth for capture in self._captures.values() for truth in capture.truth]
+
+    def score_detections(self, preambles):
+        """
+        Compare preamble detections with the ground truth. Emissions are
+        matched by their transmit and receive channels; the preamble is the
+        first thing every emission sends.
+
+        :param preambles: Preambles after Preamble.remove and set_sync_estimate
+        :type preambles: list[Preamble]
+
+        :return: One record per preamble, with the timing error in samples and
+            the CFO error in Hz, None when it was not detected
+        :rtype: list[dict]
+        """
+        truths = {}
+        for truth in self.ground_truth():
+            truths.setdefault(tuple(truth["tx"] + truth["rx"]), truth)
+        scores = []
+        for preamble in preambles:
+            truth = truths.get(tuple(preamble.tx_rx_id))
+            score = {"tx_rx_id": list(preamble.tx_rx_id), "detected": preamble.sliced_seq is not None}
+            if truth is not None and score["detected"]:
+                estimate = preamble._max_peak_idx[0] + getattr(preamble, "frac_delay", 0.0)
+                score["timing_error_samples"] = float(estimate - truth["arrival_idx"])
+                if hasattr(preamble, "cfo_est"):
+                    score["cfo_error_hz"] = preamble.cfo_est - truth["offset_hz"]
+            scores.append(score)
+        return scores
+
+
+class EmulatedTransmitterFlowgraph:
+    """
+    Transmit radio of a ChannelEmulator, with the interface of transmitter_flowgraph.
+    Create through ChannelEmulator.transmitter_flowgraph.
+    """
+
+    def __init__(
+        self,
+        emulator,
+        tx_idx,
+        address,
+        clock_rate,
+        sample_rate,
+        num_channels,
+        subdev_spec,
+        streaming=False,
+        cpu_format=CPU_FC32,
+    ):
+        self.emulator = emulator
+        self.tx_idx = tx_idx
+        self.address = address
+        self.clock_rate = clock_rate
+        self.sample_rate = sample_rate
+        self.num_channels = num_channels
+        self.subdev_spec = subdev_spec
+        self.streaming = streaming
+        self.cpu_format = cpu_format
+        self.antennas = {}
+        self.gains = {}
+        self.center_freqs = {}
+        self.channel_data = {}
+        self._tune_commands = {}  # channel -> [(device time, center frequency)]
+        self._start_time = None
+
+    def configure_channel(self, antenna, gain, center_freq, channel_num):
+        self.antennas[channel_num] = antenna
+        self.gains[channel_num] = gain
+        self.center_freqs[channel_num] = center_freq
+
+    def set_vector_source_data(self, data, channel_num):
+        data = np.asarray(data)
+        if data.dtype == np.int16:
+            # int16 pairs from the sc16 path
+            data = data.reshape(-1, 2)
+            data = (data[:, 0] + 1j * data[:, 1]) / SC16_FULL_SCALE
+        self.channel_data[channel_num] = data
+
+    def set_stream_segment(
+        self, filepath, channel_num, sample_offset=0, length=None, scale=1.0, offset_hz=0.0, impairments=None
+    ):
+        from rfsynth.otatestbed.iq_reader import open_iq_reader
+        from rfsynth.otatestbed.nco import frequency_shift
+
+        reader = open_iq_reader(filepath)
+        length = reader.num_samples - sample_offset if length is None else length
+        data = np.asarray(reader.read(sample_offset, length), dtype=np.complex64) * scale
+        if offset_hz != 0:
+            frequency_shift(data, offset_hz, self.sample_rate, out=data)
+        if impairments is not None:
+            impairments.reset()
+            impairments.process(data, out=data)
+        self.channel_data[channel_num] = data
+
+    def get_stream_stats(self, channel_num):
+        return {}
+
+    def reset_flowgraph(self):
+        pass
+
+    def set_time_now(self):
+        return time.time()
+
+    def get_time_difference(self):
+        return 0.0
+
+    def get_time_pair(self):
+        # The emulated device runs on host time
+        host_time = time.time()
+        return host_time, host_time, 0.0
+
+    def timed_start(self, time_start):
+        self._start_time = time_start
+        self.start()
+
+    def timed_tune_channel(self, center_freq, cmd_time, channel_idx, lo_freq=None):
+        self._tune_commands.setdefault(channel_idx, []).append((cmd_time, center_freq))
+
+    def timed_tune_batch(self, commands, channel_idx):
+        for center_freq, cmd_time, lo_freq in commands:
+            self.timed_tune_channel(center_freq, cmd_time, channel_idx, lo_freq)
+
+    def _center_freq_at(self, channel_num, host_time):
+        # Apply the timed tunes due by host_time, a retune within a burst is not emulated
+        commands = self._tune_commands.get(channel_num, [])
+        due = [command for command in commands if command[0] <= host_time]
+        if due:
+            self.center_freqs[channel_num] = max(due, key=lambda command: command[0])[1]
+            self._tune_commands[channel_num] = [command for command in commands if command[0] > host_time]
+        return self.center_freqs[channel_num]
+
+    def start(self):
+        host_time = time.time() if self._start_time is None else self._start_time
+        self._start_time = None
+        for channel_num, data in self.channel_data.items():
+            center_freq = self._center_freq_at(channel_num, host_time)
+            self.emulator.emit(
+                Emission(self.tx_idx, channel_num, host_time, data, self.sample_rate, center_freq)
+            )
+
+    def wait(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def print_radio_settings(self):
+        print("Emulated Radio Settings:")
+        print("Transmitter index:", self.tx_idx)
+        print("Sampling Rate:", self.sample_rate)
+        print("Number of Channels:", self.num_channels)
+        print()
+
+    def print_channel_settings(self, channel_num):
+        print("Channel", channel_num, "Settings:")
+        print("Antenna:", self.antennas.get(channel_num))
+        print("Center Frequency:", self.center_freqs.get(channel_num))
+        print("Normalized Gain:", self.gains.get(channel_num))
+        print()
+
+
+class EmulatedReceiverFlowgraph:
+    """
+    Receive radio of a ChannelEmulator, with the interface of receiver_flowgraph.
+    Create through ChannelEmulator.receiver_flowgraph.
+    """
+
+    def __init__(
+        self,
+        emulator,
+        rx_idx,
+        address,
+        clock_rate,
+        sample_rate,
+        num_channels,
+        subdev_spec,
+        num_seconds_receive,
+        cpu_format=CPU_FC32,
+    ):
+        self.emulator = emulator
+        self.rx_idx = rx_idx
+        self.address = address
+        self.clock_rate = clock_rate
+        self.sample_rate = sample_rate
+        self.num_channels = num_channels
+        self.subdev_spec = subdev_spec
+        self.num_seconds_receive = num_seconds_receive
+        self.cpu_format = cpu_format
+        self.antennas = {}
+        self.gains = {}
+        self.center_freqs = {}
+
+    def configure_channel(self, antenna, gain, center_freq, channel_num):
+        self.antennas[channel_num] = antenna
+        self.gains[channel_num] = gain
+        self.center_freqs[channel_num] = center_freq
+
+    def start(self):
+        host_time = time.time()
+        num_items = int(self.sample_rate * self.num_seconds_receive)
+        for channel_num, center_freq in self.center_freqs.items():
+            self.emulator.start_capture(
+                self.rx_idx, channel_num, host_time, num_items, self.sample_rate, center_freq
+            )
+
+    def wait(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def get_vector_sink_data(self, channel_num):
+        data = self.emulator.get_capture(self.rx_idx, channel_num)
+        if self.cpu_format == CPU_SC16:
+            return to_sc16(data)
+        return data
+
+    def print_radio_settings(self):
+        print("Emulated Radio Settings:")
+        print("Receiver index:", self.rx_idx)
+        print("Sampling Rate:", self.sample_rate)
+        print("Number of Channels:", self.num_channels)
+        print("Number of seconds to receive:", self.num_seconds_receive)
+        print()
+
+    def print_channel_settings(self, channel_num):
+        print("Channel", channel_num, "Settings:")
+        print("Antenna:", self.antennas.get(channel_num))
+        print("Center Frequency:", self.center_freqs.get(channel_num))
+        print("Normalized Gain:", self.gains.get(channel_num))
+        print()
@@ -0,0 +1,194 @@
+"""
+Host to device clock discipline for the transmit radios.
+
+Device time is set from ``time.time()`` once, which leaves an offset of a few
+milliseconds (the set call itself takes ~2.2 ms) and the device oscillator
+drifts away from the host clock afterwards. Without PPS hardware, radios
+driven from the same host stay aligned only if every scheduled time is
+converted from host time to the device's own time base.
+
+:class:`ClockDiscipline` collects (host time, device time) pairs, sampled
+periodically, and fits ``device - host = offset + drift * (host - t_ref)`` by
+least squares over a sliding window. Pairs with a long read round trip are
+left out of the fit as they carry more jitter. The fit residuals are kept as
+metrics. :class:`SimulatedDriftingClock` produces pairs from a known offset,
+drift and jitter, to check the estimator without a radio.
+"""
+
+from collections import deque
+import time
+
+import numpy as np
+
+DEFAULT_WINDOW = 64
+DEFAULT_SAMPLE_INTERVAL_S = 1.0
+# Pairs whose round trip exceeds this multiple of the window's median are not fitted
+ROUND_TRIP_REJECT_FACTOR = 2.0
+
+
+class ClockDiscipline:
+    """
+    Least squares estimate of the offset and drift of a device clock.
+
+    :param window: Number of most recent pairs used for the fit
+    :type window: int
+
+    :param sample_interval_s: Host time between periodic samples, see due
+    :type sample_interval_s: float
+    """
+
+    def __init__(self, window: int = DEFAULT_WINDOW, sample_interval_s: float = DEFAULT_SAMPLE_INTERVAL_S):
+        self.window = max(2, window)
+        self.sample_interval_s = sample_interval_s
+        self._samples = deque(maxlen=self.window)  # (host_time, device_time, round_trip)
+        self.t_ref = None
+        self.offset = 0.0
+        self.drift = 0.0
+        self.residuals = np.zeros(0)
+        self._last_sample_time = None
+
+    @classmethod
+    def from_config(cls, radio_config):
+        """
+        Build a clock discipline from the optional ``clockDiscipline`` entry of a radio config
+
+        :param radio_config: Radio configuration
+        :type radio_config: RadioConfig
+
+        :return: The clock discipline
+        :rtype: ClockDiscipline
+        """
+        policy = radio_config.clock_discipline
+        return cls(
+            window=policy.get("window", DEFAULT_WINDOW),
+            sample_interval_s=policy.get("sampleIntervalS", DEFAULT_SAMPLE_INTERVAL_S),
+        )
+
+    @property
+    def num_samples(self):
+        return len(self._samples)
+
+    def due(self, host_time: float = None):
+        """Check if the next periodic sample is due"""
+        if self._last_sample_time is None:
+            return True
+        host_time = time.time() if host_time is None else host_time
+        return host_time - self._last_sample_time >= self.sample_interval_s
+
+    def add_sample(self, host_time: float, device_time: float, round_trip: float = 0.0):
+        """
+        Add a (host time, device time) pair and refit
+
+        :param host_time: Host time the device time was read at, ideally the
+            middle of the read
+        :type host_time: float
+
+        :param device_time: Device time read
+        :type device_time: float
+
+        :param round_trip: Host time the read took
+        :type round_trip: float
+        """
+        if self.t_ref is None:
+            self.t_ref = host_time
+        self._samples.append((host_time, device_time, round_trip))
+        self._last_sample_time = host_time
+        self._fit()
+
+    def _fit(self):
+        samples = np.array(self._samples, dtype=np.float64)
+        # Relative values keep the fit well conditioned with epoch sized times
+        x = samples[:, 0] - self.t_ref
+        y = samples[:, 1] - samples[:, 0]
+        round_trip = samples[:, 2]
+
+        use = round_trip <= ROUND_TRIP_REJECT_FACTOR * np.median(round_trip)
+        if np.count_nonzero(use) < 2 or np.ptp(x[use]) == 0:
+            # A single usable pair only gives the offset
+            self.offset = float(np.mean(y[use]))
+            self.drift = 0.0
+        else:
+            self.drift, self.offset = np.polyfit(x[use], y[use], 1)
+        self.residuals = y - (self.offset + self.drift * x)
+
+    def to_device(self, host_time):
+        """
+        Convert host time to device time
+
+        :param host_time: Host time(s)
+        :type host_time: float or np.ndarray
+
+        :return: Device time(s)
+        :rtype: float or np.ndarray
+        """
+        if self.t_ref is None:
+            return host_time
+        return host_time + self.offset + self.drift * (host_time - self.t_ref)
+
+    def to_host(self, device_time):
+        """Convert device time back to host time"""
+        if self.t_ref is None:
+            return device_time
+        return (device_time - self.offset + self.drift * self.t_ref) / (1 + self.drift)
+
+    def metrics(self):
+        """
+        Current estimate and fit residuals
+
+        :return: offset_s, drift_ppm, rms and max absolute residual in seconds
+            and the number of pairs in the window
+        :rtype: dict
+        """
+        residuals = self.residuals
+        return {
+            "offset_s": float(self.offset),
+            "drift_ppm": float(self.drift * 1e6),
+            "rms_residual_s": float(np.sqrt(np.mean(residuals**2))) if len(residuals) else None,
+            "max_residual_s": float(np.max(np.abs(residuals))) if len(residuals) else None,
+            "num_samples": self.num_samples,
+        }
+
+
+class SimulatedDriftingClock:
+    """
+    Device clock with a known offset, drift and read jitter, for checking the
+    estimator. Device time is offset_s + (1 + drift) * host time.
+
+    :param offset_s: Offset of the device clock at host time 0
+    :type offset_s: float
+
+    :param drift_ppm: Drift of the device clock
+    :type drift_ppm: float
+
+    :param jitter_s: Standard deviation of the host side read timing
+    :type jitter_s: float
+
+    :param seed: Seed of the jitter generator
+    :type seed: int or None
+    """
+
+    def __init__(self, offset_s: float = 0.0, drift_ppm: float = 0.0, jitter_s: float = 0.0, seed=None):
+        self.offset_s = offset_s
+        self.drift = drift_ppm * 1e-6
+        self.jitter_s = jitter_s
+        self._rng = np.random.default_rng(seed)
+
+    def device_time(self, host_time):
+        """True device time at a host time"""
+        return host_time + self.offset_s + self.drift * host_time
+
+    def get_time_pair(self, host_time: float = None):
+        """
+        Read the device clock like transmitter_flowgraph.get_time_pair does
+
+        :param host_time: Host time of the read, time.time() when None
+        :type host_time: float or None
+
+        :return: Host time, device time and round trip of the read
+        :rtype: tuple[float, float, float]
+        """
+        host_time = time.time() if host_time is None else host_time
+        round_trip = abs(self._rng.normal(0.0, self.jitter_s)) if self.jitter_s else 0.0
+        # The device is read somewhere inside the round trip, not at its middle
+        read_at = host_time + self._rng.uniform(-0.5, 0.5) * round_trip
+        return host_time, self.device_time(read_at), round_trip
@@ -1,56 +1,18 @@
 import os
+from rfsynth.otatestbed.config_model import parse_config
 
 
 def tx_config_parse(tx_config):
-    check_num_radios(tx_config)
-    check_num_channels(tx_config)
-    check_antenna_type(tx_config)
-    check_gain(tx_config)
-    enforce_same_sample_rate(tx_config)
+    # Transmit radios may run at different sample rates, IQ files are
+    # resampled to the rate of the radio that plays them.
+    # All structural and file checks happen in one pass in config_model
+    return parse_config(tx_config)
 
 def rx_config_parse(rx_config):
     check_save_dir(rx_config)
-    check_num_radios(rx_config)
-    check_num_channels(rx_config)
-    check_antenna_type(rx_config)
-    check_gain(rx_config)
     enforce_same_sample_rate(rx_config)
-    
-
-    for radio in rx_config['radios']:
-        for channel in radio['channels']:
-            pass
-
-def check_num_radios(config):
-    num_radios = len(config['radios'])
-    if num_radios < 1:
-        raise ValueError(f'No radios were listed in the config')
-
-def check_num_channels(config):
-    radios = config['radios']
-    for radio in radios:
-        num_channels = len(radio['channels'])
-        if num_channels < 1:
-            raise ValueError(f'No channels were specified for one of the radios')
-        if num_channels > 4:
-            raise ValueError(f'Too many channels ({num_channels}) were specified for one of the radios')
-
-def check_antenna_type(config):
-    antenna_types = {'TX/RX','RX2'}
-    radios = config['radios']
-    for radio in radios:
-        for channel in radio['channels']:
-            antenna = channel['antenna']
-            if antenna not in antenna_types:
-                raise ValueError(f'Invalid antenna type was given ({antenna}). Should be one of {antenna_types} ')    
-
-def check_gain(config):
-    radios = config['radios']
-    for radio in radios:
-        for channel in radio['channels']:
-            gain = channel['gain']
-            if gain < 0.0 or gain > 1.0:
-                raise ValueError(f'Invalid gain was given ({gain}). Should be a normalized gain between 0.0 and 1.0')
+    # Receivers record, their IQ files and metadata do not exist yet
+    return parse_config(rx_config, check_files=False)
 
 def check_save_dir(rx_config):
     save_dir = rx_config['save_dir']
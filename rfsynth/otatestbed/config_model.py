@@ -0,0 +1,434 @@
+"""
+Typed radio configuration model.
+
+Radio configs are JSON files with one entry per radio, and channels inside
+each radio. This module turns them into slotted dataclasses in a single
+validation pass that reports every problem at once. It checks the IQ files
+and energy metadata of the real time transmit schema up front, instead of
+minutes into a run. The resulting objects are small and pickle cheaply, so
+they are handed to worker processes instead of having the workers re-read
+the JSON.
+"""
+
+from dataclasses import dataclass, field
+import json
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from rfsynth.otatestbed.exec_policy import MAX_NICE, MAX_REALTIME_PRIORITY, MIN_NICE, MIN_REALTIME_PRIORITY
+from rfsynth.otatestbed.impairments import IMPAIRMENT_KEYS, RANGE_SUFFIX
+from rfsynth.otatestbed.iq_codec import IqzReader, is_compressed_iq
+from rfsynth.otatestbed.sample_format import CPU_FC32, CPU_FORMATS, is_sc16_file
+
+logger = logging.getLogger(__name__)
+
+ANTENNA_TYPES = {"TX/RX", "RX2"}
+MAX_CHANNELS = 4
+SAMPLE_BYTES = 8  # complex64
+SC16_SAMPLE_BYTES = 4  # int16 pairs
+METADATA_COLUMNS = ("time_start", "freq_lo", "freq_hi", "timeLength_s", "tx_radio", "iq_filename")
+# Relative mismatch between an IQ file's duration and its energy length that is reported
+DURATION_TOLERANCE = 0.01
+# Rows listed per metadata problem, the rest are counted
+MAX_REPORTED_ROWS = 10
+
+
+@dataclass(slots=True)
+class IqStreamParams:
+    frequency: float
+    file: str
+    metadata: str
+    sample_rate: Optional[float] = None  # rate of the IQ files, None for the radio's rate
+    burst: Optional[str] = None  # name of the burst to play when file is a burst pack
+
+
+@dataclass(slots=True)
+class ChannelConfig:
+    name: str
+    antenna: str
+    gain: float
+    iq_stream: IqStreamParams
+
+
+@dataclass(slots=True)
+class RadioConfig:
+    model: str
+    name: str
+    addrs: List[str]
+    sample_rate: float
+    master_clock_rate: float
+    subdev_spec: str
+    channels: List[ChannelConfig]
+    num_seconds_receive: Optional[float] = None
+    retune_policy: dict = field(default_factory=dict)
+    clock_discipline: dict = field(default_factory=dict)
+    execution_policy: dict = field(default_factory=dict)
+    impairments: dict = field(default_factory=dict)
+    streaming: bool = False  # stream IQ files from disk instead of loading them
+    cpu_format: str = CPU_FC32  # host sample format of the radio stream
+
+    @property
+    def address(self):
+        return self.addrs[0]
+
+    def file_sample_rate(self, channel_num: int):
+        """Sample rate of the IQ files of a channel"""
+        sample_rate = self.channels[channel_num].iq_stream.sample_rate
+        return self.sample_rate if sample_rate is None else sample_rate
+
+
+@dataclass(slots=True)
+class RadiosConfig:
+    radios: List[RadioConfig]
+    preamble_on_time_ms: Optional[float] = None
+    save_dir: Optional[str] = None
+
+
+class _Errors(list):
+    # Collects messages so that all problems are reported together
+    def check(self, condition, message):
+        if not condition:
+            self.append(message)
+        return condition
+
+
+def _get(d, key, errors, where, default=KeyError):
+    if key in d:
+        return d[key]
+    if default is KeyError:
+        errors.append(f"{where}: missing '{key}'")
+        return None
+    return default
+
+
+def _parse_channel(channel_d, errors, where):
+    iq_d = _get(channel_d, "IQSTREAM_Params", errors, where, {})
+    iq_stream = IqStreamParams(
+        frequency=_get(iq_d, "frequency", errors, f"{where}.IQSTREAM_Params"),
+        file=_get(iq_d, "file", errors, f"{where}.IQSTREAM_Params", ""),
+        metadata=_get(iq_d, "metadata", errors, f"{where}.IQSTREAM_Params", ""),
+        sample_rate=iq_d.get("sampleRate"),
+        burst=iq_d.get("burst"),
+    )
+    channel = ChannelConfig(
+        name=channel_d.get("name", ""),
+        antenna=_get(channel_d, "antenna", errors, where),
+        gain=_get(channel_d, "gain", errors, where),
+        iq_stream=iq_stream,
+    )
+    errors.check(
+        channel.antenna in ANTENNA_TYPES,
+        f"{where}: invalid antenna type ({channel.antenna}). Should be one of {ANTENNA_TYPES}",
+    )
+    if channel.gain is not None:
+        errors.check(
+            0.0 <= channel.gain <= 1.0,
+            f"{where}: invalid gain ({channel.gain}). Should be a normalized gain between 0.0 and 1.0",
+        )
+    if iq_stream.sample_rate is not None:
+        errors.check(
+            iq_stream.sample_rate > 0,
+            f"{where}: invalid IQ file sample rate ({iq_stream.sample_rate}). Should be positive",
+        )
+    return channel
+
+
+def _check_execution_policy(policy, errors, where):
+    cpus = policy.get("cpus")
+    if cpus is not None:
+        errors.check(
+            isinstance(cpus, list) and len(cpus) > 0 and all(isinstance(cpu, int) and cpu >= 0 for cpu in cpus),
+            f"{where}: invalid cpus ({cpus}). Should be a non empty list of CPU numbers",
+        )
+    priority = policy.get("realtimePriority")
+    if priority is not None:
+        errors.check(
+            isinstance(priority, int) and MIN_REALTIME_PRIORITY <= priority <= MAX_REALTIME_PRIORITY,
+            f"{where}: invalid realtimePriority ({priority}). "
+            f"Should be between {MIN_REALTIME_PRIORITY} and {MAX_REALTIME_PRIORITY}",
+        )
+    nice = policy.get("nice")
+    if nice is not None:
+        errors.check(
+            isinstance(nice, int) and MIN_NICE <= nice <= MAX_NICE,
+            f"{where}: invalid nice ({nice}). Should be between {MIN_NICE} and {MAX_NICE}",
+        )
+
+
+def _check_impairments(impairments, errors, where):
+    known = set(IMPAIRMENT_KEYS) | {key + RANGE_SUFFIX for key in IMPAIRMENT_KEYS} | {"seed"}
+    unknown = sorted(set(impairments) - known)
+    errors.check(not unknown, f"{where}: unknown keys {unknown}. Should be among {sorted(known)}")
+    for key in IMPAIRMENT_KEYS:
+        value = impairments.get(key)
+        if value is not None:
+            errors.check(isinstance(value, (int, float)), f"{where}: invalid {key} ({value}). Should be a number")
+        value_range = impairments.get(key + RANGE_SUFFIX)
+        if value_range is not None:
+            errors.check(
+                isinstance(value_range, list)
+                and len(value_range) == 2
+                and all(isinstance(bound, (int, float)) for bound in value_range)
+                and value_range[0] <= value_range[1],
+                f"{where}: invalid {key + RANGE_SUFFIX} ({value_range}). Should be [low, high]",
+            )
+    for key in ("dcGain", "phaseNoiseHz"):
+        value = impairments.get(key)
+        if isinstance(value, (int, float)):
+            errors.check(value >= 0, f"{where}: invalid {key} ({value}). Should not be negative")
+
+
+def parse_radio_config(radio_d: dict, errors=None, where: str = "radio"):
+    """
+    Build a RadioConfig from its JSON dictionary
+
+    :param radio_d: Radio configuration dictionary
+    :type radio_d: dict
+
+    :param errors: List collecting error messages. Raises ValueError on the
+        first call's errors when not given
+    :type errors: list or None
+
+    :param where: Location of the radio in the config, for the messages
+    :type where: str
+
+    :return: The radio config
+    :rtype: RadioConfig
+    """
+    raise_errors = errors is None
+    errors = _Errors() if errors is None else errors
+
+    channels_d = _get(radio_d, "channels", errors, where, [])
+    errors.check(len(channels_d) >= 1, f"{where}: no channels were specified")
+    errors.check(
+        len(channels_d) <= MAX_CHANNELS,
+        f"{where}: too many channels ({len(channels_d)}) were specified",
+    )
+    radio = RadioConfig(
+        model=radio_d.get("model", ""),
+        name=radio_d.get("name", ""),
+        addrs=_get(radio_d, "addrs", errors, where, [""]),
+        sample_rate=_get(radio_d, "sampleRate", errors, where),
+        master_clock_rate=_get(radio_d, "masterClockRate", errors, where),
+        subdev_spec=_get(radio_d, "subdevSpec", errors, where),
+        channels=[
+            _parse_channel(channel_d, errors, f"{where}.channels[{idx}]")
+            for idx, channel_d in enumerate(channels_d)
+        ],
+        num_seconds_receive=radio_d.get("numSecondsReceive"),
+        retune_policy=radio_d.get("retunePolicy", {}),
+        clock_discipline=radio_d.get("clockDiscipline", {}),
+        execution_policy=radio_d.get("executionPolicy", {}),
+        impairments=radio_d.get("impairments", {}),
+        streaming=radio_d.get("streaming", False),
+        cpu_format=radio_d.get("cpuFormat", CPU_FC32),
+    )
+    errors.check(
+        radio.cpu_format in CPU_FORMATS,
+        f"{where}: invalid cpu format ({radio.cpu_format}). Should be one of {CPU_FORMATS}",
+    )
+    _check_execution_policy(radio.execution_policy, errors, f"{where}.executionPolicy")
+    _check_impairments(radio.impairments, errors, f"{where}.impairments")
+    if raise_errors and errors:
+        raise ValueError("Invalid radio config:\n" + "\n".join(errors))
+    return radio
+
+
+class _FileChecker:
+    # Checks every IQ file once, however many rows refer to it
+    def __init__(self, errors):
+        self.errors = errors
+        self.num_samples = {}
+        self.checked_metadata = set()
+
+    def iq_file(self, filepath, where):
+        if filepath not in self.num_samples:
+            num_samples = None
+            if not os.path.isfile(filepath):
+                self.errors.append(f"{where}: IQ file {filepath} does not exist")
+            elif is_compressed_iq(filepath):
+                try:
+                    num_samples = IqzReader(filepath).num_samples
+                except (ValueError, OSError) as e:
+                    self.errors.append(f"{where}: IQ file {filepath} cannot be read ({e})")
+            else:
+                size = os.path.getsize(filepath)
+                sample_bytes = SC16_SAMPLE_BYTES if is_sc16_file(filepath) else SAMPLE_BYTES
+                if size == 0 or size % sample_bytes:
+                    self.errors.append(
+                        f"{where}: IQ file {filepath} has {size} bytes, not a whole number of samples"
+                    )
+                else:
+                    num_samples = size // sample_bytes
+            self.num_samples[filepath] = num_samples
+        return self.num_samples[filepath]
+
+    def metadata(self, radio, channel, where):
+        meta_file = channel.iq_stream.metadata
+        if not os.path.isfile(meta_file):
+            self.errors.append(f"{where}: metadata file {meta_file} does not exist")
+            return
+        if not meta_file.endswith(".csv"):
+            return
+
+        file_sample_rate = channel.iq_stream.sample_rate or radio.sample_rate
+        if (meta_file, file_sample_rate) in self.checked_metadata:
+            return
+        self.checked_metadata.add((meta_file, file_sample_rate))
+        # Imported here, workers that never validate do not pay for pandas
+        import pandas as pd
+
+        df = pd.read_csv(meta_file)
+        missing = [col for col in METADATA_COLUMNS if col not in df.columns]
+        if missing:
+            self.errors.append(f"{where}: metadata file {meta_file} is missing columns {missing}")
+            return
+        if df.empty:
+            return
+
+        time_start = pd.to_numeric(df.time_start, errors="coerce").to_numpy(np.float64)
+        time_length = pd.to_numeric(df.timeLength_s, errors="coerce").to_numpy(np.float64)
+        freq_lo = pd.to_numeric(df.freq_lo, errors="coerce").to_numpy(np.float64)
+        freq_hi = pd.to_numeric(df.freq_hi, errors="coerce").to_numpy(np.float64)
+        self._check_rows(meta_file, "time_start is not a time >= 0", ~(time_start >= 0))
+        self._check_rows(meta_file, "timeLength_s is not a duration > 0", ~(time_length > 0))
+        self._check_rows(meta_file, "freq_lo is above freq_hi", ~(freq_lo <= freq_hi))
+        # The transmit loop plays the energies of a radio in file order
+        tx_radio = df.tx_radio.to_numpy()
+        order = np.argsort(tx_radio, kind="stable")
+        same_radio = tx_radio[order][1:] == tx_radio[order][:-1]
+        backwards = np.zeros(len(df), dtype=bool)
+        backwards[order[1:]] = same_radio & (np.diff(time_start[order]) < 0)
+        self._check_rows(meta_file, "time_start is before the previous energy of its tx_radio", backwards)
+
+        # Each IQ file is checked once, then the durations are compared for all rows at once
+        files = df.iq_filename.astype(str)
+        first_rows = files.drop_duplicates()
+        file_samples = {
+            filepath: self.iq_file(filepath, f"{meta_file} row {row_idx}")
+            for row_idx, filepath in first_rows.items()
+        }
+        num_samples = files.map(file_samples).to_numpy(np.float64)
+        if "iq_length" in df.columns:
+            # A burst is a segment of a larger file
+            iq_length = pd.to_numeric(df.iq_length, errors="coerce").to_numpy(np.float64)
+            segment = ~np.isnan(iq_length) & ~np.isnan(num_samples)
+            if "iq_offset" in df.columns:
+                iq_offset = pd.to_numeric(df.iq_offset, errors="coerce").fillna(0).to_numpy(np.float64)
+                self._check_rows(
+                    meta_file,
+                    "iq_offset + iq_length is past the end of the IQ file",
+                    segment & ((iq_offset < 0) | (iq_offset + iq_length > num_samples)),
+                )
+            num_samples = np.where(segment, iq_length, num_samples)
+        duration = num_samples / file_sample_rate
+        mismatch = np.abs(duration - time_length) > DURATION_TOLERANCE * time_length
+        for row_idx in np.flatnonzero(mismatch):
+            logger.warning(
+                f"{meta_file} row {row_idx}: IQ file lasts {duration[row_idx]:.6f} s "
+                f"but the energy is {time_length[row_idx]:.6f} s long"
+            )
+
+    def _check_rows(self, meta_file, problem, bad_rows):
+        bad_rows = np.flatnonzero(bad_rows)
+        if len(bad_rows):
+            shown = ", ".join(str(row_idx) for row_idx in bad_rows[:MAX_REPORTED_ROWS])
+            more = f" and {len(bad_rows) - MAX_REPORTED_ROWS} more" if len(bad_rows) > MAX_REPORTED_ROWS else ""
+            rows = "rows" if len(bad_rows) > 1 else "row"
+            self.errors.append(f"{meta_file} {rows} {shown}{more}: {problem}")
+
+
+def parse_config(config_d: dict, check_files: bool = True):
+    """
+    Validate a radios config dictionary in a single pass and build its model.
+    All problems found are reported together in one ValueError.
+
+    :param config_d: The config dictionary
+    :type config_d: dict
+
+    :param check_files: Also check the IQ files and metadata the channels refer to
+    :type check_files: bool
+
+    :return: The config model
+    :rtype: RadiosConfig
+    """
+    errors = _Errors()
+    radios_d = _get(config_d, "radios", errors, "config", [])
+    errors.check(len(radios_d) >= 1, "config: no radios were listed")
+    config = RadiosConfig(
+        radios=[
+            parse_radio_config(radio_d, errors, f"radios[{idx}]")
+            for idx, radio_d in enumerate(radios_d)
+        ],
+        preamble_on_time_ms=config_d.get("preambleOnTimeMs"),
+        save_dir=config_d.get("save_dir"),
+    )
+
+    if check_files:
+        checker = _FileChecker(errors)
+        for radio_idx, radio in enumerate(config.radios):
+            for channel_idx, channel in enumerate(radio.channels):
+                where = f"radios[{radio_idx}].channels[{channel_idx}]"
+                checker.iq_file(channel.iq_stream.file, where)
+                checker.metadata(radio, channel, where)
+
+    if errors:
+        raise ValueError(f"Invalid config, {len(errors)} problem(s):\n" + "\n".join(errors))
+    return config
+
+
+def override_data_paths(config_d: dict, metadata: str = None, data_dir: str = None):
+    """
+    Point the channels of a config dictionary at the files of one run,
+    instead of the fixed paths written in the config
+
+    :param config_d: The config dictionary, updated in place
+    :type config_d: dict
+
+    :param metadata: Energy metadata file used by every channel
+    :type metadata: str or None
+
+    :param data_dir: Directory the IQ files are looked up in, by file name
+    :type data_dir: str or None
+
+    :return: config_d
+    :rtype: dict
+    """
+    for radio_d in config_d.get("radios", []):
+        for channel_d in radio_d.get("channels", []):
+            iq_d = channel_d.get("IQSTREAM_Params")
+            if iq_d is None:
+                continue
+            if metadata is not None:
+                iq_d["metadata"] = metadata
+            if data_dir is not None and iq_d.get("file"):
+                iq_d["file"] = os.path.join(data_dir, os.path.basename(iq_d["file"]))
+    return config_d
+
+
+def load_config(config_filename: str, check_files: bool = True, metadata: str = None, data_dir: str = None):
+    """
+    Load and validate a radios config file
+
+    :param config_filename: The name of the config file
+    :type config_filename: str
+
+    :param check_files: Also check the IQ files and metadata the channels refer to
+    :type check_files: bool
+
+    :param metadata: Overrides the energy metadata file of every channel
+    :type metadata: str or None
+
+    :param data_dir: Overrides the directory of the channels' IQ files
+    :type data_dir: str or None
+
+    :return: The config model
+    :rtype: RadiosConfig
+    """
+    with open(config_filename, "r") as f:
+        config_d = json.load(f)
+    override_data_paths(config_d, metadata, data_dir)
+    return parse_config(config_d, check_files)
@@ -0,0 +1,223 @@
+"""
+Execution policy of the real time transmit workers.
+
+By default a transmit worker runs under the normal scheduler, on whatever
+CPU the OS picks, next to unzipping, JSON and logging work. A late start is
+then often caused by preemption or by page faults on a freshly loaded
+buffer. A radio can opt in to a stricter policy with the optional
+``executionPolicy`` entry of its config::
+
+    "executionPolicy": {
+        "cpus": [2, 3],            # CPUs the worker may run on
+        "realtimePriority": 50,    # SCHED_FIFO priority, 1 to 99
+        "nice": -10,               # niceness, used when SCHED_FIFO is not asked for or not permitted
+        "lockMemory": true         # lock all current and future memory of the worker
+    }
+
+The policy is applied by the worker to itself before its flowgraph is
+built. The scheduler settings apply to the calling thread and are inherited
+by the flowgraph threads started afterwards. Loaded bursts are copied into
+the flowgraph's own vectors and streamed ones pass through ring buffers of
+the flowgraph, so locking individual numpy arrays would pin copies that are
+never transmitted. ``lockMemory`` uses ``mlockall(MCL_CURRENT | MCL_FUTURE)``
+instead: every page the flowgraph allocates afterwards is faulted in and
+locked as it is mapped, on the load and the streaming path alike.
+
+Every setting that needs privileges the process does not have
+(``CAP_SYS_NICE``, ``CAP_IPC_LOCK`` or an unlimited ``RLIMIT_MEMLOCK``) is
+dropped with a warning instead of failing the run. The settings actually in
+effect are logged and returned by :meth:`ExecutionPolicy.apply`.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+MIN_REALTIME_PRIORITY = 1
+MAX_REALTIME_PRIORITY = 99
+MIN_NICE = -20
+MAX_NICE = 19
+
+# mlockall flags from sys/mman.h
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+CAP_IPC_LOCK = 14
+
+_libc = None
+
+
+def _get_libc():
+    # Loaded on first use, only mlockall and munlockall are needed
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        _libc.mlockall.argtypes = (ctypes.c_int,)
+        _libc.mlockall.restype = ctypes.c_int
+        _libc.munlockall.argtypes = ()
+        _libc.munlockall.restype = ctypes.c_int
+    return _libc
+
+
+def _has_capability(capability: int):
+    # Effective capabilities of this process, from /proc on Linux
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("CapEff:"):
+                    return bool(int(line.split()[1], 16) >> capability & 1)
+    except OSError:
+        pass
+    return False
+
+
+class ExecutionPolicy:
+    """
+    CPU affinity, scheduling and memory locking of a transmit worker
+
+    :param cpus: CPUs to run on, any CPU when None
+    :type cpus: list[int] or None
+
+    :param realtime_priority: SCHED_FIFO priority, the default scheduler when None
+    :type realtime_priority: int or None
+
+    :param nice: Niceness, unchanged when None
+    :type nice: int or None
+
+    :param lock_memory: Lock all current and future memory of the process in RAM
+    :type lock_memory: bool
+    """
+
+    def __init__(
+        self,
+        cpus=None,
+        realtime_priority: int = None,
+        nice: int = None,
+        lock_memory: bool = False,
+    ):
+        self.cpus = None if cpus is None else sorted(set(cpus))
+        self.realtime_priority = realtime_priority
+        self.nice = nice
+        self.lock_memory = lock_memory
+        self.effective = {}
+
+    @classmethod
+    def from_config(cls, radio_config):
+        """
+        Build a policy from the optional ``executionPolicy`` entry of a radio config
+
+        :param radio_config: Radio configuration
+        :type radio_config: RadioConfig
+
+        :return: The execution policy
+        :rtype: ExecutionPolicy
+        """
+        policy = radio_config.execution_policy
+        return cls(
+            cpus=policy.get("cpus"),
+            realtime_priority=policy.get("realtimePriority"),
+            nice=policy.get("nice"),
+            lock_memory=policy.get("lockMemory", False),
+        )
+
+    @property
+    def enabled(self):
+        return (
+            self.cpus is not None
+            or self.realtime_priority is not None
+            or self.nice is not None
+            or self.lock_memory
+        )
+
+    def apply(self, name: str = ""):
+        """
+        Apply the policy to the calling process, dropping what is not permitted
+
+        :param name: Name of the worker, for the log
+        :type name: str
+
+        :return: The settings in effect
+        :rtype: dict
+        """
+        if not self.enabled:
+            return self.effective
+        self.effective = {
+            "cpus": self._apply_affinity(),
+            "scheduler": "other",
+            "priority": 0,
+            "nice": None,
+            "lock_memory": self.lock_memory and self._lock_memory(),
+        }
+        if self.realtime_priority is not None and self._apply_realtime():
+            self.effective["scheduler"] = "fifo"
+            self.effective["priority"] = self.realtime_priority
+        elif self.nice is not None:
+            self._apply_nice()
+        if hasattr(os, "getpriority"):
+            self.effective["nice"] = os.getpriority(os.PRIO_PROCESS, 0)
+        logger.info("%s execution policy in effect: %s", name or "Worker", self.effective)
+        return self.effective
+
+    def _apply_affinity(self):
+        if not hasattr(os, "sched_setaffinity"):
+            if self.cpus is not None:
+                logger.warning("CPU affinity is not supported on this platform, running on any CPU")
+            return None
+        if self.cpus is not None:
+            try:
+                os.sched_setaffinity(0, self.cpus)
+            except (OSError, ValueError) as e:
+                logger.warning("Cannot pin to CPUs %s (%s), running on any CPU", self.cpus, e)
+        return sorted(os.sched_getaffinity(0))
+
+    def _apply_realtime(self):
+        if not hasattr(os, "sched_setscheduler"):
+            logger.warning("SCHED_FIFO is not supported on this platform")
+            return False
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.realtime_priority))
+        except (OSError, ValueError) as e:
+            logger.warning(
+                "Cannot set SCHED_FIFO priority %d (%s), grant CAP_SYS_NICE or an rtprio limit",
+                self.realtime_priority,
+                e,
+            )
+            return False
+        return True
+
+    def _apply_nice(self):
+        if not hasattr(os, "setpriority"):
+            return
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, self.nice)
+        except OSError as e:
+            logger.warning("Cannot set nice %d (%s), keeping %d", self.nice, e, os.getpriority(os.PRIO_PROCESS, 0))
+
+    def _lock_memory(self):
+        try:
+            import resource
+
+            libc = _get_libc()
+        except (ImportError, OSError, AttributeError) as e:
+            logger.warning("Memory locking is not available (%s)", e)
+            return False
+        # With MCL_FUTURE every allocation beyond the limit would fail, so the
+        # limit has to be lifted rather than just large enough for now
+        soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+        if soft != resource.RLIM_INFINITY and not _has_capability(CAP_IPC_LOCK):
+            logger.warning(
+                "RLIMIT_MEMLOCK is %d bytes and CAP_IPC_LOCK is missing, memory is not locked", soft
+            )
+            return False
+        if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+            logger.warning("Cannot lock memory (%s)", os.strerror(ctypes.get_errno()))
+            return False
+        return True
+
+    def release(self):
+        """Unlock the memory of the process"""
+        if self.effective.get("lock_memory"):
+            _get_libc().munlockall()
+            self.effective["lock_memory"] = False
@@ -0,0 +1,348 @@
+"""
+RF impairments applied to IQ samples on the transmit host.
+
+The MATLAB ``atomic.Source`` bakes IQ imbalance, DC offset and carrier
+frequency offset into every generated file, so each impaired variant of a
+burst costs another file. This module applies the same effects to stored
+clean bursts as they are loaded or streamed, plus Wiener phase noise. A
+radio opts in with the optional ``impairments`` entry of its config::
+
+    "impairments": {
+        "cfoHz": 250.0,             # carrier frequency offset
+        "iqGain": 0.02,             # IQ gain imbalance epsilon, linear
+        "iqPhaseRad": 0.01,         # IQ phase imbalance, radians
+        "dcGain": 0.01,             # DC offset relative to the normalized peak of 1
+        "dcPhaseRad": 0.0,          # phase of the DC offset, radians
+        "phaseNoiseHz": 50.0,       # 3 dB linewidth of the oscillator phase noise
+        "cfoHzRange": [-500, 500],  # optional, any parameter with a range is
+                                    # drawn uniformly for every loaded burst
+        "seed": 1                   # optional seed of the draws and the phase noise
+    }
+
+The effects are applied in the MATLAB order (IQ imbalance, DC offset, then
+CFO), with the phase noise folded into the CFO rotation. An
+:class:`ImpairmentStream` processes samples chunk by chunk into preallocated
+buffers and keeps the mixer and phase noise state between chunks, so a
+streamed segment is impaired the same way as a loaded one. IQ imbalance and
+DC offset raise the peak above the normalized 1, so loaded signals are
+scaled back to a peak of 1 and streamed ones are backed off by
+:meth:`Impairments.peak_gain`.
+"""
+
+import logging
+
+import numpy as np
+
+from rfsynth.otatestbed.nco import DEFAULT_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Config key of every parameter and its attribute
+IMPAIRMENT_KEYS = {
+    "cfoHz": "cfo_hz",
+    "iqGain": "iq_gain",
+    "iqPhaseRad": "iq_phase",
+    "dcGain": "dc_gain",
+    "dcPhaseRad": "dc_phase",
+    "phaseNoiseHz": "phase_noise_hz",
+}
+RANGE_SUFFIX = "Range"
+
+
+def iq_imbalance_coefficients(gain: float, phase: float):
+    """
+    Coefficients of y = alpha * x + beta * conj(x) for a gain and phase
+    imbalance, as in applyIQImbaltoSignal of atomic.Source
+
+    :param gain: Gain imbalance epsilon, linear
+    :type gain: float
+
+    :param phase: Phase imbalance in radians
+    :type phase: float
+
+    :return: alpha and beta
+    :rtype: tuple[complex, complex]
+    """
+    half_phase = phase / 2
+    alpha = complex(np.cos(half_phase), gain * np.sin(half_phase))
+    beta = complex(gain * np.cos(half_phase), -np.sin(half_phase))
+    return alpha, beta
+
+
+class ImpairmentStream:
+    """
+    Applies one set of impairments to consecutive chunks of a signal
+
+    :param impairments: Impairment parameters
+    :type impairments: Impairments
+
+    :param sample_rate: Sample rate of the signal
+    :type sample_rate: float
+
+    :param amplitude: Amplitude the DC offset is relative to
+    :type amplitude: float
+
+    :param chunk_size: Samples processed per step, the size of the work buffers
+    :type chunk_size: int
+
+    :param rng: Random generator of the phase noise
+    :type rng: np.random.Generator or None
+    """
+
+    def __init__(
+        self,
+        impairments,
+        sample_rate: float,
+        amplitude: float = 1.0,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        rng=None,
+    ):
+        self.impairments = impairments
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self._rng = np.random.default_rng(rng)
+        self._imbalance = None
+        if impairments.iq_gain or impairments.iq_phase:
+            self._imbalance = iq_imbalance_coefficients(impairments.iq_gain, impairments.iq_phase)
+        self._dc = impairments.dc_gain * amplitude * np.exp(1j * impairments.dc_phase)
+        self._cycles_per_sample = impairments.cfo_hz / sample_rate
+        # Wiener phase noise, the increment variance is 2*pi*linewidth/fs
+        self._phase_noise_std = np.sqrt(2 * np.pi * impairments.phase_noise_hz / sample_rate)
+        self._ramp = np.arange(chunk_size, dtype=np.float64)
+        self._phase = np.empty(chunk_size, dtype=np.float64)
+        self._noise = np.empty(chunk_size, dtype=np.float64)
+        self._rotator = np.empty(chunk_size, dtype=np.complex64)
+        self._scratch = np.empty(chunk_size, dtype=np.complex64)
+        self._out = np.empty(0, dtype=np.complex64)
+        self.reset()
+
+    def reset(self):
+        """Start over at the first sample, the phase noise walk restarts at 0"""
+        self._position = 0
+        self._noise_phase = 0.0
+
+    @property
+    def rotates(self):
+        return self._cycles_per_sample != 0 or self._phase_noise_std != 0
+
+    def process(self, samples, out=None):
+        """
+        Impair the next samples of the signal
+
+        :param samples: Complex samples
+        :type samples: np.ndarray
+
+        :param out: Output buffer, may be samples itself. When None the
+            samples are written to an internal buffer that the next call reuses
+        :type out: np.ndarray or None
+
+        :return: The impaired samples
+        :rtype: np.ndarray
+        """
+        samples = np.asarray(samples)
+        num_samples = len(samples)
+        if out is None:
+            if len(self._out) < num_samples:
+                self._out = np.empty(num_samples, dtype=np.complex64)
+            out = self._out[:num_samples]
+        for start in range(0, num_samples, self.chunk_size):
+            stop = min(start + self.chunk_size, num_samples)
+            self._process_chunk(samples[start:stop], out[start:stop])
+        return out
+
+    def _process_chunk(self, x, y):
+        count = len(x)
+        if self._imbalance is not None:
+            alpha, beta = self._imbalance
+            scratch = self._scratch[:count]
+            np.multiply(x, alpha, out=scratch)
+            np.conjugate(x, out=y)
+            y *= beta
+            y += scratch
+        elif y is not x:
+            np.copyto(y, x)
+        if self._dc:
+            y += self._dc
+        if self.rotates:
+            phase = self._phase[:count]
+            # Phase at the start of the chunk, wrapped in float64 to keep precision
+            start_cycles = (self._position * self._cycles_per_sample) % 1.0
+            np.multiply(self._ramp[:count], 2 * np.pi * self._cycles_per_sample, out=phase)
+            phase += 2 * np.pi * start_cycles
+            if self._phase_noise_std:
+                noise = self._noise[:count]
+                self._rng.standard_normal(out=noise)
+                noise *= self._phase_noise_std
+                np.cumsum(noise, out=noise)
+                noise += self._noise_phase
+                self._noise_phase = float(noise[-1]) % (2 * np.pi)
+                phase += noise
+            rotator = self._rotator[:count]
+            np.cos(phase, out=rotator.real)
+            np.sin(phase, out=rotator.imag)
+            y *= rotator
+        self._position += count
+
+
+class Impairments:
+    """
+    RF impairment parameters, fixed or drawn from ranges
+
+    :param cfo_hz: Carrier frequency offset
+    :type cfo_hz: float
+
+    :param iq_gain: IQ gain imbalance epsilon, linear
+    :type iq_gain: float
+
+    :param iq_phase: IQ phase imbalance in radians
+    :type iq_phase: float
+
+    :param dc_gain: DC offset relative to the signal amplitude
+    :type dc_gain: float
+
+    :param dc_phase: Phase of the DC offset in radians
+    :type dc_phase: float
+
+    :param phase_noise_hz: 3 dB linewidth of the phase noise
+    :type phase_noise_hz: float
+
+    :param ranges: [low, high] of the parameters drawn for every variant, by attribute name
+    :type ranges: dict or None
+
+    :param seed: Seed or random generator of the draws and the phase noise
+    :type seed: int or np.random.Generator or None
+    """
+
+    def __init__(
+        self,
+        cfo_hz: float = 0.0,
+        iq_gain: float = 0.0,
+        iq_phase: float = 0.0,
+        dc_gain: float = 0.0,
+        dc_phase: float = 0.0,
+        phase_noise_hz: float = 0.0,
+        ranges: dict = None,
+        seed=None,
+    ):
+        self.cfo_hz = cfo_hz
+        self.iq_gain = iq_gain
+        self.iq_phase = iq_phase
+        self.dc_gain = dc_gain
+        self.dc_phase = dc_phase
+        self.phase_noise_hz = phase_noise_hz
+        self.ranges = ranges or {}
+        self._rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_dict(cls, impairments_d: dict):
+        """
+        Build impairments from an ``impairments`` config entry
+
+        :param impairments_d: Impairments config
+        :type impairments_d: dict
+
+        :return: The impairments
+        :rtype: Impairments
+        """
+        kwargs = {attr: float(impairments_d.get(key, 0.0)) for key, attr in IMPAIRMENT_KEYS.items()}
+        ranges = {
+            attr: tuple(impairments_d[key + RANGE_SUFFIX])
+            for key, attr in IMPAIRMENT_KEYS.items()
+            if key + RANGE_SUFFIX in impairments_d
+        }
+        return cls(ranges=ranges, seed=impairments_d.get("seed"), **kwargs)
+
+    @classmethod
+    def from_config(cls, radio_config):
+        """
+        Build impairments from the optional ``impairments`` entry of a radio config
+
+        :param radio_config: Radio configuration
+        :type radio_config: RadioConfig
+
+        :return: The impairments
+        :rtype: Impairments
+        """
+        return cls.from_dict(radio_config.impairments)
+
+    @property
+    def enabled(self):
+        return bool(self.ranges) or any(getattr(self, attr) for attr in IMPAIRMENT_KEYS.values())
+
+    def draw(self):
+        """
+        Impairments of one variant, with every ranged parameter drawn uniformly
+
+        :return: Fixed impairments, self when nothing is ranged
+        :rtype: Impairments
+        """
+        if not self.ranges:
+            return self
+        kwargs = {attr: getattr(self, attr) for attr in IMPAIRMENT_KEYS.values()}
+        for attr, (low, high) in self.ranges.items():
+            kwargs[attr] = float(self._rng.uniform(low, high))
+        return Impairments(seed=self._rng.integers(2**63), **kwargs)
+
+    def peak_gain(self):
+        """
+        Largest magnitude of the impaired signal for samples of magnitude up
+        to 1. IQ imbalance and DC offset can raise the peak, the rotations
+        cannot. Streamed segments are backed off by it to stay in full scale.
+
+        :rtype: float
+        """
+        gain = 1.0
+        if self.iq_gain or self.iq_phase:
+            alpha, beta = iq_imbalance_coefficients(self.iq_gain, self.iq_phase)
+            gain = abs(alpha) + abs(beta)
+        return gain + abs(self.dc_gain)
+
+    def stream(self, sample_rate: float, amplitude: float = 1.0, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        Stream state for applying these impairments to one signal
+
+        :param sample_rate: Sample rate of the signal
+        :type sample_rate: float
+
+        :param amplitude: Amplitude the DC offset is relative to
+        :type amplitude: float
+
+        :param chunk_size: Samples processed per step
+        :type chunk_size: int
+
+        :rtype: ImpairmentStream
+        """
+        return ImpairmentStream(self, sample_rate, amplitude, chunk_size, self._rng)
+
+    def apply(self, samples, sample_rate: float, out=None, amplitude: float = 1.0, normalize: bool = False):
+        """
+        Impair a whole signal
+
+        :param samples: Complex samples
+        :type samples: np.ndarray
+
+        :param sample_rate: Sample rate of the signal
+        :type sample_rate: float
+
+        :param out: Optional output buffer, may be samples itself for in-place processing
+        :type out: np.ndarray or None
+
+        :param amplitude: Amplitude the DC offset is relative to
+        :type amplitude: float
+
+        :param normalize: Scale the impaired signal back to a peak of amplitude
+        :type normalize: bool
+
+        :return: The impaired samples
+        :rtype: np.ndarray
+        """
+        out = self.stream(sample_rate, amplitude).process(samples, out)
+        if normalize and len(out):
+            peak = np.max(np.abs(out))
+            if peak > 0:
+                out *= amplitude / peak
+        return out
+
+    def to_dict(self):
+        """Parameters in the config's keys, for metadata"""
+        return {key: getattr(self, attr) for key, attr in IMPAIRMENT_KEYS.items()}
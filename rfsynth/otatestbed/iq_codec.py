@@ -0,0 +1,331 @@
+"""
+Block compressed IQ storage.
+
+IQ files are raw complex64, which zip barely compresses (noise-like data) and
+which unzip expands back to full size. This codec stores samples in blocks
+of a fixed number of samples, each encoded on its own, with a block table at
+the end of the file so any sample range can be decoded without touching the
+rest::
+
+    header      IQZ_HEADER
+    blocks      encoded blocks
+    table       BLOCK_DTYPE record per block
+
+Lossless codecs (zlib and lzma from the standard library, zstd and lz4 when
+the zstandard/lz4 packages are installed) compress the complex64 bytes after
+a byte shuffle, which groups the exponent bytes of the floats together.
+Lossy codecs store I and Q as int16 or packed 12 bit integers with a scale
+factor per block. Decoding is vectorized straight into complex64 buffers.
+
+Encode a file with::
+
+    python -m rfsynth.otatestbed.iq_codec input.32cf output.iqz --codec int16
+"""
+
+import argparse
+import lzma
+import os
+import struct
+import zlib
+
+import numpy as np
+
+IQZ_EXTENSION = ".iqz"
+IQZ_MAGIC = b"RFSIQZ01"
+IQZ_VERSION = 1
+# magic, version, flags, codec name, num samples, block size, num blocks, table offset
+IQZ_HEADER = struct.Struct("<8sHH16sQIIQ")
+FLAG_SHUFFLE = 1
+DEFAULT_BLOCK_SIZE = 1 << 16  # samples
+SAMPLE_BYTES = np.dtype(np.complex64).itemsize
+
+BLOCK_DTYPE = np.dtype(
+    [
+        ("offset", np.uint64),  # bytes from the start of the file
+        ("nbytes", np.uint64),
+        ("num_samples", np.uint32),
+        ("scale", np.float32),  # lossy codecs only
+    ]
+)
+
+LOSSLESS_CODECS = ("raw", "zlib", "lzma", "zstd", "lz4")
+LOSSY_CODECS = ("int16", "int12")
+INT_MAX = {"int16": 32767, "int12": 2047}
+
+
+def is_compressed_iq(filepath: str):
+    return str(filepath).endswith(IQZ_EXTENSION)
+
+
+def _get_compressor(codec: str, level=None):
+    # Returns (compress, decompress) for the byte level codecs
+    if codec == "zlib":
+        level = 6 if level is None else level
+        return (lambda data: zlib.compress(data, level)), zlib.decompress
+    if codec == "lzma":
+        preset = 6 if level is None else level
+        return (lambda data: lzma.compress(data, preset=preset)), lzma.decompress
+    if codec == "zstd":
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("The zstd codec needs the zstandard package") from e
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+        decompressor = zstandard.ZstdDecompressor()
+        return compressor.compress, decompressor.decompress
+    if codec == "lz4":
+        try:
+            import lz4.frame
+        except ImportError as e:
+            raise ImportError("The lz4 codec needs the lz4 package") from e
+        compression_level = 0 if level is None else level
+        return (lambda data: lz4.frame.compress(data, compression_level)), lz4.frame.decompress
+    return (lambda data: data), (lambda data: data)
+
+
+def _shuffle(samples):
+    return np.ascontiguousarray(samples.view(np.uint8).reshape(-1, 4).T)
+
+
+def _unshuffle(data, num_samples, out):
+    out.view(np.uint8).reshape(-1, 4)[:] = np.frombuffer(data, dtype=np.uint8).reshape(4, 2 * num_samples).T
+
+
+def _pack_int12(values):
+    # Two 12 bit values in three bytes
+    values = values.astype(np.uint16) & 0xFFF
+    pairs = values.reshape(-1, 2)
+    packed = np.empty((len(pairs), 3), dtype=np.uint8)
+    packed[:, 0] = pairs[:, 0] & 0xFF
+    packed[:, 1] = (pairs[:, 0] >> 8) | ((pairs[:, 1] & 0xF) << 4)
+    packed[:, 2] = pairs[:, 1] >> 4
+    return packed
+
+
+def _unpack_int12(data):
+    packed = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int16)
+    values = np.empty((len(packed), 2), dtype=np.int16)
+    values[:, 0] = packed[:, 0] | ((packed[:, 1] & 0xF) << 8)
+    values[:, 1] = (packed[:, 1] >> 4) | (packed[:, 2] << 4)
+    # Sign extend from 12 bits
+    return ((values ^ 0x800) - 0x800).ravel()
+
+
+def encode_block(samples, codec: str, compress=None, shuffle: bool = True):
+    """
+    Encode one block of samples
+
+    :param samples: Samples of the block
+    :type samples: np.ndarray
+
+    :param codec: Codec name
+    :type codec: str
+
+    :param compress: Byte compressor of lossless codecs, from the codec by default
+    :type compress: callable or None
+
+    :param shuffle: Byte shuffle before compressing, lossless codecs only
+    :type shuffle: bool
+
+    :return: Encoded bytes and the block scale factor
+    :rtype: tuple[bytes, float]
+    """
+    samples = np.ascontiguousarray(samples, dtype=np.complex64)
+    if codec in LOSSY_CODECS:
+        floats = samples.view(np.float32)
+        peak = float(np.max(np.abs(floats))) if len(floats) else 0.0
+        scale = peak / INT_MAX[codec] if peak > 0 else 1.0
+        values = np.rint(floats / scale).astype(np.int16)
+        if codec == "int12":
+            return _pack_int12(values).tobytes(), scale
+        return values.tobytes(), scale
+
+    if compress is None:
+        compress = _get_compressor(codec)[0]
+    data = _shuffle(samples) if shuffle and codec != "raw" else samples
+    return compress(data.tobytes()), 1.0
+
+
+def encode_file(
+    src_path: str,
+    dst_path: str,
+    codec: str = "zlib",
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    level=None,
+    shuffle: bool = True,
+):
+    """
+    Encode a complex64 IQ file, block by block. Written to a temporary file
+    and moved into place.
+
+    :param src_path: complex64 IQ file
+    :type src_path: str
+
+    :param dst_path: Output file
+    :type dst_path: str
+
+    :param codec: One of LOSSLESS_CODECS or LOSSY_CODECS
+    :type codec: str
+
+    :param block_size: Samples per block, the unit of random access
+    :type block_size: int
+
+    :param level: Compression level of the lossless codecs
+    :type level: int or None
+
+    :param shuffle: Byte shuffle before compressing
+    :type shuffle: bool
+
+    :return: dst_path
+    :rtype: str
+    """
+    if codec not in LOSSLESS_CODECS + LOSSY_CODECS:
+        raise ValueError(f"Unknown IQ codec ({codec})")
+    compress = _get_compressor(codec, level)[0]
+    shuffle = shuffle and codec in LOSSLESS_CODECS and codec != "raw"
+    samples = np.memmap(src_path, dtype=np.complex64, mode="r")
+
+    tmp_path = f"{dst_path}.{os.getpid()}.tmp"
+    table = np.zeros(-(-len(samples) // block_size), dtype=BLOCK_DTYPE)
+    with open(tmp_path, "wb") as f:
+        f.seek(IQZ_HEADER.size)
+        for block_idx, start in enumerate(range(0, len(samples), block_size)):
+            block = samples[start : start + block_size]
+            data, scale = encode_block(block, codec, compress, shuffle)
+            table[block_idx] = (f.tell(), len(data), len(block), scale)
+            f.write(data)
+        table_offset = f.tell()
+        table.tofile(f)
+        f.seek(0)
+        f.write(
+            IQZ_HEADER.pack(
+                IQZ_MAGIC,
+                IQZ_VERSION,
+                FLAG_SHUFFLE if shuffle else 0,
+                codec.encode(),
+                len(samples),
+                block_size,
+                len(table),
+                table_offset,
+            )
+        )
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+
+class IqzReader:
+    """
+    Random access decoder of block compressed IQ files
+
+    :param filepath: Encoded IQ file
+    :type filepath: str
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        with open(filepath, "rb") as f:
+            header = IQZ_HEADER.unpack(f.read(IQZ_HEADER.size))
+        magic, version, flags, codec, num_samples, block_size, num_blocks, table_offset = header
+        if magic != IQZ_MAGIC:
+            raise ValueError(f"{filepath} is not a compressed IQ file")
+        if version != IQZ_VERSION:
+            raise ValueError(f"{filepath} has unsupported IQ codec version {version}")
+        self.codec = codec.rstrip(b"\0").decode()
+        self.shuffle = bool(flags & FLAG_SHUFFLE)
+        self.num_samples = num_samples
+        self.block_size = block_size
+        self.table = np.fromfile(filepath, dtype=BLOCK_DTYPE, count=num_blocks, offset=table_offset)
+        self._raw = np.memmap(filepath, dtype=np.uint8, mode="r")
+        self._decompress = _get_compressor(self.codec)[1]
+
+    def decode_block(self, block_idx: int, out):
+        """
+        Decode one block into out
+
+        :param block_idx: Block to decode
+        :type block_idx: int
+
+        :param out: complex64 buffer of at least the block's length
+        :type out: np.ndarray
+
+        :return: Number of samples decoded
+        :rtype: int
+        """
+        offset, nbytes, num_samples, scale = self.table[block_idx].tolist()
+        data = self._raw[offset : offset + nbytes]
+        out = out[:num_samples]
+        if self.codec in LOSSY_CODECS:
+            values = _unpack_int12(data) if self.codec == "int12" else np.frombuffer(data, dtype=np.int16)
+            np.multiply(values, np.float32(scale), out=out.view(np.float32))
+        elif self.shuffle:
+            _unshuffle(self._decompress(data), num_samples, out)
+        else:
+            out[:] = np.frombuffer(self._decompress(data), dtype=np.complex64)
+        return num_samples
+
+    def read(self, start: int = 0, count: int = None, out=None):
+        """
+        Decode count samples from start, only the blocks covering them are read
+
+        :param start: First sample
+        :type start: int
+
+        :param count: Number of samples, None for the rest of the file
+        :type count: int or None
+
+        :param out: Optional complex64 output buffer
+        :type out: np.ndarray or None
+
+        :return: The samples
+        :rtype: np.ndarray
+        """
+        stop = self.num_samples if count is None else min(start + count, self.num_samples)
+        start = min(start, stop)
+        if out is None:
+            out = np.empty(stop - start, dtype=np.complex64)
+        first_block = start // self.block_size
+        last_block = -(-stop // self.block_size)
+        block_buf = None
+        for block_idx in range(first_block, last_block):
+            block_start = block_idx * self.block_size
+            lo = max(start, block_start) - block_start
+            hi = min(stop, block_start + self.block_size) - block_start
+            dst = out[block_start + lo - start : block_start + hi - start]
+            if lo == 0 and hi == self.table[block_idx]["num_samples"]:
+                # Whole block, decode in place
+                self.decode_block(block_idx, dst)
+            else:
+                if block_buf is None:
+                    block_buf = np.empty(self.block_size, dtype=np.complex64)
+                self.decode_block(block_idx, block_buf)
+                dst[:] = block_buf[lo:hi]
+        return out
+
+    def iter_chunks(self, start: int = 0, stop: int = None):
+        """Decoded chunks of [start, stop), one block at a time"""
+        stop = self.num_samples if stop is None else min(stop, self.num_samples)
+        for chunk_start in range(start, stop, self.block_size):
+            yield self.read(chunk_start, min(self.block_size, stop - chunk_start))
+
+    def peak(self, start: int = 0, stop: int = None):
+        """Largest magnitude in [start, stop)"""
+        peak = 0.0
+        for chunk in self.iter_chunks(start, stop):
+            if len(chunk):
+                peak = max(peak, float(np.max(np.abs(chunk))))
+        return peak
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Encode a complex64 IQ file with a block codec")
+    parser.add_argument("src", type=str, help="complex64 IQ file")
+    parser.add_argument("dst", type=str, help="Output file")
+    parser.add_argument("--codec", type=str, default="zlib", choices=LOSSLESS_CODECS + LOSSY_CODECS)
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE, help="Samples per block")
+    parser.add_argument("--level", type=int, default=None, help="Compression level")
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    encode_file(args.src, args.dst, args.codec, args.block_size, args.level)
@@ -0,0 +1,336 @@
+"""
+Chunked, memory mapped IQ reading for streaming transmission.
+
+Handing a whole burst to ``blocks.vector_source_c`` needs the file in memory
+twice (numpy array and C++ vector), so files larger than RAM cannot be sent.
+Here a background thread reads the file through a memory map, chunk by chunk,
+into a bounded ring buffer that the flowgraph source drains. Only the ring
+buffer is resident, whatever the file size. Reading is restricted to a
+segment of the file that can be moved with :meth:`StreamingIqSource.seek`,
+so bursts can be cut from one large concatenated file by sample offset.
+Underruns (the consumer asking for samples the reader has not delivered yet)
+are counted and reported.
+"""
+
+import threading
+
+import numpy as np
+
+from rfsynth.otatestbed.iq_codec import IqzReader, is_compressed_iq
+from rfsynth.otatestbed.nco import frequency_shift
+from rfsynth.otatestbed.sample_format import Sc16Array, is_sc16_file
+
+DEFAULT_CHUNK_SIZE = 1 << 18  # samples per read
+DEFAULT_CAPACITY = 1 << 22  # samples in the ring buffer, 32 MiB of complex64
+DEFAULT_UNDERRUN_TIMEOUT_S = 0.005
+
+
+class MmapIqReader:
+    """
+    Random access to a complex64 IQ file through a memory map
+
+    :param filepath: IQ file
+    :type filepath: str
+
+    :param chunk_size: Samples per chunk in iter_chunks
+    :type chunk_size: int
+    """
+
+    def __init__(self, filepath: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.filepath = filepath
+        self.chunk_size = chunk_size
+        self._data = np.memmap(filepath, dtype=np.complex64, mode="r")
+
+    @property
+    def num_samples(self):
+        return len(self._data)
+
+    def read(self, start: int, count: int):
+        """View of count samples from start, shorter at the end of the file"""
+        return self._data[start : start + count]
+
+    def iter_chunks(self, start: int = 0, stop: int = None):
+        """Views of consecutive chunks of [start, stop)"""
+        stop = self.num_samples if stop is None else min(stop, self.num_samples)
+        for chunk_start in range(start, stop, self.chunk_size):
+            yield self._data[chunk_start : min(chunk_start + self.chunk_size, stop)]
+
+    def peak(self, start: int = 0, stop: int = None):
+        """Largest magnitude in [start, stop), read chunk by chunk"""
+        peak = 0.0
+        for chunk in self.iter_chunks(start, stop):
+            if len(chunk):
+                peak = max(peak, float(np.max(np.abs(chunk))))
+        return peak
+
+
+def open_iq_reader(filepath: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Random access reader for an IQ file, raw complex64, sc16 or block compressed
+
+    :return: Reader with num_samples, read, iter_chunks and peak
+    :rtype: MmapIqReader, IqzReader or Sc16Array
+    """
+    if is_compressed_iq(filepath):
+        return IqzReader(filepath)
+    if is_sc16_file(filepath):
+        return Sc16Array.from_file(filepath)
+    return MmapIqReader(filepath, chunk_size)
+
+
+class IqRingBuffer:
+    """
+    Bounded single producer, single consumer ring buffer of complex64 samples.
+    Callers hold the lock of the owning source.
+
+    :param capacity: Number of samples the buffer holds
+    :type capacity: int
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._buffer = np.zeros(capacity, dtype=np.complex64)
+        self._read_pos = 0
+        self.available = 0
+
+    @property
+    def free(self):
+        return self.capacity - self.available
+
+    def clear(self):
+        self._read_pos = 0
+        self.available = 0
+
+    def write(self, samples):
+        """
+        Append samples, as many as fit
+
+        :return: Number of samples written
+        :rtype: int
+        """
+        count = min(len(samples), self.free)
+        write_pos = (self._read_pos + self.available) % self.capacity
+        first = min(count, self.capacity - write_pos)
+        self._buffer[write_pos : write_pos + first] = samples[:first]
+        self._buffer[: count - first] = samples[first:count]
+        self.available += count
+        return count
+
+    def read_into(self, out):
+        """
+        Move samples into out, as many as are available
+
+        :return: Number of samples read
+        :rtype: int
+        """
+        count = min(len(out), self.available)
+        first = min(count, self.capacity - self._read_pos)
+        out[:first] = self._buffer[self._read_pos : self._read_pos + first]
+        out[first:count] = self._buffer[: count - first]
+        self._read_pos = (self._read_pos + count) % self.capacity
+        self.available -= count
+        return count
+
+
+class StreamingIqSource:
+    """
+    Streams a segment of an IQ file through a ring buffer filled by a reader
+    thread. Samples can be scaled, shifted in frequency and impaired on the way out.
+
+    :param capacity: Ring buffer size in samples
+    :type capacity: int
+
+    :param chunk_size: Samples per file read
+    :type chunk_size: int
+
+    :param underrun_timeout_s: How long read waits for samples before filling
+        the output with zeros and counting an underrun
+    :type underrun_timeout_s: float
+    """
+
+    def __init__(
+        self,
+        capacity: int = DEFAULT_CAPACITY,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        underrun_timeout_s: float = DEFAULT_UNDERRUN_TIMEOUT_S,
+    ):
+        self.chunk_size = min(chunk_size, capacity)
+        self.underrun_timeout_s = underrun_timeout_s
+        self.ring = IqRingBuffer(capacity)
+        self._staging = np.empty(self.chunk_size, dtype=np.complex64)
+        self._cond = threading.Condition()
+        self._reader = None
+        self._generation = 0  # bumped by every seek, stale reads are discarded
+        self._file_pos = 0
+        self._segment_start = 0
+        self._stop = 0
+        self._remaining = 0  # samples of the segment not handed out yet
+        self._closed = False
+
+        self.scale = 1.0
+        self.offset_hz = 0.0
+        self.sample_rate = 1.0
+        self.impairments = None
+        self._phase = 0.0
+
+        self.num_underruns = 0
+        self.underrun_samples = 0
+        self.samples_delivered = 0
+
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def open(self, filepath: str):
+        """Switch to another file, the segment is empty until seek is called"""
+        with self._cond:
+            if self._reader is None or self._reader.filepath != filepath:
+                self._reader = open_iq_reader(filepath, self.chunk_size)
+            self._set_segment(0, 0)
+
+    @property
+    def num_samples(self):
+        return 0 if self._reader is None else self._reader.num_samples
+
+    def _set_segment(self, start, length):
+        self._generation += 1
+        self._segment_start = start
+        self.ring.clear()
+        self._file_pos = start
+        self._stop = start + length
+        self._remaining = length
+        self._phase = 0.0
+        if self.impairments is not None:
+            self.impairments.reset()
+        self._cond.notify_all()
+
+    def seek(
+        self,
+        sample_offset: int,
+        length: int = None,
+        scale: float = 1.0,
+        offset_hz: float = 0.0,
+        sample_rate: float = 1.0,
+        impairments=None,
+    ):
+        """
+        Start streaming a segment of the open file
+
+        :param sample_offset: First sample of the segment
+        :type sample_offset: int
+
+        :param length: Samples in the segment, None for the rest of the file
+        :type length: int or None
+
+        :param scale: Factor applied to the samples
+        :type scale: float
+
+        :param offset_hz: Frequency shift applied to the samples
+        :type offset_hz: float
+
+        :param sample_rate: Sample rate for the frequency shift
+        :type sample_rate: float
+
+        :param impairments: Impairments applied after the shift
+        :type impairments: ImpairmentStream or None
+        """
+        num_samples = self.num_samples
+        if not 0 <= sample_offset <= num_samples:
+            raise ValueError(f"Sample offset {sample_offset} is outside the file ({num_samples} samples)")
+        if length is None:
+            length = num_samples - sample_offset
+        length = min(length, num_samples - sample_offset)
+        with self._cond:
+            self.scale = scale
+            self.offset_hz = offset_hz
+            self.sample_rate = sample_rate
+            self.impairments = impairments
+            self._set_segment(sample_offset, length)
+
+    def rewind(self):
+        """Stream the current segment again from its start"""
+        with self._cond:
+            self._set_segment(self._segment_start, self._stop - self._segment_start)
+
+    def _fill(self):
+        while True:
+            with self._cond:
+                while not self._closed and (
+                    self._reader is None or self._file_pos >= self._stop or self.ring.free < self.chunk_size
+                ):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                generation = self._generation
+                start = self._file_pos
+                count = min(self.chunk_size, self._stop - start)
+                reader = self._reader
+
+            # Page in and copy outside the lock, the consumer keeps draining meanwhile
+            staged = self._staging[:count]
+            np.copyto(staged, reader.read(start, count))
+
+            with self._cond:
+                if generation != self._generation:
+                    continue
+                self.ring.write(staged)
+                self._file_pos = start + count
+                self._cond.notify_all()
+
+    @property
+    def done(self):
+        """True once the whole segment was handed out"""
+        return self._remaining == 0
+
+    def read(self, out):
+        """
+        Fill out with the next samples of the segment. Waits up to
+        underrun_timeout_s for the reader, then fills the output with zeros
+        and counts an underrun.
+
+        :param out: Output buffer
+        :type out: np.ndarray
+
+        :return: Number of samples written to out, 0 once the segment is done
+        :rtype: int
+        """
+        with self._cond:
+            wanted = min(len(out), self._remaining)
+            if wanted == 0:
+                return 0
+            if self.ring.available == 0:
+                self._cond.wait_for(lambda: self.ring.available > 0, self.underrun_timeout_s)
+            count = self.ring.read_into(out[:wanted])
+            if count == 0:
+                # Keep the radio fed, the segment position does not advance
+                out[:wanted] = 0
+                self.num_underruns += 1
+                self.underrun_samples += wanted
+                return wanted
+            self._remaining -= count
+            self.samples_delivered += count
+            self._cond.notify_all()
+            scale, offset_hz, phase, impairments = self.scale, self.offset_hz, self._phase, self.impairments
+            if offset_hz:
+                self._phase = (phase + 2 * np.pi * offset_hz * count / self.sample_rate) % (2 * np.pi)
+
+        if scale != 1.0:
+            out[:count] *= scale
+        if offset_hz:
+            frequency_shift(out[:count], offset_hz, self.sample_rate, phase=phase, out=out[:count])
+        if impairments is not None:
+            impairments.process(out[:count], out=out[:count])
+        return count
+
+    def stats(self):
+        """Underrun and throughput counters"""
+        return {
+            "num_underruns": self.num_underruns,
+            "underrun_samples": self.underrun_samples,
+            "samples_delivered": self.samples_delivered,
+        }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
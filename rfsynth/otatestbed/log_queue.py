@@ -0,0 +1,217 @@
+"""
+Non-blocking logging for the real time transmit workers.
+
+Log calls in the transmit loop must not wait on disk or console I/O. Every
+process logs through a single ``QueueHandler`` on its root logger, which
+only puts the record on a multiprocessing queue. One ``QueueListener``
+thread in the parent process owns the file and console handlers and writes
+the records of all processes. Pool workers install their handler through
+:func:`executor_kwargs`, which also carries tracing into the workers.
+
+Repeated records (same logger, level and message template) are rate limited
+by :class:`RateLimitFilter` before they are queued. Log with lazy %
+formatting so repeats share the template. The number of suppressed records
+is appended to the next one let through and reported by
+:func:`report_suppressed`. Errors are never suppressed.
+"""
+
+import logging
+import logging.handlers
+import multiprocessing
+from pathlib import Path
+import sys
+import threading
+import time
+
+from rfsynth.otatestbed import tracing
+
+LOG_FORMAT = "%(asctime)s [%(processName)-15.15s] [%(name)s] [%(levelname)-5.5s] %(message)s"
+DEFAULT_RATE_LIMIT_INTERVAL_S = 1.0
+DEFAULT_RATE_LIMIT_BURST = 5
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most burst records of the same template through per interval
+
+    :param interval_s: Length of the rate limit window
+    :type interval_s: float
+
+    :param burst: Records of a template let through per window
+    :type burst: int
+    """
+
+    def __init__(self, interval_s: float = DEFAULT_RATE_LIMIT_INTERVAL_S, burst: int = DEFAULT_RATE_LIMIT_BURST):
+        super().__init__()
+        self.interval_s = interval_s
+        self.burst = burst
+        self._lock = threading.Lock()
+        # key: [window start, records in window, suppressed since the last one let through]
+        self._windows = {}
+        self.suppressed_total = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR or record.name == __name__:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval_s:
+                suppressed = 0 if window is None else window[2]
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = window[2]
+                window[2] = 0
+            else:
+                window[2] += 1
+                self.suppressed_total[key] = self.suppressed_total.get(key, 0) + 1
+                return False
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+    def pop_suppressed(self):
+        """Suppressed record counts per (logger, level, template) since the last call"""
+        with self._lock:
+            counts, self.suppressed_total = self.suppressed_total, {}
+            for window in self._windows.values():
+                window[2] = 0
+        return counts
+
+
+class _State:
+    def __init__(self):
+        self.queue = None
+        self.listener = None
+        self.log_file = None
+        self.level = logging.INFO
+        self.rate_limit = (DEFAULT_RATE_LIMIT_INTERVAL_S, DEFAULT_RATE_LIMIT_BURST)
+
+
+_state = _State()
+
+
+def _install_queue_handler(queue, level, rate_limit):
+    root = logging.getLogger()
+    # Replace whatever was set up before, so repeated setup never duplicates output
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.handlers.QueueHandler(queue)
+    handler.addFilter(RateLimitFilter(*rate_limit))
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
+
+
+def start_logging(
+    log_path: str = "./logs",
+    file_name: str = "rfsynth.log",
+    loglevel=logging.INFO,
+    rate_limit_interval_s: float = DEFAULT_RATE_LIMIT_INTERVAL_S,
+    rate_limit_burst: int = DEFAULT_RATE_LIMIT_BURST,
+):
+    """
+    Start the listener writing to a log file and stdout, and log this process
+    through the queue. Calling it again with the same file only updates the
+    level; with another file the previous listener is stopped first.
+
+    :param log_path: Directory of the log file, created if needed
+    :type log_path: str
+
+    :param file_name: Name of the log file
+    :type file_name: str
+
+    :param loglevel: Logging level
+    :type loglevel: int
+
+    :param rate_limit_interval_s: Rate limit window of repeated records
+    :type rate_limit_interval_s: float
+
+    :param rate_limit_burst: Repeated records let through per window
+    :type rate_limit_burst: int
+
+    :return: The listener
+    :rtype: logging.handlers.QueueListener
+    """
+    log_file = str(Path(log_path) / file_name)
+    _state.level = loglevel
+    _state.rate_limit = (rate_limit_interval_s, rate_limit_burst)
+    if _state.listener is not None and _state.log_file == log_file:
+        _install_queue_handler(_state.queue, loglevel, _state.rate_limit)
+        return _state.listener
+    stop_logging()
+
+    Path(log_path).mkdir(parents=True, exist_ok=True)
+    formatter = logging.Formatter(LOG_FORMAT)
+    file_handler = logging.FileHandler(log_file)
+    file_handler.setFormatter(formatter)
+    console_handler = logging.StreamHandler(stream=sys.stdout)
+    console_handler.setFormatter(formatter)
+
+    _state.queue = multiprocessing.Queue()
+    _state.listener = logging.handlers.QueueListener(
+        _state.queue, file_handler, console_handler, respect_handler_level=True
+    )
+    _state.listener.start()
+    _state.log_file = log_file
+    _install_queue_handler(_state.queue, loglevel, _state.rate_limit)
+    return _state.listener
+
+
+def stop_logging():
+    """Write out the queued records and stop the listener"""
+    if _state.listener is None:
+        return
+    report_suppressed()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    _state.listener.stop()
+    for handler in _state.listener.handlers:
+        handler.close()
+    _state.listener = None
+    _state.queue = None
+    _state.log_file = None
+
+
+def init_worker(queue, level, rate_limit, trace_initargs=None):
+    """Log a worker process through the parent's queue"""
+    # A forked worker inherits the parent's listener, which only the parent runs
+    _state.listener = None
+    _state.log_file = None
+    _state.queue = queue
+    _state.level = level
+    _state.rate_limit = rate_limit
+    _install_queue_handler(queue, level, rate_limit)
+    if trace_initargs is not None:
+        tracing.init_worker(*trace_initargs)
+
+
+def executor_kwargs():
+    """
+    Arguments for ProcessPoolExecutor that set up logging, and tracing when
+    it is on, in its workers
+
+    :rtype: dict
+    """
+    trace_kwargs = tracing.executor_kwargs()
+    if _state.queue is None:
+        return trace_kwargs
+    return {
+        "initializer": init_worker,
+        "initargs": (_state.queue, _state.level, _state.rate_limit, trace_kwargs.get("initargs")),
+    }
+
+
+def report_suppressed(logger=None):
+    """Log how many records the rate limit dropped in this process, per template"""
+    logger = logger or logging.getLogger(__name__)
+    for handler in logging.getLogger().handlers:
+        for log_filter in handler.filters:
+            if not isinstance(log_filter, RateLimitFilter):
+                continue
+            for (name, level, template), count in log_filter.pop_suppressed().items():
+                logger.info("%d records of %s suppressed: %s", count, name, template)
@@ -0,0 +1,135 @@
+"""
+Vectorized NCO/mixer for shifting IQ samples in frequency on the host.
+
+Shifting a burst digitally lets several energies share one LO setting of the
+radio: the data is mixed to its offset within the LO window instead of
+retuning the RF front end. The complex exponential tables are cached by
+(offset, length, sample rate), least recently used first out once they hold
+MIXER_CACHE_BYTES, and the samples are processed in chunks, so the
+per-burst cost is one complex multiply per sample.
+"""
+
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+# Total size of the cached mixer tables, 16 tables of a default chunk
+MIXER_CACHE_BYTES = 16 << 20
+
+
+class _TableCache:
+    # LRU cache bounded by the bytes of its tables rather than their number
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self._tables.move_to_end(key)
+            return table
+
+    def put(self, key, table):
+        if table.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._tables:
+                return
+            self._tables[key] = table
+            self.num_bytes += table.nbytes
+            while self.num_bytes > self.max_bytes:
+                _, evicted = self._tables.popitem(last=False)
+                self.num_bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self.num_bytes = 0
+
+
+_mixer_tables = _TableCache(MIXER_CACHE_BYTES)
+
+
+def get_mixer_table(offset_hz: float, length: int, sample_rate: float):
+    """
+    Get a (cached, read-only) table of exp(2j*pi*offset_hz*n/sample_rate)
+    for n in [0, length)
+
+    :param offset_hz: Frequency offset in Hz
+    :type offset_hz: float
+
+    :param length: Number of samples in the table
+    :type length: int
+
+    :param sample_rate: Sample rate in Hz
+    :type sample_rate: float
+
+    :return: The mixer table
+    :rtype: np.ndarray
+    """
+    key = (offset_hz, length, sample_rate)
+    table = _mixer_tables.get(key)
+    if table is None:
+        cycles = np.arange(length, dtype=np.float64) * (offset_hz / sample_rate)
+        table = np.exp(2j * np.pi * (cycles % 1.0))
+        table.setflags(write=False)
+        _mixer_tables.put(key, table)
+    return table
+
+
+def frequency_shift(
+    samples,
+    offset_hz: float,
+    sample_rate: float,
+    phase: float = 0.0,
+    out=None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+):
+    """
+    Shift samples in frequency by offset_hz. Phase is continuous across chunks.
+
+    :param samples: Complex samples to shift
+    :type samples: np.ndarray
+
+    :param offset_hz: Frequency offset in Hz
+    :type offset_hz: float
+
+    :param sample_rate: Sample rate in Hz
+    :type sample_rate: float
+
+    :param phase: Initial phase of the mixer in radians
+    :type phase: float
+
+    :param out: Optional output buffer, may be samples itself for an in-place shift
+    :type out: np.ndarray or None
+
+    :param chunk_size: Number of samples mixed per step
+    :type chunk_size: int
+
+    :return: The shifted samples
+    :rtype: np.ndarray
+    """
+    samples = np.asarray(samples)
+    if out is None:
+        dtype = samples.dtype if np.iscomplexobj(samples) else np.complex64
+        out = np.empty(samples.shape, dtype=dtype)
+
+    num_samples = len(samples)
+    if num_samples == 0:
+        return out
+
+    chunk_size = min(chunk_size, num_samples)
+    table = get_mixer_table(float(offset_hz), chunk_size, float(sample_rate))
+    cycles_per_sample = offset_hz / sample_rate
+    for start in range(0, num_samples, chunk_size):
+        stop = min(start + chunk_size, num_samples)
+        # Phase at the start of the chunk, wrapped in float64 to keep precision
+        chunk_phase = 2 * np.pi * ((start * cycles_per_sample) % 1.0) + phase
+        np.multiply(samples[start:stop], table[: stop - start], out=out[start:stop])
+        out[start:stop] *= np.exp(1j * chunk_phase)
+    return out
@@ -0,0 +1,129 @@
+"""
+Block-wise noise floor estimation for preamble thresholding.
+
+The noise floor of a correlation output is estimated as the (bias corrected)
+mean of its lowest fraction of magnitudes. :class:`NoiseFloorEstimator` takes
+the magnitudes one block at a time and only keeps the candidates that can
+still be among the lowest values overall, so the full correlation never has
+to be held or partitioned at once. When the total length is known up front
+the result equals the estimate over the whole array. Every block also gets
+its own estimate and threshold, kept as diagnostics.
+"""
+
+import numpy as np
+
+# Mean of the lowest values underestimates the noise floor, found empirically
+BIAS_CORRECTION = 20 * 3.1
+# Detection threshold as a multiple of the noise floor estimate
+THRESHOLD_FACTOR = 200
+# Fraction of the lowest magnitudes averaged for the estimate
+LOWEST_FRACTION = 0.001
+
+BLOCK_DIAGNOSTICS_DTYPE = np.dtype(
+    [
+        ("block_start", np.int64),
+        ("block_len", np.int64),
+        ("noise_est", np.float64),
+        ("threshold", np.float64),
+        ("block_peak", np.float64),
+    ]
+)
+
+
+def _num_lowest(num_samples, fraction):
+    return max(1, int(np.round(fraction * num_samples)))
+
+
+def _lowest(values, k):
+    if k >= len(values):
+        return values
+    return np.partition(values, k - 1)[:k]
+
+
+class NoiseFloorEstimator:
+    """
+    Streaming estimate of the noise floor of a correlation magnitude.
+
+    :param total_len: Total number of magnitudes that will be seen. Makes the
+        estimate exact, otherwise the lowest fraction is tracked as it grows
+    :type total_len: int or None
+
+    :param fraction: Fraction of the lowest magnitudes to average
+    :type fraction: float
+
+    :param bias_correction: Factor applied to the mean of the lowest magnitudes
+    :type bias_correction: float
+
+    :param threshold_factor: Threshold as a multiple of the noise floor
+    :type threshold_factor: float
+    """
+
+    def __init__(
+        self,
+        total_len: int = None,
+        fraction: float = LOWEST_FRACTION,
+        bias_correction: float = BIAS_CORRECTION,
+        threshold_factor: float = THRESHOLD_FACTOR,
+    ):
+        self.total_len = total_len
+        self.fraction = fraction
+        self.bias_correction = bias_correction
+        self.threshold_factor = threshold_factor
+        self.num_samples = 0
+        self._pool = np.zeros(0)
+        self._blocks = []
+
+    def _pool_size(self):
+        if self.total_len is not None:
+            return _num_lowest(self.total_len, self.fraction)
+        return _num_lowest(self.num_samples, self.fraction)
+
+    def update(self, magnitudes, block_start: int = None):
+        """
+        Add the next block of correlation magnitudes
+
+        :param magnitudes: Correlation magnitudes of the block
+        :type magnitudes: np.ndarray
+
+        :param block_start: Index of the first magnitude, for the diagnostics
+        :type block_start: int or None
+
+        :return: Noise floor estimate of this block alone
+        :rtype: float
+        """
+        if block_start is None:
+            block_start = self.num_samples
+        self.num_samples += len(magnitudes)
+
+        # Only the lowest pool_size values of a block can make it into the pool
+        pool_size = self._pool_size()
+        candidates = _lowest(magnitudes, pool_size)
+        self._pool = _lowest(np.concatenate((self._pool, candidates)), pool_size)
+
+        block_lowest = _lowest(candidates, _num_lowest(len(magnitudes), self.fraction))
+        block_est = self.bias_correction * np.average(block_lowest)
+        self._blocks.append(
+            (
+                block_start,
+                len(magnitudes),
+                block_est,
+                self.threshold_factor * block_est,
+                np.max(magnitudes),
+            )
+        )
+        return block_est
+
+    @property
+    def estimate(self):
+        """Noise floor estimate over all blocks seen so far"""
+        return self.bias_correction * np.average(_lowest(self._pool, self._pool_size()))
+
+    @property
+    def threshold(self):
+        """Detection threshold over all blocks seen so far"""
+        return self.threshold_factor * self.estimate
+
+    @property
+    def block_diagnostics(self):
+        """Per block start, length, noise estimate, threshold and peak magnitude"""
+        return np.array(self._blocks, dtype=BLOCK_DIAGNOSTICS_DTYPE)
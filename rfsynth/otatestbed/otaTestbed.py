@@ -2,35 +2,25 @@ import json
 import copy
 import sys
 import os
-from absl import flags
-from timeit import timeit
 import numpy as np
-from numpy.matlib import repmat
-from scipy import signal
-import matplotlib.pyplot as plt
-from config_file_parser import tx_config_parse, rx_config_parse
-from receiver import Receiver
-from transmitter import Transmitter
-from preamble import Preamble
-from fractions import Fraction
+from rfsynth.otatestbed.config_file_parser import tx_config_parse, rx_config_parse
+from rfsynth.otatestbed.receiver import Receiver
+from rfsynth.otatestbed.transmitter import Transmitter
+from rfsynth.otatestbed.preamble import Preamble
+from rfsynth.otatestbed.resampler import get_resampled_file, resample
+from rfsynth.otatestbed.sync_estimation import estimate_sync
+from rfsynth.otatestbed.spectrogram import SpectrogramEngine
+from rfsynth.otatestbed.qa_report import write_qa_report
+from rfsynth.otatestbed.burst_pack import BurstPack
+from rfsynth.otatestbed.iq_codec import IqzReader, is_compressed_iq
+from rfsynth.otatestbed.sample_format import (CPU_SC16, SC16_EXTENSION, Sc16Array,
+                                              is_sc16_file, write_sc16_file)
+from rfsynth.otatestbed import tracing
 import time
 import logging
 
-# decorater definition used for timing methods
-def timeit(f):
-    try:
-        def timed(self):
-            ts = time.time()            
-            result = f(self)
-            te = time.time()
-            print(f'{f.__qualname__} took: {te-ts:4.2f} seconds')            
-            return result        
-        return timed
-    except:
-        pass
-
 class OtaTestbed:
-    def __init__(self,rx_config_file,tx_config_file):
+    def __init__(self,rx_config_file,tx_config_file,channel_emulator=None,debug_plots=False):
         # Load radio configurations
         self.rx_config = self.load_config_json(rx_config_file)
         self.tx_config = self.load_config_json(tx_config_file)        
@@ -44,6 +34,9 @@ class OtaTestbed:
         # self.preamble_on = 40 # on-time (ms)
         self.preamble_seeds = np.random.randint(0,2**32,self.num_channels_tx)      
 
+        # Radios are emulated over a software channel when an emulator is given
+        self.channel_emulator = channel_emulator
+
         # Instantiate all radios
         self.receivers = self.initialize_receivers()
         self.transmitters = self.initialize_transmitters() 
@@ -58,7 +51,9 @@ class OtaTestbed:
                 for i,transmitter in enumerate(self.transmitters):
                     for j in range(transmitter.num_channels):
                         idxs = (i,j,n,m)
-                        preamble = Preamble(self.preamble_on, self.preamble_seeds[tx_ch_idx], self.fs, idxs)                      
+                        preamble = Preamble(self.preamble_on, self.preamble_seeds[tx_ch_idx], self.fs, idxs)
+                        # The full correlation is only kept when it is going to be plotted
+                        preamble.keep_xcorr = debug_plots
                         tx_ch_idx += 1
                         self.preambles_to_idxs_dict[preamble] = idxs # tracks tx_num,tx_ch_num,rx_num,rx_ch_num for each preamble
                         self.idxs_to_preambles_dict[idxs] = preamble
@@ -68,6 +63,7 @@ class OtaTestbed:
         self.preamble_on = self.tx_config['preambleOnTimeMs']
         self.fs = self.rx_config['radios'][0]['sampleRate']
         self.save_dir = self.rx_config['save_dir']
+        self.correct_cfo = self.rx_config.get('correctCfo', False)
         self.num_rx = len(self.rx_config['radios'])
         self.num_tx = len(self.tx_config['radios'])
 
@@ -81,31 +77,59 @@ class OtaTestbed:
 
         self.num_channels = self.num_channels_tx + self.num_channels_rx   
 
-    def read_from_file(self,filepath):
+    def read_from_file(self,filepath,file_sample_rate=None,burst=None):
+        if burst is not None:
+            # A single burst out of a burst pack, sliced from the mapped pack
+            data = BurstPack(filepath)[burst]
+            if file_sample_rate is not None and file_sample_rate != self.fs:
+                return resample(data, file_sample_rate, self.fs).astype(np.complex128)
+            return data.astype(np.complex128)
+        # Preambles live at the receiver rate, bring the file there first
+        if file_sample_rate is not None and file_sample_rate != self.fs:
+            filepath = get_resampled_file(filepath, file_sample_rate, self.fs)
+        if is_compressed_iq(filepath):
+            return IqzReader(filepath).read().astype(np.complex128)
+        if is_sc16_file(filepath):
+            return np.asarray(Sc16Array.from_file(filepath), dtype=np.complex128)
         data = np.fromfile(filepath,np.complex64).astype(np.complex128)
         return data
 
     def write_to_file(self,filepath, data):
+        if is_sc16_file(filepath):
+            write_sc16_file(filepath, data)
+            return
         with open(filepath, 'wb') as f:
             np.array(data, dtype=np.complex64).tofile(f)
         return
 
-    @timeit
+    @tracing.traced()
     def collect(self):        
         self.print_all_radio_settings()
 
         # Setup all preamble objects and insert preambles on data
         tx_signals = []
+        # One impaired variant per transmitter channel, the same for every receiver
+        impaired_data = {}
+        self.impairment_reports = {}
         for n,receiver in enumerate(self.receivers):
             for m in range(receiver.num_channels):                
                 for i,transmitter in enumerate(self.transmitters):
                     for j in range(transmitter.num_channels):
                         iq_filepath = transmitter.filepaths[j]
-                        data_to_tx = self.read_from_file(iq_filepath)
+                        data_to_tx = self.read_from_file(iq_filepath, transmitter.file_sample_rates[j], transmitter.bursts[j])
                         data_to_tx = (data_to_tx / np.max(np.abs(data_to_tx)) * 1)
+                        if transmitter.impairments.enabled:
+                            # Preambles stay clean, only the data is impaired
+                            if (i,j) not in impaired_data:
+                                variant = transmitter.impairments.draw()
+                                impaired_data[(i,j)] = variant.apply(data_to_tx, self.fs, normalize=True).astype(np.complex128)
+                                self.impairment_reports[(i,j)] = variant.to_dict()
+                            data_to_tx = impaired_data[(i,j)]
                         preamble = self.idxs_to_preambles_dict[(i,j,n,m)] 
                         tx_signal = preamble.insert(data_to_tx)
                         if n == 0:
+                            # Play the preamble and data back at the transmitter's rate
+                            tx_signal = resample(tx_signal, self.fs, transmitter.sample_rate)
                             tx_signals.append(tx_signal / np.max(np.abs(tx_signal)) * 0.8)
 
         # Place data into vector sources
@@ -145,7 +169,23 @@ class OtaTestbed:
                     for j in range(transmitter.num_channels):
                         preamble = self.idxs_to_preambles_dict[(i,j,n,m)]
                         #sliced_signals.append(preamble.remove(receiver.get_single_channel_data(m)))
-                        sliced_signal = preamble.remove(receiver.get_single_channel_data(m))
+                        preamble.remove(receiver.get_single_channel_data(m), sync=False)
+
+                # Fine timing and CFO of all preambles found in this capture at once
+                detected = [preamble for preamble in self.preambles
+                            if preamble.tx_rx_id[2:] == (n,m) and preamble.sliced_seq is not None]
+                if detected:
+                    sync_estimates = estimate_sync(detected[0].rx_seq,
+                                                   [preamble._pn_seq for preamble in detected],
+                                                   [preamble._max_peak_idx[0] for preamble in detected],
+                                                   self.fs)
+                    for preamble, sync_estimate in zip(detected, sync_estimates):
+                        preamble.set_sync_estimate(sync_estimate, self.correct_cfo)
+
+                for i,transmitter in enumerate(self.transmitters):
+                    for j in range(transmitter.num_channels):
+                        preamble = self.idxs_to_preambles_dict[(i,j,n,m)]
+                        sliced_signal = preamble.sliced_seq if preamble in detected else None
                         sliced_signals.append(sliced_signal)
 
                         if sliced_signal is not None:
@@ -159,10 +199,14 @@ class OtaTestbed:
                                 metadata_json = json.load(f)
 
                             # Get updated metadata
-                            updated_metadata_json = self.update_metadata(metadata_json,n,m,i,j) 
+                            updated_metadata_json = self.update_metadata(metadata_json,n,m,i,j,preamble.get_sync_report(),
+                                                                          self.impairment_reports.get((i,j)))
 
                             # Get new filenames
                             slice_filename = "Tx"+str(i)+"-"+str(j)+"_Rx"+str(n)+"-"+str(m)+"_"+iq_filename
+                            if receiver.cpu_format == CPU_SC16:
+                                # Slices are stored the way they were captured, as int16 pairs
+                                slice_filename = os.path.splitext(slice_filename)[0] + SC16_EXTENSION
                             new_metadata_filename = "Tx"+str(i)+"-"+str(j)+"_Rx"+str(n)+"-"+str(m)+"_"+metadata_filename
             
                             try:
@@ -186,7 +230,9 @@ class OtaTestbed:
                         receiver_num,
                         receiver_channel_num,
                         transmitter_num,
-                        transmitter_channel_num):
+                        transmitter_channel_num,
+                        sync_report=None,
+                        impairments=None):
 
         updated_metadata = copy.deepcopy(metadata)
         receiver = copy.deepcopy(self.rx_config['radios'][receiver_num])
@@ -203,19 +249,25 @@ class OtaTestbed:
         # Update siggen metadata
         updated_metadata['receiver_config'] = receiver
         updated_metadata['transmitter_config'] = transmitter        
+        if sync_report is not None:
+            updated_metadata['preamble_sync'] = sync_report
+        if impairments is not None:
+            updated_metadata['impairments'] = impairments
         return updated_metadata
 
     def initialize_receivers(self):
         receivers = []
+        flowgraph = None if self.channel_emulator is None else self.channel_emulator.receiver_flowgraph
         for radio_config_d in self.rx_config['radios']:
-            receiver = Receiver(radio_config_d)
+            receiver = Receiver(radio_config_d, flowgraph)
             receivers.append(receiver)
         return receivers
 
     def initialize_transmitters(self):
         transmitters = []
+        flowgraph = None if self.channel_emulator is None else self.channel_emulator.transmitter_flowgraph
         for radio_config_d in self.tx_config['radios']:
-            transmitter = Transmitter(radio_config_d)
+            transmitter = Transmitter(radio_config_d, flowgraph)
             transmitters.append(transmitter)
         return transmitters
 
@@ -228,23 +280,40 @@ class OtaTestbed:
             print("RECEIVER", i)
             receiver.print_settings()
 
-    @timeit
+    @tracing.traced()
     def show_debug_plots(self):
+        import matplotlib.pyplot as plt
+
         ## Visualizations
+        # One engine for all plots so the window and frame buffer are reused
+        spectrogram_engine = SpectrogramEngine(self.fs)
         for preamble in self.preambles:
             try:                
                 preamble.plot_debug_xcorr(self.preambles_to_idxs_dict[preamble])
                 preamble.plot_debug_tx_time(self.preambles_to_idxs_dict[preamble])
                 preamble.plot_debug_rx_time(self.preambles_to_idxs_dict[preamble])
-                # preamble.plot_debug_spectrograms(self.preambles_to_idxs_dict[preamble])
+                preamble.plot_debug_spectrograms(self.preambles_to_idxs_dict[preamble], spectrogram_engine)
                 plt.show()
             except:
                 print('A problem occured while plotting.')
 
+    @tracing.traced()
+    def write_qa_report(self, out_dir=None):
+        # Headless alternative to show_debug_plots, see qa_report
+        if out_dir is None:
+            out_dir = os.path.join(self.save_dir, 'qa_report')
+        metas = [self.preambles_to_idxs_dict[preamble] for preamble in self.preambles]
+        return write_qa_report(self.preambles, metas, self.fs, out_dir)
+
 if __name__ == "__main__":
-        
+    from absl import flags
+
     flags.DEFINE_string("rx_config_file", None, "RX config file to use")
     flags.DEFINE_string("tx_config_file", None, "TX config file to use")
+    flags.DEFINE_string("trace_file", None, "Write a Chrome trace of the collection to this file")
+    flags.DEFINE_list("profile_stages", [], "Trace stages to sample with the profiler")
+    flags.DEFINE_string("channel_emulator_file", None, "Run over an emulated channel with this config instead of radios")
+    flags.DEFINE_bool("debug_plots", True, "Show the debug plots of every Tx/Rx pair after the collection")
 
     FLAGS = flags.FLAGS
     FLAGS(sys.argv)
@@ -256,9 +325,23 @@ if __name__ == "__main__":
     tx_config_file = FLAGS.tx_config_file
     rx_config_file = 'configs/rx_config_scenario1.json'
     tx_config_file = 'configs/tx_config_scenario1.json'
+    collector = tracing.start_collector(FLAGS.profile_stages) if FLAGS.trace_file else None
     # import pdb; pdb.set_trace()
-    otaTestbed = OtaTestbed(rx_config_file,tx_config_file)
-    
-    otaTestbed.collect()
+    channel_emulator = None
+    if FLAGS.channel_emulator_file:
+        from rfsynth.otatestbed.channel_emulator import ChannelEmulator
+
+        channel_emulator = ChannelEmulator.from_file(FLAGS.channel_emulator_file)
+    try:
+        otaTestbed = OtaTestbed(rx_config_file,tx_config_file,channel_emulator,FLAGS.debug_plots)
+
+        otaTestbed.collect()
+        if channel_emulator is not None:
+            for score in channel_emulator.score_detections(otaTestbed.preambles):
+                print(score)
+    finally:
+        if collector is not None:
+            collector.write(FLAGS.trace_file)
     # import pdb; pdb.set_trace()
-    otaTestbed.show_debug_plots()
+    if FLAGS.debug_plots:
+        otaTestbed.show_debug_plots()
@@ -1,8 +1,14 @@
+from functools import lru_cache
 import numpy as np
 import scipy.signal as signal
 from fractions import Fraction
-import matplotlib.pyplot as plt
-from numpy.matlib import repmat
+from rfsynth.otatestbed.noise_floor import NoiseFloorEstimator
+from rfsynth.otatestbed.sync_estimation import estimate_sync, correct_cfo
+from rfsynth.otatestbed.spectrogram import SpectrogramEngine, get_color_bounds
+
+# PN templates kept, one per (seed, pn_sym_len, sps, shape). A template is a
+# whole preamble of complex128, 16 MB for 100 ms at 10 MS/s.
+PN_CACHE_SIZE = 16
 
 class Preamble:
     """This class is used to add and remove preambles from a sequence of samples"""
@@ -10,6 +16,11 @@ class Preamble:
     # pn_sym_len = 1024 # symbol length of all preambles
     pn_mod_order = 2 # should be two to minimize symbol error probability
     # pn_len = pn_sym_len*sps
+    rrc_beta = 0.35 # roll-off of the 'rrc' pulse shape
+    rrc_span = 8 # length of the 'rrc' pulse shape in symbols
+    detect_block_len = 1 << 22 # correlation outputs computed per detection block
+    keep_xcorr = False # keep the full correlation for the debug plots, set per instance by OtaTestbed
+
 
     def __init__(self, preamble_on_time_ms=100, seed=1234, fs=1, tx_rx_id=None):
         self.fs = fs
@@ -21,6 +32,9 @@ class Preamble:
         self.sliced_seq = None 
         self.start_time = None    
         self.stop_time =  None 
+        self.frac_delay = 0.0
+        self.cfo_est = 0.0
+        self.phase_est = 0.0
         self.pn_sym_len = np.ceil(preamble_on_time_ms*1e-3*fs/Preamble.sps).astype(int)
 
     def insert(self, in_seq=np.array([1,2,3]), shape='square'):
@@ -30,16 +44,19 @@ class Preamble:
         self.padded_seq = np.concatenate((pn_seq,in_seq))
         return self.padded_seq
 
-    def remove(self, in_seq=np.array([1,2,3]), shape='square'):
+    def remove(self, in_seq=np.array([1,2,3]), shape='square', sync=True, correct=False):
         self.rx_seq = in_seq
+        self.sliced_seq = None
         self._pn_seq = self._get_pn_seq(shape)
         # xcorr = np.correlate(in_seq, pn_seq,mode='valid')/len(pn_seq) # does not use fft based method
-        self._xcorr = signal.correlate(in_seq, self._pn_seq, mode='valid')/len(self._pn_seq)
-        self._noise_pow_est = self._get_noise_pow_est(np.abs(self._xcorr))
-        self._threshold = 200*self._noise_pow_est # should be a multiple of the estimated noise floor 460
-        peak_indices = np.argwhere(np.abs(self._xcorr) > self._threshold) # there can be many samples above the threshold
-        if len(peak_indices) > 0:
-            self._max_peak_idx = peak_indices[np.argmax(np.abs(self._xcorr[peak_indices]))] # now find the max of all samples above the threshold            
+        peak_idx, peak_val = self._detect_blocks(in_seq)
+        self._peak_val = float(peak_val)
+        self._noise_pow_est = self._noise_floor.estimate
+        self._threshold = self._noise_floor.threshold # should be a multiple of the estimated noise floor 460
+        self.noise_floor_blocks = self._noise_floor.block_diagnostics
+        # the max of all samples above the threshold is the max over all blocks
+        if peak_val > self._threshold:
+            self._max_peak_idx = np.array([peak_idx])
         else:
             self._max_peak_idx = []
         if len(self._max_peak_idx) != 1:
@@ -53,9 +70,58 @@ class Preamble:
             self.sliced_seq = in_seq[self.start_idx:self.stop_idx]  
             self.start_time = self.start_idx/self.fs     
             self.stop_time =  self.stop_idx/self.fs    
+            if sync:
+                self.set_sync_estimate(estimate_sync(in_seq, [self._pn_seq], self._max_peak_idx, self.fs)[0], correct)
             return self.sliced_seq
 
+    def set_sync_estimate(self, estimate, correct=False):
+        # estimate is a record of sync_estimation.SYNC_ESTIMATE_DTYPE for this detection
+        self.frac_delay = float(estimate['frac_delay'])
+        self.cfo_est = float(estimate['cfo_hz'])
+        self.phase_est = float(estimate['phase_rad'])
+        self.start_time = (self.start_idx+self.frac_delay)/self.fs
+        self.stop_time = (self.stop_idx+self.frac_delay)/self.fs
+        if correct:
+            # The slice is a view into the received sequence, which the debug plots
+            # show as received, so a copy is corrected
+            data_phase = self.phase_est + 2*np.pi*self.cfo_est*len(self._pn_seq)/self.fs
+            self.sliced_seq = correct_cfo(self.sliced_seq.copy(), self.cfo_est, data_phase, self.fs)
+
+    def get_sync_report(self):
+        return {
+            'start_idx': int(self.start_idx),
+            'frac_delay': self.frac_delay,
+            'start_time': self.start_time,
+            'stop_time': self.stop_time,
+            'cfo_hz': self.cfo_est,
+            'phase_rad': self.phase_est,
+        }
+
+    def _detect_blocks(self, in_seq):
+        # Correlate block by block, only the noise floor candidates and the
+        # running peak are kept unless the full correlation is wanted for plots
+        pn_len = len(self._pn_seq)
+        num_valid = max(0, len(in_seq) - pn_len + 1)
+        self._noise_floor = NoiseFloorEstimator(total_len=num_valid)
+        self._xcorr = np.empty(num_valid, dtype=np.complex64) if self.keep_xcorr else None
+        peak_idx, peak_val = 0, -np.inf
+        for block_start in range(0, num_valid, self.detect_block_len):
+            block_stop = min(block_start + self.detect_block_len, num_valid)
+            xcorr = signal.correlate(in_seq[block_start:block_stop + pn_len - 1], self._pn_seq, mode='valid')/pn_len
+            xcorr_mag = np.abs(xcorr)
+            self._noise_floor.update(xcorr_mag, block_start)
+            block_peak = np.argmax(xcorr_mag)
+            if xcorr_mag[block_peak] > peak_val:
+                peak_idx, peak_val = block_start + block_peak, xcorr_mag[block_peak]
+            if self._xcorr is not None:
+                self._xcorr[block_start:block_stop] = xcorr
+        return peak_idx, peak_val
+
     def plot_debug_xcorr(self, meta=None):
+        import matplotlib.pyplot as plt
+
+        if self._xcorr is None:
+            raise RuntimeError('The correlation was not kept, set keep_xcorr before remove to plot it')
         # debug plots to see correlation peak
         plt.subplot(311)
         plt.plot(np.abs(self._xcorr))        
@@ -86,20 +152,21 @@ class Preamble:
             plt.title(f'Sliced Output Tx{tx_num}:{tx_ch_num}-Rx{rx_num}:{rx_ch_num}')
         plt.tight_layout()
 
-    def plot_debug_spectrograms(self, meta=None):        
-        f_orig,t_orig,Sxx_orig = signal.spectrogram(self.orig_seq+self.eps, fs=self.fs, window=('hamming'), nperseg=256, noverlap=128, nfft=256, \
-                detrend=False, return_onesided=False, scaling='density', axis=-1, mode='complex')
-        f_in,t_in,Sxx_rx = signal.spectrogram(self.rx_seq, fs=self.fs, window=('hamming'), nperseg=256, noverlap=128, nfft=256, \
-                detrend=False, return_onesided=False, scaling='density', axis=-1, mode='complex')
+    def plot_debug_spectrograms(self, meta=None, engine=None):        
+        import matplotlib.pyplot as plt
+
+        if engine is None:
+            engine = SpectrogramEngine(self.fs)
+        f_orig,t_orig,Sxx_orig = engine.compute(self.orig_seq)
+        f_in,t_in,Sxx_rx = engine.compute(self.rx_seq)
         if self.sliced_seq is not None:
-            f_out,t_out,Sxx_sliced = signal.spectrogram(self.sliced_seq, fs=self.fs, window=('hamming'), nperseg=256, noverlap=128, nfft=256, \
-                detrend=False, return_onesided=False, scaling='density', axis=-1, mode='complex')
+            f_out,t_out,Sxx_sliced = engine.compute(self.sliced_seq)
         # clo_orig, chi_orig = self._get_spectro_color_bounds(Sxx_orig)
         clo_rx, chi_rx = self._get_spectro_color_bounds(Sxx_rx)
         # clo_sliced, chi_sliced = self._get_spectro_color_bounds(Sxx_sliced)
         plt.figure()
         plt.subplot(131)
-        plt.pcolormesh(np.fft.fftshift(f_orig)*1e-6, t_orig*1e3, np.transpose(10*np.log10(1/256*np.abs(np.fft.fftshift(Sxx_orig,axes=0))**2+self.eps)), cmap='jet', vmin=clo_rx, vmax=chi_rx)  
+        plt.pcolormesh(f_orig*1e-6, t_orig*1e3, 10*np.log10(Sxx_orig+self.eps), cmap='jet', vmin=clo_rx, vmax=chi_rx)  
         plt.xlabel('Frequency (MHz)'); plt.ylabel('Time (ms)'); 
         if meta is None: 
             plt.title('Input')
@@ -107,7 +174,7 @@ class Preamble:
             tx_num = meta[0]; tx_ch_num = meta[1]; rx_num = meta[2]; rx_ch_num = meta[3]
             plt.title(f'Input Tx{tx_num}:{tx_ch_num}-Rx{rx_num}:{rx_ch_num}')
         plt.subplot(132)
-        plt.pcolormesh(np.fft.fftshift(f_in)*1e-6, t_in*1e3, np.transpose(10*np.log10(1/256*np.abs(np.fft.fftshift(Sxx_rx,axes=0))**2)), cmap='jet', vmin=clo_rx, vmax=chi_rx)  
+        plt.pcolormesh(f_in*1e-6, t_in*1e3, 10*np.log10(Sxx_rx+self.eps), cmap='jet', vmin=clo_rx, vmax=chi_rx)  
         plt.xlabel('Frequency (MHz)'); plt.ylabel('Time (ms)'); 
         if meta is None: 
             plt.title('Received')
@@ -115,7 +182,7 @@ class Preamble:
             plt.title(f'Received Tx{tx_num}:{tx_ch_num}-Rx{rx_num}:{rx_ch_num}')
         if self.sliced_seq is not None:
             plt.subplot(133)
-            plt.pcolormesh(np.fft.fftshift(f_out)*1e-6, t_out*1e3, np.transpose(10*np.log10(1/256*np.abs(np.fft.fftshift(Sxx_sliced,axes=0))**2)), cmap='jet', vmin=clo_rx, vmax=chi_rx)
+            plt.pcolormesh(f_out*1e-6, t_out*1e3, 10*np.log10(Sxx_sliced+self.eps), cmap='jet', vmin=clo_rx, vmax=chi_rx)
             plt.colorbar() 
             plt.xlabel('Frequency (MHz)'); plt.ylabel('Time (ms)'); 
             if meta is None: 
@@ -124,6 +191,8 @@ class Preamble:
                 plt.title(f'Sliced Tx{tx_num}:{tx_ch_num}-Rx{rx_num}:{rx_ch_num}')       
 
     def plot_debug_tx_time(self, meta=None):
+        import matplotlib.pyplot as plt
+
         ## plot original sequence and preamble added sequence        
         plt.figure()
         plt.subplot(221)
@@ -158,6 +227,8 @@ class Preamble:
         plt.tight_layout()    
 
     def plot_debug_rx_time(self, meta=None):  
+        import matplotlib.pyplot as plt
+
         ## plot received sequence and compare sliced to original sequence
         # scale sequences so the max values coincide to help visually compare
         rx_seq = self.rx_seq/np.max(np.abs(self.rx_seq))
@@ -202,38 +273,45 @@ class Preamble:
         plt.tight_layout()
 
     def _get_spectro_color_bounds(self, Sxx):
-        specv = np.ravel(10*np.log10(1/256*np.abs(Sxx)**2+self.eps))
-        # specv = 10*np.log10(np.ravel(Sxx))
-        num_min_vals = np.round(.1*len(specv)).astype(int)
-        mink_vals = specv[np.argpartition(specv,num_min_vals)[:num_min_vals]]
-        clo = np.average(mink_vals)+10; 
-        chi = np.max(specv)-10
-        return clo, chi
+        # Sxx is a power spectrogram from SpectrogramEngine
+        return get_color_bounds(10*np.log10(Sxx+self.eps))
 
     def _get_pn_seq(self, shape):
-        np.random.seed(self.seed)
-        if shape.casefold() == 'rrc':        
-            pass
-        else:
-            pn_symbols = 2*np.random.randint(0,Preamble.pn_mod_order,size=self.pn_sym_len)-1 + \
-                1j*(2*np.random.randint(0,Preamble.pn_mod_order,size=self.pn_sym_len)-1)
-            pn_seq = np.matlib.repmat(pn_symbols,Preamble.sps,1).flatten('F')
-
-        return pn_seq
-
-    def _get_noise_pow_est(self, in_seq):
-        # _,_,psd = signal.spectrogram(in_seq, fs=self.fs, window=('hamming'), nperseg=256, noverlap=128, nfft=256, \
-        #     detrend=False, return_onesided=False, scaling='density', axis=-1, mode='psd')
-        # plt.pcolormesh(fft.fftshift(f)*1e-6, t*1e3, np.transpose(np.abs(fft.fftshift(Sxx,axes=0))), cmap='jet')  
-        # plt.show()  
-        # b = Sxx.reshape(-1,10,256)
-        # c = np.mean(b,axis=1)
-        k = np.round(0.001*len(in_seq)).astype(int) # the number of minimum samples to use for noise floor estimate
-        # Sxx_mink = np.average(Sxx[np.argpartition(np.ravel(Sxx),k)[:k]])
-        # Sxx_vec = np.ravel(psd)
-        # pow_est = np.average(Sxx_vec[np.argpartition(Sxx_vec,k)[:k]])
-        bias_correction = 20*3.1 # empirically found
-        return bias_correction*np.average(in_seq[np.argpartition(in_seq,k)[:k]])
+        # Templates are shared between instances and threads, see _get_pn_template
+        return _get_pn_template(int(self.seed), int(self.pn_sym_len), Preamble.sps, shape.casefold())
+
+@lru_cache(maxsize=PN_CACHE_SIZE)
+def _get_pn_template(seed, pn_sym_len, sps, shape):
+    # Read-only PN template. The generator is owned by this call, the global
+    # numpy RNG is never touched.
+    rng = np.random.default_rng(seed)
+    bits = rng.integers(0, Preamble.pn_mod_order, size=(2, pn_sym_len))
+    pn_symbols = (2*bits[0]-1) + 1j*(2*bits[1]-1)
+    if shape == 'rrc':
+        taps = _get_rrc_taps(sps, Preamble.rrc_span, Preamble.rrc_beta)
+        delay = (len(taps)-1)//2
+        pn_seq = signal.upfirdn(taps, pn_symbols, up=sps)[delay:delay+pn_sym_len*sps]
+    else:
+        pn_seq = np.repeat(pn_symbols, sps)
+    pn_seq.setflags(write=False)
+    return pn_seq
+
+@lru_cache(maxsize=8)
+def _get_rrc_taps(sps, span, beta):
+    # Root raised cosine pulse with unit energy, span symbols long
+    t = np.arange(-span*sps//2, span*sps//2+1)/sps
+    taps = np.empty(len(t))
+    center = t == 0
+    edge = np.isclose(np.abs(t), 1/(4*beta)) if beta > 0 else np.zeros(len(t), dtype=bool)
+    rest = ~(center | edge)
+    taps[center] = 1 - beta + 4*beta/np.pi
+    taps[edge] = beta/np.sqrt(2)*((1+2/np.pi)*np.sin(np.pi/(4*beta)) + (1-2/np.pi)*np.cos(np.pi/(4*beta)))
+    tr = t[rest]
+    taps[rest] = (np.sin(np.pi*tr*(1-beta)) + 4*beta*tr*np.cos(np.pi*tr*(1+beta))) / \
+        (np.pi*tr*(1-(4*beta*tr)**2))
+    taps = taps/np.sqrt(np.sum(taps**2))*np.sqrt(sps)
+    taps.setflags(write=False)
+    return taps
 
 if __name__ == "__main__":  
     fs = 10e6 # sample rate
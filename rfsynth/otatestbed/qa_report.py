@@ -0,0 +1,263 @@
+"""
+Headless QA report for OtaTestbed captures.
+
+Instead of showing interactive figures one preamble at a time, the report
+reduces each Tx/Rx pair to min/max envelopes and a display sized spectrogram
+in the parent process, renders the figures in worker processes without any
+GUI backend, and writes a PNG and a machine readable summary JSON per pair
+with the detection figures of merit, an index.html and a summary.json of all
+pairs.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import html
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+from rfsynth.otatestbed.spectrogram import SpectrogramEngine, get_color_bounds
+
+logger = logging.getLogger(__name__)
+
+ENVELOPE_BINS = 2000
+
+
+def minmax_envelope(samples, num_bins: int = ENVELOPE_BINS):
+    """
+    Reduce a trace to the min and max of num_bins equal bins, which preserves
+    its visual extent at a fraction of the points
+
+    :param samples: Real valued trace
+    :type samples: np.ndarray
+
+    :param num_bins: Number of bins
+    :type num_bins: int
+
+    :return: Index of the first sample of every bin, bin minima and bin maxima
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    samples = np.asarray(samples)
+    if len(samples) <= 2 * num_bins:
+        return np.arange(len(samples)), samples, samples
+    bin_len = len(samples) // num_bins
+    usable = bin_len * num_bins
+    bins = samples[:usable].reshape(num_bins, bin_len)
+    lows = bins.min(axis=1)
+    highs = bins.max(axis=1)
+    if usable < len(samples):
+        lows = np.append(lows, samples[usable:].min())
+        highs = np.append(highs, samples[usable:].max())
+    return np.arange(len(lows)) * bin_len, lows, highs
+
+
+def _db(value):
+    return float(20 * np.log10(value)) if value > 0 else None
+
+
+def get_pair_summary(preamble, meta):
+    """
+    Figures of merit of one Tx/Rx pair
+
+    :param preamble: Preamble object after remove was called
+    :type preamble: Preamble
+
+    :param meta: (tx_num, tx_ch_num, rx_num, rx_ch_num)
+    :type meta: tuple
+
+    :return: Summary dictionary
+    :rtype: dict
+    """
+    detected = preamble.sliced_seq is not None
+    peak = None
+    if detected:
+        peak = preamble._peak_val
+    elif len(preamble.noise_floor_blocks):
+        peak = float(np.max(preamble.noise_floor_blocks["block_peak"]))
+
+    summary = {
+        "pair": "Tx{}:{}-Rx{}:{}".format(*meta),
+        "detected": detected,
+        "peak_snr_db": _db(peak / preamble._noise_pow_est) if peak else None,
+        "correlation_margin_db": _db(peak / preamble._threshold) if peak else None,
+        "slice_length": int(len(preamble.sliced_seq)) if detected else 0,
+    }
+    if detected:
+        summary.update(preamble.get_sync_report())
+    return summary
+
+
+def get_pair_payload(preamble, meta, engine, num_bins: int = ENVELOPE_BINS):
+    """
+    Everything the worker needs to draw one pair, reduced to display size so
+    that shipping it to the worker process is cheap
+
+    :param preamble: Preamble object after remove was called
+    :type preamble: Preamble
+
+    :param meta: (tx_num, tx_ch_num, rx_num, rx_ch_num)
+    :type meta: tuple
+
+    :param engine: Spectrogram engine for the received signal
+    :type engine: SpectrogramEngine
+
+    :param num_bins: Number of envelope bins per trace
+    :type num_bins: int
+
+    :return: Payload dictionary
+    :rtype: dict
+    """
+    payload = {"summary": get_pair_summary(preamble, meta), "fs": preamble.fs}
+    payload["rx"] = minmax_envelope(np.real(preamble.rx_seq), num_bins)
+    payload["orig"] = minmax_envelope(np.real(preamble.orig_seq), num_bins)
+    if preamble.sliced_seq is not None:
+        payload["sliced"] = minmax_envelope(np.real(preamble.sliced_seq), num_bins)
+        payload["slice_bounds"] = (preamble.start_idx, preamble.stop_idx)
+    if preamble._xcorr is not None:
+        payload["xcorr"] = minmax_envelope(np.abs(preamble._xcorr), num_bins)
+    payload["levels"] = (preamble._noise_pow_est, preamble._threshold)
+
+    freqs, times, power = engine.compute(preamble.rx_seq)
+    power_db = 10 * np.log10(power + preamble.eps)
+    payload["spectrogram"] = (freqs, times, power_db, get_color_bounds(power_db))
+    return payload
+
+
+def render_pair(payload, png_path: str):
+    """
+    Draw one pair to a PNG file. Uses the Agg canvas directly, no GUI backend
+    or pyplot state is involved, so it is safe in worker processes.
+
+    :param payload: Payload from get_pair_payload
+    :type payload: dict
+
+    :param png_path: Output file
+    :type png_path: str
+
+    :return: png_path
+    :rtype: str
+    """
+    from matplotlib.figure import Figure
+
+    fs = payload["fs"]
+    title = payload["summary"]["pair"]
+    fig = Figure(figsize=(14, 10))
+    axes = fig.subplots(2, 2)
+
+    def fill(ax, envelope, scale=1.0, **kwargs):
+        idx, lows, highs = envelope
+        ax.fill_between(idx * scale, lows, highs, linewidth=0.5, **kwargs)
+
+    ax = axes[0, 0]
+    if "xcorr" in payload:
+        fill(ax, payload["xcorr"], color="b")
+        noise, threshold = payload["levels"]
+        ax.axhline(threshold, color="k", linestyle="--", label="threshold")
+        ax.axhline(noise, color="b", linestyle="--", label="noise floor")
+        ax.legend(loc="upper right")
+    ax.set_xlabel("Sample Delay")
+    ax.set_ylabel("|xcorr|")
+    ax.set_title(f"Cross-correlation Output {title}")
+
+    ax = axes[0, 1]
+    fill(ax, payload["rx"], 1e3 / fs, color="b")
+    if "slice_bounds" in payload:
+        for bound in payload["slice_bounds"]:
+            ax.axvline(bound * 1e3 / fs, color="k", linestyle="--")
+    ax.set_xlabel("Time (ms)")
+    ax.set_ylabel("Real Amplitude")
+    ax.set_title(f"Received Signal {title}")
+
+    ax = axes[1, 0]
+    fill(ax, payload["orig"], 1e3 / fs, color="b", alpha=0.6, label="transmitted")
+    if "sliced" in payload:
+        fill(ax, payload["sliced"], 1e3 / fs, color="r", alpha=0.6, label="sliced")
+    ax.legend(loc="upper right")
+    ax.set_xlabel("Time (ms)")
+    ax.set_ylabel("Real Amplitude")
+    ax.set_title(f"Real Part Compare Tx/Rx {title}")
+
+    ax = axes[1, 1]
+    freqs, times, power_db, (clo, chi) = payload["spectrogram"]
+    mesh = ax.pcolormesh(freqs * 1e-6, times * 1e3, power_db, cmap="jet", vmin=clo, vmax=chi)
+    fig.colorbar(mesh, ax=ax)
+    ax.set_xlabel("Frequency (MHz)")
+    ax.set_ylabel("Time (ms)")
+    ax.set_title(f"Received {title}")
+
+    fig.tight_layout()
+    fig.savefig(png_path, dpi=100)
+    return png_path
+
+
+def _write_index(out_dir, summaries, png_files):
+    rows = []
+    for summary, png_file in zip(summaries, png_files):
+        fields = "".join(
+            f"<li>{html.escape(str(k))}: {html.escape(str(v))}</li>" for k, v in summary.items()
+        )
+        rows.append(
+            f"<h2>{html.escape(summary['pair'])}</h2><ul>{fields}</ul>"
+            f'<img src="{html.escape(png_file)}" width="100%">'
+        )
+    with open(os.path.join(out_dir, "index.html"), "w") as f:
+        f.write("<html><head><title>OtaTestbed QA report</title></head><body>")
+        f.write("\n".join(rows))
+        f.write("</body></html>\n")
+
+
+def write_qa_report(preambles, metas, fs: float, out_dir: str, max_workers: int = None):
+    """
+    Render the QA report of a set of Tx/Rx pairs
+
+    :param preambles: Preamble objects after remove was called
+    :type preambles: list[Preamble]
+
+    :param metas: (tx_num, tx_ch_num, rx_num, rx_ch_num) of every preamble
+    :type metas: list[tuple]
+
+    :param fs: Sample rate of the captures
+    :type fs: float
+
+    :param out_dir: Directory receiving the PNG and JSON files of the pairs, index.html and summary.json
+    :type out_dir: str
+
+    :param max_workers: Number of rendering processes
+    :type max_workers: int or None
+
+    :return: The pair summaries
+    :rtype: list[dict]
+    """
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    engine = SpectrogramEngine(fs, max_frames=512)
+
+    payloads = []
+    png_files = []
+    summary_files = []
+    for preamble, meta in zip(preambles, metas):
+        if not hasattr(preamble, "rx_seq"):
+            logger.warning("Tx{}:{}-Rx{}:{} has no capture, skipping".format(*meta))
+            continue
+        payloads.append(get_pair_payload(preamble, meta, engine))
+        png_files.append("Tx{}-{}_Rx{}-{}.png".format(*meta))
+        summary_files.append("Tx{}-{}_Rx{}-{}.json".format(*meta))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(render_pair, payload, os.path.join(out_dir, png_file))
+            for payload, png_file in zip(payloads, png_files)
+        ]
+        for future in futures:
+            future.result()
+
+    summaries = [payload["summary"] for payload in payloads]
+    for summary, summary_file in zip(summaries, summary_files):
+        with open(os.path.join(out_dir, summary_file), "w") as f:
+            json.dump(summary, f, indent=4)
+    with open(os.path.join(out_dir, "summary.json"), "w") as f:
+        json.dump(summaries, f, indent=4)
+    _write_index(out_dir, summaries, png_files)
+    logger.info(f"QA report with {len(summaries)} pairs written to {out_dir}")
+    return summaries
@@ -1,52 +1,16 @@
 import json
-import copy
 import sys
-import os
-from absl import flags
-from timeit import timeit
-import numpy as np
-from numpy.matlib import repmat
-from scipy import signal
-import matplotlib.pyplot as plt
-from rfsynth.otatestbed.config_file_parser import tx_config_parse, rx_config_parse
-from rfsynth.otatestbed.receiver import Receiver
-from rfsynth.otatestbed.transmitter import Transmitter
-from rfsynth.otatestbed.preamble import Preamble
-from fractions import Fraction
 import time
-import pandas as pd
 import logging
+from rfsynth.otatestbed.transmitter import Transmitter
+from rfsynth.otatestbed.config_model import load_config
+from rfsynth.otatestbed import log_queue, tracing
 
 from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 def setup_logger(log_path, file_name):
-    logFormatter = logging.Formatter(
-        "%(asctime)s [%(threadName)-12.12s] [%(levelname)-5.5s]  %(message)s"
-    )
-    rootLogger = logging.getLogger()
-    fileHandler = logging.FileHandler("{0}/{1}".format(log_path, file_name))
-    fileHandler.setFormatter(logFormatter)
-    rootLogger.addHandler(fileHandler)
-    consoleHandler = logging.StreamHandler()
-    consoleHandler.setFormatter(logFormatter)
-    rootLogger.addHandler(consoleHandler)
-
-
-# decorater definition used for timing methods
-def timeit(f):
-    try:
-
-        def timed(self):
-            ts = time.time()
-            result = f(self)
-            te = time.time()
-            print(f"{f.__qualname__} took: {te-ts:4.4f} seconds")
-            return result
-
-        return timed
-    except:
-        pass
+    log_queue.start_logging(log_path, file_name)
 
 
 def load_config_json(config_filename):
@@ -56,33 +20,27 @@ def load_config_json(config_filename):
     return config_json
 
 
-def initialize_transmitters(tx_config_file, tx_idx):
-    tx_config = load_config_json(tx_config_file)
+def initialize_transmitters(radio_config, tx_idx):
+    # Older callers pass the config file, newer ones the parsed radio config
+    if isinstance(radio_config, str):
+        radio_config = load_config(radio_config).radios[tx_idx]
 
-    idx = 0
-    flag = 0
-    for radio_config_d in tx_config["radios"]:
-        if idx == tx_idx:
-            transmitter = Transmitter(radio_config_d)
-            transmitter.set_all_channel_data()
-            flag = 1
-            break
-        else:
-            idx += 1
+    with tracing.span("init"):
+        transmitter = Transmitter(radio_config)
+    transmitter.set_all_channel_data()
+    return transmitter
 
-    if flag:
-        return transmitter
-    else:
-        return None
 
-
-def real_time_tx_loop(tx_config_file, transmitter_idx, channel_idx, start_time):
+@tracing.traced()
+def real_time_tx_loop(radio_config, transmitter_idx, channel_idx, start_time):
+    tracing.set_process_name(f"Tx {transmitter_idx}")
     logging.info(f"Init Tx {transmitter_idx}")
-    transmitter = initialize_transmitters(tx_config_file, transmitter_idx)
+    transmitter = initialize_transmitters(radio_config, transmitter_idx)
     transmitter.real_time_transmit_loop(transmitter_idx, channel_idx, start_time)
+    log_queue.report_suppressed()
     return 0
     try:
-        transmitter = initialize_transmitters(tx_config_file, transmitter_idx)
+        transmitter = initialize_transmitters(radio_config, transmitter_idx)
         transmitter.real_time_transmit_loop(transmitter_idx, channel_idx, start_time)
         return 0
     except Exception as e:
@@ -92,7 +50,11 @@ def real_time_tx_loop(tx_config_file, transmitter_idx, channel_idx, start_time):
 
 
 if __name__ == "__main__":
+    from absl import flags
+
     flags.DEFINE_string("tx_config_file", None, "TX config file to use")
+    flags.DEFINE_string("trace_file", None, "Write a Chrome trace of all radios to this file")
+    flags.DEFINE_list("profile_stages", [], "Trace stages to sample with the profiler")
     FLAGS = flags.FLAGS
     FLAGS(sys.argv)
 
@@ -102,19 +64,29 @@ if __name__ == "__main__":
     setup_logger("./", "realTimeTestbed.log")
     logging.info(f"Log file: ./realTimeTestbed.log")
 
-    config_json = load_config_json(tx_config_file)
-    num_transmitters = len(config_json["radios"])
-    logging.info(f"Starting with {num_transmitters} radios")
+    collector = None
+    if FLAGS.trace_file:
+        collector = tracing.start_collector(FLAGS.profile_stages)
 
-    with ProcessPoolExecutor() as executor:
-        futures = list()
-        start_time = time.time() + 10
-        for idx in range(num_transmitters):
-            p = executor.submit(real_time_tx_loop, tx_config_file, idx, 0, start_time)
-            futures.append(p)
+    # Validate everything before any radio is touched
+    tx_config = load_config(tx_config_file)
+    num_transmitters = len(tx_config.radios)
+    logging.info(f"Starting with {num_transmitters} radios")
 
-        for future in as_completed(futures):
-            print(future.result())
+    try:
+        with ProcessPoolExecutor(**log_queue.executor_kwargs()) as executor:
+            futures = list()
+            start_time = time.time() + 10
+            for idx, radio_config in enumerate(tx_config.radios):
+                p = executor.submit(real_time_tx_loop, radio_config, idx, 0, start_time)
+                futures.append(p)
+
+            for future in as_completed(futures):
+                print(future.result())
+    finally:
+        if collector is not None:
+            collector.write(FLAGS.trace_file)
+        log_queue.stop_logging()
 
     # import pdb; pdb.set_trace()
     # otaTestbed.show_debug_plots()
@@ -1,10 +1,10 @@
-from rfsynth.otatestbed.receiver_flowgraph import receiver_flowgraph
+from rfsynth.otatestbed.sample_format import CPU_FC32, CPU_SC16, Sc16Array
 import numpy as np
 import json
 
 
 class Receiver:
-    def __init__(self, radio_config_d):
+    def __init__(self, radio_config_d, flowgraph=None):
         # Pull radio settings from the config dictionary
         self.address = radio_config_d["addrs"][0]
         self.clock_rate = radio_config_d["masterClockRate"]
@@ -12,15 +12,21 @@ class Receiver:
         self.num_channels = len(radio_config_d["channels"])
         self.subdev_spec = radio_config_d["subdevSpec"]
         self.num_seconds_receive = radio_config_d["numSecondsReceive"]
+        self.cpu_format = radio_config_d.get("cpuFormat", CPU_FC32)
 
-        # Initialze radio flowgraph
-        self.tb = receiver_flowgraph(
+        # Initialze radio flowgraph, GNU Radio is only loaded once a radio is used.
+        # Another flowgraph class with the same interface can be passed instead.
+        if flowgraph is None:
+            from rfsynth.otatestbed.receiver_flowgraph import receiver_flowgraph as flowgraph
+
+        self.tb = flowgraph(
             address=self.address,
             clock_rate=self.clock_rate,
             sample_rate=self.sample_rate,
             num_channels=self.num_channels,
             subdev_spec=self.subdev_spec,
             num_seconds_receive=self.num_seconds_receive,
+            cpu_format=self.cpu_format,
         )
 
         # Configure individual channels on the flowgraph
@@ -44,13 +50,16 @@ class Receiver:
 
     def get_single_channel_data(self, channel_num):
         channel_data = self.tb.get_vector_sink_data(channel_num)
+        if self.cpu_format == CPU_SC16:
+            # Kept as int16 pairs, scaled when samples are accessed
+            return Sc16Array(np.asarray(channel_data, dtype=np.int16))
         channel_data = np.asarray(channel_data)
         channel_data = channel_data.astype(dtype=np.complex64)
         return channel_data
 
     def get_all_channel_data(self):
         channel_data_list = [
-            np.asarray(self.tb.get_vector_sink_data(i), dtype=np.complex64)
+            self.get_single_channel_data(i)
             for i in range(self.num_channels)
         ]
         return channel_data_list
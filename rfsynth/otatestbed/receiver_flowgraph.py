@@ -22,13 +22,16 @@ from gnuradio import eng_notation
 from gnuradio import uhd
 import time
 
+from rfsynth.otatestbed.sample_format import CPU_FC32, CPU_SC16
+
 class receiver_flowgraph(gr.top_block):
     def __init__(self,address,
                     clock_rate,
                     sample_rate,
                     num_channels,
                     subdev_spec,
-                    num_seconds_receive):
+                    num_seconds_receive,
+                    cpu_format=CPU_FC32):
 
         gr.top_block.__init__(self, "Not titled yet")
 
@@ -39,12 +42,14 @@ class receiver_flowgraph(gr.top_block):
         self.num_channels = num_channels
         self.subdev_spec = subdev_spec
         self.num_seconds_receive = num_seconds_receive
+        # fc32 receives complex64 from UHD, sc16 int16 pairs
+        self.cpu_format = cpu_format
         
         # Instantiate source block
         self.uhd_usrp_source = uhd.usrp_source(
             ",".join(("addr="+str(address),"","master_clock_rate="+str(clock_rate))),
             uhd.stream_args(
-                cpu_format="fc32",
+                cpu_format=cpu_format,
                 args='',
                 channels=list(range(0,num_channels)),
             ),
@@ -65,8 +70,13 @@ class receiver_flowgraph(gr.top_block):
         self.uhd_usrp_source.set_center_freq(center_freq, channel_num)
 
         # Create head and vector sink blocks
-        head_block = blocks.head(gr.sizeof_gr_complex*1, int(self.sample_rate * self.num_seconds_receive))
-        vector_sink_block = blocks.vector_sink_c(1,1024) 
+        num_items = int(self.sample_rate * self.num_seconds_receive)
+        if self.cpu_format == CPU_SC16:
+            head_block = blocks.head(gr.sizeof_short*2, num_items)
+            vector_sink_block = blocks.vector_sink_s(2,1024)
+        else:
+            head_block = blocks.head(gr.sizeof_gr_complex*1, num_items)
+            vector_sink_block = blocks.vector_sink_c(1,1024) 
 
         # Connect blocks to source
         self.connect((head_block,0), (vector_sink_block,0))
@@ -4,24 +4,8 @@ Tools to parse or edit report files
 TODO: More description
 """
 import argparse
-from cgi import test
-from cmath import polar
-from dataclasses import asdict
-
 import json
-import pdb
-import shutil
-import subprocess
 import logging
-from typing import List, Optional
-import sys
-import os
-import time
-import concurrent.futures
-import csv
-from pathlib import Path
-import pandas as pd
-import traceback 
 import re
 
 logger = logging.getLogger(__name__)
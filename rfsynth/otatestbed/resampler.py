@@ -0,0 +1,363 @@
+"""
+Rational polyphase sample rate conversion of IQ data.
+
+IQ files do not have to be generated at the sample rate of the radio that
+plays them. Files are converted with a streaming polyphase resampler that
+produces the same output as ``scipy.signal.resample_poly`` while reading the
+input in chunks, so large files never have to be loaded whole. Burst packs
+are resampled burst by burst, each with a fresh filter, into a new pack with
+its own index. Filter designs are cached by ratio, and resampled files are
+cached on disk by (file hash, ratio). File hashes are remembered by
+path, size and modification time.
+"""
+
+from fractions import Fraction
+from functools import lru_cache
+import hashlib
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+from scipy import signal
+
+from rfsynth.otatestbed.burst_pack import PACK_EXTENSION, BurstPack, BurstPackWriter, is_burst_pack
+from rfsynth.otatestbed.iq_codec import IqzReader, is_compressed_iq
+from rfsynth.otatestbed.sample_format import Sc16Array, is_sc16_file
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "/tmp/rfsynth_cache/resampled/"
+DEFAULT_CHUNK_SIZE = 1 << 20  # samples per read
+MAX_DENOMINATOR = 1000
+
+
+def get_resample_ratio(from_rate: float, to_rate: float, max_denominator: int = MAX_DENOMINATOR):
+    """
+    Get the rational up/down factors converting from_rate to to_rate
+
+    :param from_rate: Sample rate of the input
+    :type from_rate: float
+
+    :param to_rate: Sample rate of the output
+    :type to_rate: float
+
+    :param max_denominator: Largest down factor to approximate the ratio with
+    :type max_denominator: int
+
+    :return: Up and down factors
+    :rtype: tuple[int, int]
+    """
+    if float(from_rate).is_integer() and float(to_rate).is_integer():
+        ratio = Fraction(int(to_rate), int(from_rate))
+    else:
+        ratio = Fraction(to_rate / from_rate)
+    ratio = ratio.limit_denominator(max_denominator)
+    return ratio.numerator, ratio.denominator
+
+
+@lru_cache(maxsize=32)
+def get_polyphase_filter(up: int, down: int):
+    """
+    Design the anti-aliasing filter for an up/down ratio, zero padded the same
+    way scipy.signal.resample_poly does so that outputs line up with inputs.
+
+    :param up: Up factor
+    :type up: int
+
+    :param down: Down factor
+    :type down: int
+
+    :return: The read-only filter taps and the number of leading outputs to drop
+    :rtype: tuple[np.ndarray, int]
+    """
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    taps = signal.firwin(2 * half_len + 1, 1.0 / max_rate, window=("kaiser", 5.0)) * up
+    n_pre_pad = down - half_len % down
+    taps = np.concatenate((np.zeros(n_pre_pad), taps))
+    taps.setflags(write=False)
+    return taps, (half_len + n_pre_pad) // down
+
+
+class StreamingResampler:
+    """
+    Polyphase resampler that accepts its input in chunks. The concatenated
+    outputs of :meth:`process` and :meth:`flush` equal
+    ``scipy.signal.resample_poly(x, up, down)`` on the whole input.
+
+    :param up: Up factor
+    :type up: int
+
+    :param down: Down factor
+    :type down: int
+    """
+
+    def __init__(self, up: int, down: int):
+        gcd = np.gcd(up, down)
+        self.up = up // gcd
+        self.down = down // gcd
+        self.taps, self._num_drop = get_polyphase_filter(self.up, self.down)
+
+        self._hist = np.zeros(0, dtype=np.complex64)
+        self._hist_start = 0  # input index of the first history sample
+        self._num_in = 0  # input samples consumed so far
+        self._next_out = 0  # next (causal) output index to produce
+
+    def _advance(self, chunk):
+        buf = np.concatenate((self._hist, chunk)) if len(self._hist) else chunk
+        self._num_in += len(chunk)
+
+        # Outputs whose newest input sample has been seen
+        last_out = (self._num_in * self.up - 1) // self.down
+        local_offset = self._hist_start * self.up // self.down
+        if last_out >= self._next_out:
+            y = signal.upfirdn(self.taps, buf, self.up, self.down)
+            out = y[self._next_out - local_offset : last_out + 1 - local_offset]
+            self._next_out = last_out + 1
+        else:
+            out = np.zeros(0, dtype=np.complex64)
+
+        # Keep the input still needed by future outputs. The history has to
+        # start on a multiple of down to keep the polyphase alignment.
+        first_needed = (self._next_out * self.down - len(self.taps) + 1) // self.up
+        hist_start = max(0, first_needed // self.down * self.down)
+        self._hist = buf[hist_start - self._hist_start :].astype(np.complex64)
+        self._hist_start = hist_start
+        return out.astype(np.complex64)
+
+    def _trim(self, out, first_out):
+        # Drop the filter delay at the start of the stream
+        if first_out < self._num_drop:
+            out = out[self._num_drop - first_out :]
+        return out
+
+    def process(self, chunk):
+        """
+        Resample the next chunk of input
+
+        :param chunk: Next input samples
+        :type chunk: np.ndarray
+
+        :return: Output samples that are complete after this chunk
+        :rtype: np.ndarray
+        """
+        first_out = self._next_out
+        return self._trim(self._advance(np.asarray(chunk)), first_out)
+
+    def flush(self):
+        """
+        Produce the remaining output at the end of the input
+
+        :return: Remaining output samples
+        :rtype: np.ndarray
+        """
+        num_out = -(-self._num_in * self.up // self.down)
+        last_out = self._num_drop + num_out - 1
+        num_zeros = max(0, -(-(last_out * self.down + 1) // self.up) - self._num_in)
+        first_out = self._next_out
+        out = self._advance(np.zeros(num_zeros, dtype=np.complex64))
+        out = self._trim(out, first_out)
+        return out[: max(0, last_out + 1 - max(first_out, self._num_drop))]
+
+
+def resample(data, from_rate: float, to_rate: float):
+    """
+    Resample an in-memory array of samples
+
+    :param data: Input samples
+    :type data: np.ndarray
+
+    :param from_rate: Sample rate of the input
+    :type from_rate: float
+
+    :param to_rate: Sample rate of the output
+    :type to_rate: float
+
+    :return: Resampled samples
+    :rtype: np.ndarray
+    """
+    up, down = get_resample_ratio(from_rate, to_rate)
+    if up == down:
+        return data
+    resampler = StreamingResampler(up, down)
+    return np.concatenate((resampler.process(data), resampler.flush()))
+
+
+def file_digest(filepath: str, chunk_bytes: int = 1 << 24):
+    """
+    Hash the content of a file without loading it whole
+
+    :param filepath: The file to hash
+    :type filepath: str
+
+    :param chunk_bytes: Number of bytes read per step
+    :type chunk_bytes: int
+
+    :return: Hex digest of the file content
+    :rtype: str
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(chunk_bytes), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=256)
+def _get_file_digest(real_path: str, size: int, mtime_ns: int):
+    return file_digest(real_path)
+
+
+def get_file_digest(filepath: str):
+    """
+    Hash of a file, remembered by path, size and modification time so an
+    unchanged file is only read once
+
+    :param filepath: The file to hash
+    :type filepath: str
+
+    :return: Hex digest of the file content
+    :rtype: str
+    """
+    real_path = os.path.realpath(filepath)
+    stat = os.stat(real_path)
+    return _get_file_digest(real_path, stat.st_size, stat.st_mtime_ns)
+
+
+def resample_file(
+    src_path: str,
+    dst_path: str,
+    from_rate: float,
+    to_rate: float,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+):
+    """
+    Resample a complex64 IQ file chunk by chunk. The output is written to a
+    temporary file and renamed into place once complete.
+
+    :param src_path: Input IQ file, complex64, sc16 or block compressed
+    :type src_path: str
+
+    :param dst_path: Output IQ file, complex64
+    :type dst_path: str
+
+    :param from_rate: Sample rate of the input file
+    :type from_rate: float
+
+    :param to_rate: Sample rate of the output file
+    :type to_rate: float
+
+    :param chunk_size: Number of samples read per step
+    :type chunk_size: int
+
+    :return: None
+    """
+    up, down = get_resample_ratio(from_rate, to_rate)
+    if is_burst_pack(src_path):
+        resample_burst_pack(src_path, dst_path, up, down, to_rate, chunk_size)
+        return
+    resampler = StreamingResampler(up, down)
+
+    tmp_path = f"{dst_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as dst:
+        for chunk in _iter_file_chunks(src_path, chunk_size):
+            resampler.process(chunk).tofile(dst)
+        resampler.flush().tofile(dst)
+    os.replace(tmp_path, dst_path)
+
+
+def _resample_chunks(data, up, down, chunk_size):
+    resampler = StreamingResampler(up, down)
+    for start in range(0, len(data), chunk_size):
+        yield resampler.process(data[start : start + chunk_size])
+    yield resampler.flush()
+
+
+def resample_burst_pack(
+    src_path: str, dst_path: str, up: int, down: int, to_rate: float, chunk_size: int = DEFAULT_CHUNK_SIZE
+):
+    """
+    Resample every burst of a burst pack on its own and write a new pack. The
+    filter starts from zeros for every burst, so no burst bleeds into the
+    next. Ids, names, center frequencies and bandwidths are kept, offsets,
+    lengths and peaks are those of the resampled bursts.
+
+    :param src_path: Input burst pack
+    :type src_path: str
+
+    :param dst_path: Output burst pack
+    :type dst_path: str
+
+    :param up: Up factor
+    :type up: int
+
+    :param down: Down factor
+    :type down: int
+
+    :param to_rate: Sample rate of the output pack
+    :type to_rate: float
+
+    :param chunk_size: Number of samples resampled per step
+    :type chunk_size: int
+
+    :return: None
+    """
+    pack = BurstPack(src_path)
+    with BurstPackWriter(dst_path, to_rate) as writer:
+        for record, name in zip(pack.index, pack.names):
+            writer.add(
+                name,
+                _resample_chunks(pack[int(record["burst_id"])], up, down, chunk_size),
+                float(record["center_freq"]),
+                float(record["bandwidth"]),
+            )
+
+
+def _iter_file_chunks(src_path, chunk_size):
+    if is_compressed_iq(src_path):
+        # Block compressed files are decoded block by block
+        yield from IqzReader(src_path).iter_chunks()
+        return
+    if is_sc16_file(src_path):
+        yield from Sc16Array.from_file(src_path).iter_chunks(chunk_size=chunk_size)
+        return
+    num_samples = os.path.getsize(src_path) // np.dtype(np.complex64).itemsize
+    with open(src_path, "rb") as src:
+        for _ in range(0, num_samples, chunk_size):
+            yield np.fromfile(src, dtype=np.complex64, count=chunk_size)
+
+
+def get_resampled_file(
+    src_path: str, from_rate: float, to_rate: float, cache_dir: str = CACHE_DIR
+):
+    """
+    Get the path of a copy of src_path at to_rate, resampling it only if it is
+    not cached on disk yet.
+
+    :param src_path: Input IQ file
+    :type src_path: str
+
+    :param from_rate: Sample rate of the input file
+    :type from_rate: float
+
+    :param to_rate: Sample rate wanted
+    :type to_rate: float
+
+    :param cache_dir: Directory holding the resampled files
+    :type cache_dir: str
+
+    :return: Path to a file at to_rate, a burst pack for a burst pack
+    :rtype: str
+    """
+    up, down = get_resample_ratio(from_rate, to_rate)
+    if up == down:
+        return src_path
+
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    extension = PACK_EXTENSION if is_burst_pack(src_path) else ".32cf"
+    dst_path = os.path.join(cache_dir, f"{get_file_digest(src_path)}_{up}_{down}{extension}")
+    if not os.path.exists(dst_path):
+        logger.info(f"Resampling {src_path} by {up}/{down}")
+        resample_file(src_path, dst_path, from_rate, to_rate)
+    return dst_path
@@ -0,0 +1,317 @@
+"""
+Retune planning for the real time transmit loop.
+
+Every distinct energy center frequency used to cost a full RF LO retune
+(``set_command_time``/``set_center_freq``/``clear_command_time`` plus LO
+settling) right at the start of the burst. The planner walks a radio's schedule
+ahead of time and decides, per burst, whether the LO has to move at all: bursts
+that fit inside the current instantaneous bandwidth are reached with a DUC
+(DSP) offset only, or with a host side NCO shift of the samples (see
+:mod:`rfsynth.otatestbed.nco`). When the LO does have to move, it is placed so that it
+covers as many of the upcoming bursts as possible.
+
+The resulting timed tune commands are handed to the radio in batches through
+:class:`TimedTuneQueue`, so that retunes are queued on the device well before
+the bursts that need them.
+"""
+
+from dataclasses import dataclass
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Minimum gap between the end of one energy and the start of the next one
+GUARD_INTERVAL_S = 0.0070
+# Time for an RF LO retune to settle, overridden by retunePolicy.rfRetuneLatencyS
+RF_RETUNE_LATENCY_S = 0.005
+
+TUNE_DSP = "dsp"
+TUNE_RF = "rf"
+
+SHIFT_DUC = "duc"  # in-band offsets are applied by the radio's DUC
+SHIFT_NCO = "nco"  # in-band offsets are applied to the samples on the host
+
+
+@dataclass
+class TuneCommand:
+    """A single timed tune command for one burst of the schedule"""
+
+    row_pos: int  # position of the burst among the transmitted rows
+    cmd_time: float  # seconds, relative to the start of the schedule
+    target_freq: float  # center frequency of the burst
+    lo_freq: float  # RF LO frequency after the command
+    action: str  # TUNE_DSP or TUNE_RF
+
+
+def schedule_mask(time_start, time_length, guard_s: float = GUARD_INTERVAL_S):
+    """
+    Decide which energies of a single radio can be transmitted. An energy is
+    skipped when it starts before the previous transmitted energy (plus the
+    guard interval) is done, mirroring the check in the transmit loop.
+
+    :param time_start: Start times of the energies, in schedule order
+    :type time_start: np.ndarray
+
+    :param time_length: Durations of the energies
+    :type time_length: np.ndarray
+
+    :param guard_s: Guard interval between consecutive energies
+    :type guard_s: float
+
+    :return: Boolean mask, True for energies that will be transmitted
+    :rtype: np.ndarray
+    """
+    time_start = np.asarray(time_start, dtype=np.float64)
+    time_stop = time_start + np.asarray(time_length, dtype=np.float64)
+    keep = np.ones(len(time_start), dtype=bool)
+
+    # Fast path: nothing overlaps, so nothing needs to be dropped
+    if len(time_start) < 2 or np.all(time_stop[:-1] + guard_s <= time_start[1:]):
+        return keep
+
+    prev_time_stop = -1.0
+    for idx, (t_start, t_stop) in enumerate(zip(time_start.tolist(), time_stop.tolist())):
+        if prev_time_stop + guard_s > t_start:
+            keep[idx] = False
+        else:
+            prev_time_stop = t_stop
+    return keep
+
+
+class RetunePlanner:
+    """
+    Plans the tune commands for a sequence of bursts on one channel.
+
+    :param clock_rate: Master clock rate of the radio, bounds the DUC range
+    :type clock_rate: float
+
+    :param dsp_shift: Use DUC offsets for bursts that fit the current LO window
+    :type dsp_shift: bool
+
+    :param instantaneous_bandwidth: Usable bandwidth around the LO in Hz. Defaults
+        to 80 % of the master clock rate
+    :type instantaneous_bandwidth: float or None
+
+    :param lead_time_s: Issue tune commands this long before the burst starts,
+        as far as the gap to the previous burst allows. from_config defaults it
+        to the RF retune latency
+    :type lead_time_s: float
+
+    :param shift_mode: SHIFT_DUC or SHIFT_NCO, how in-band offsets are applied
+    :type shift_mode: str
+
+    :param sample_rate: Sample rate of the radio, bounds the NCO range
+    :type sample_rate: float or None
+    """
+
+    def __init__(
+        self,
+        clock_rate: float,
+        dsp_shift: bool = True,
+        instantaneous_bandwidth: float = None,
+        lead_time_s: float = 0.0,
+        shift_mode: str = SHIFT_DUC,
+        sample_rate: float = None,
+    ):
+        if shift_mode not in (SHIFT_DUC, SHIFT_NCO):
+            raise ValueError(f"Invalid shift mode ({shift_mode})")
+        self.dsp_shift = dsp_shift
+        self.shift_mode = shift_mode
+        if instantaneous_bandwidth is None:
+            # Host side shifts have to stay inside the sampled band
+            if shift_mode == SHIFT_NCO:
+                instantaneous_bandwidth = 0.8 * sample_rate
+            else:
+                instantaneous_bandwidth = 0.8 * clock_rate
+        self.instantaneous_bandwidth = instantaneous_bandwidth
+        self.lead_time_s = lead_time_s
+
+    @classmethod
+    def from_config(cls, radio_config):
+        """
+        Build a planner from the optional ``retunePolicy`` entry of a radio config
+
+        :param radio_config: Radio configuration
+        :type radio_config: RadioConfig
+
+        :return: The planner
+        :rtype: RetunePlanner
+        """
+        policy = radio_config.retune_policy
+        return cls(
+            clock_rate=radio_config.master_clock_rate,
+            dsp_shift=policy.get("dspShift", True),
+            instantaneous_bandwidth=policy.get("instantaneousBandwidth"),
+            lead_time_s=policy.get("leadTimeS", policy.get("rfRetuneLatencyS", RF_RETUNE_LATENCY_S)),
+            shift_mode=policy.get("shiftMode", SHIFT_DUC),
+            sample_rate=radio_config.sample_rate,
+        )
+
+    def fits(self, lo_freq: float, freq_lo: float, freq_hi: float):
+        """Check if the band [freq_lo, freq_hi] is reachable from lo_freq with DSP only"""
+        half_ibw = self.instantaneous_bandwidth / 2
+        return freq_lo >= lo_freq - half_ibw and freq_hi <= lo_freq + half_ibw
+
+    def _place_lo(self, freq_lo, freq_hi, start):
+        """Place the LO to cover the longest run of bursts starting at start"""
+        band_lo = freq_lo[start]
+        band_hi = freq_hi[start]
+        if self.dsp_shift:
+            for idx in range(start + 1, len(freq_lo)):
+                new_lo = min(band_lo, freq_lo[idx])
+                new_hi = max(band_hi, freq_hi[idx])
+                if new_hi - new_lo > self.instantaneous_bandwidth:
+                    break
+                band_lo, band_hi = new_lo, new_hi
+        return (band_lo + band_hi) / 2
+
+    def plan(self, time_start, time_length, freq_lo, freq_hi, current_freq=None):
+        """
+        Plan the tune commands for the transmitted bursts of one channel.
+
+        :param time_start: Start times of the bursts, relative to the schedule start
+        :type time_start: np.ndarray
+
+        :param time_length: Durations of the bursts
+        :type time_length: np.ndarray
+
+        :param freq_lo: Lower band edges of the bursts
+        :type freq_lo: np.ndarray
+
+        :param freq_hi: Upper band edges of the bursts
+        :type freq_hi: np.ndarray
+
+        :param current_freq: Frequency the channel is tuned to before the schedule
+        :type current_freq: float or None
+
+        :return: The tune commands, in time order
+        :rtype: list[TuneCommand]
+        """
+        time_start = np.asarray(time_start, dtype=np.float64).tolist()
+        time_length = np.asarray(time_length, dtype=np.float64).tolist()
+        freq_lo = np.asarray(freq_lo, dtype=np.float64).tolist()
+        freq_hi = np.asarray(freq_hi, dtype=np.float64).tolist()
+
+        commands = []
+        lo_freq = current_freq
+        tuned_freq = current_freq
+        prev_time_stop = None
+        for pos in range(len(time_start)):
+            center_freq = (freq_lo[pos] + freq_hi[pos]) / 2
+            if center_freq != tuned_freq:
+                if (
+                    self.dsp_shift
+                    and lo_freq is not None
+                    and self.fits(lo_freq, freq_lo[pos], freq_hi[pos])
+                ):
+                    action = TUNE_DSP
+                else:
+                    action = TUNE_RF
+                    lo_freq = self._place_lo(freq_lo, freq_hi, pos)
+
+                cmd_time = time_start[pos] - self.lead_time_s
+                if prev_time_stop is not None:
+                    cmd_time = max(cmd_time, prev_time_stop)
+                commands.append(
+                    TuneCommand(pos, min(cmd_time, time_start[pos]), center_freq, lo_freq, action)
+                )
+                tuned_freq = center_freq
+            prev_time_stop = time_start[pos] + time_length[pos]
+
+        num_rf = sum(cmd.action == TUNE_RF for cmd in commands)
+        logger.info(
+            f"Retune plan: {len(time_start)} bursts, {num_rf} RF retunes, "
+            f"{len(commands) - num_rf} DSP retunes"
+        )
+        return commands
+
+
+def lo_per_burst(commands, num_bursts: int, current_freq: float):
+    """
+    Expand planned commands to the LO frequency in effect for every burst
+
+    :param commands: Planned commands, in time order
+    :type commands: list[TuneCommand]
+
+    :param num_bursts: Number of bursts that were planned
+    :type num_bursts: int
+
+    :param current_freq: Frequency the channel is tuned to before the schedule
+    :type current_freq: float
+
+    :return: LO frequency per burst
+    :rtype: np.ndarray
+    """
+    lo_freqs = np.full(num_bursts, current_freq, dtype=np.float64)
+    for cmd in commands:
+        lo_freqs[cmd.row_pos :] = cmd.lo_freq
+    return lo_freqs
+
+
+def rf_only_commands(commands):
+    """
+    Reduce planned commands to the RF retunes, tuning the radio to the LO itself.
+    Used when in-band offsets are applied on the host (SHIFT_NCO).
+
+    :param commands: Planned commands, in time order
+    :type commands: list[TuneCommand]
+
+    :return: The RF retune commands
+    :rtype: list[TuneCommand]
+    """
+    return [
+        TuneCommand(cmd.row_pos, cmd.cmd_time, cmd.lo_freq, cmd.lo_freq, TUNE_RF)
+        for cmd in commands
+        if cmd.action == TUNE_RF
+    ]
+
+
+class TimedTuneQueue:
+    """
+    Hands planned tune commands to the radio in batches ahead of the bursts.
+
+    :param commands: Planned commands, in time order
+    :type commands: list[TuneCommand]
+
+    :param issue: Callable issuing a list of TuneCommand on the radio
+    :type issue: callable
+
+    :param batch_size: Number of bursts to keep queued ahead of the current one
+    :type batch_size: int
+    """
+
+    def __init__(self, commands, issue, batch_size: int = 8):
+        self.commands = commands
+        self.issue = issue
+        self.batch_size = max(1, batch_size)
+        self._next_cmd = 0
+        self._frontier = 0  # bursts before this position have their commands issued
+
+    def advance(self, row_pos: int):
+        """
+        Make sure the commands for the burst at row_pos are issued. Issues the
+        next batch whenever less than half a batch is left queued.
+
+        :param row_pos: Position of the burst about to be transmitted
+        :type row_pos: int
+
+        :return: Number of commands issued by this call
+        :rtype: int
+        """
+        if self._frontier - row_pos > self.batch_size // 2:
+            return 0
+
+        self._frontier = row_pos + self.batch_size + 1
+        first_cmd = self._next_cmd
+        while (
+            self._next_cmd < len(self.commands)
+            and self.commands[self._next_cmd].row_pos < self._frontier
+        ):
+            self._next_cmd += 1
+
+        batch = self.commands[first_cmd : self._next_cmd]
+        if batch:
+            self.issue(batch)
+        return len(batch)
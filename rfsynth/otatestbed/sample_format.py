@@ -0,0 +1,192 @@
+"""
+Host sample formats of the radio streams.
+
+UHD streams carry 16 bit I/Q on the wire. With ``cpu_format="fc32"`` UHD
+converts them to complex64 on the host, which doubles host memory and disk
+traffic compared to keeping them as int16 pairs (``sc16``). In sc16 mode the
+radios hand int16 pairs to and from the flowgraphs, IQ files can be stored as
+int16 pairs (``.sc16``), and :class:`Sc16Array` keeps samples as int16 with a
+scale factor, converting to complex64 only the ranges that are accessed.
+"""
+
+import numpy as np
+
+CPU_FC32 = "fc32"
+CPU_SC16 = "sc16"
+CPU_FORMATS = (CPU_FC32, CPU_SC16)
+
+SC16_EXTENSION = ".sc16"
+SC16_FULL_SCALE = 32767
+# Samples converted per step when a whole Sc16Array is scanned
+SC16_CHUNK_SIZE = 1 << 20
+
+
+def is_sc16_file(filepath: str):
+    return str(filepath).endswith(SC16_EXTENSION)
+
+
+def to_sc16(samples, scale: float = SC16_FULL_SCALE, out=None):
+    """
+    Convert complex samples to int16 I/Q pairs, clipping at full scale
+
+    :param samples: Complex samples, nominally within [-1, 1]
+    :type samples: np.ndarray
+
+    :param scale: Integer value of 1.0
+    :type scale: float
+
+    :param out: Optional int16 output of shape (len(samples), 2)
+    :type out: np.ndarray or None
+
+    :return: int16 pairs of shape (len(samples), 2)
+    :rtype: np.ndarray
+    """
+    if isinstance(samples, Sc16Array) and samples.scale == 1.0 / scale:
+        return samples.raw
+    samples = np.asarray(samples)
+    if samples.dtype == np.int16 and samples.ndim == 2:
+        # Already int16 pairs
+        return samples
+    floats = np.empty((len(samples), 2), dtype=np.float32)
+    floats[:, 0] = samples.real
+    floats[:, 1] = samples.imag
+    floats *= scale
+    np.rint(floats, out=floats)
+    np.clip(floats, -SC16_FULL_SCALE - 1, SC16_FULL_SCALE, out=floats)
+    if out is None:
+        return floats.astype(np.int16)
+    out[:] = floats
+    return out
+
+
+def from_sc16(pairs, scale: float = 1.0 / SC16_FULL_SCALE, out=None):
+    """
+    Convert int16 I/Q pairs to complex64
+
+    :param pairs: int16 pairs of shape (num_samples, 2)
+    :type pairs: np.ndarray
+
+    :param scale: Value of one integer step
+    :type scale: float
+
+    :param out: Optional complex64 output
+    :type out: np.ndarray or None
+
+    :return: complex64 samples
+    :rtype: np.ndarray
+    """
+    if out is None:
+        out = np.empty(len(pairs), dtype=np.complex64)
+    np.multiply(pairs, np.float32(scale), out=out.view(np.float32).reshape(-1, 2))
+    return out
+
+
+class Sc16Array:
+    """
+    int16 I/Q samples with a scale factor, converted to complex64 on access.
+
+    Indexing with a slice returns the complex64 samples of that slice only,
+    and np.asarray converts everything. It also offers the reader interface
+    of :mod:`rfsynth.otatestbed.iq_reader` (num_samples, read, iter_chunks,
+    peak) so sc16 files can be streamed.
+
+    :param raw: int16 pairs, shape (num_samples, 2) or interleaved
+    :type raw: np.ndarray
+
+    :param scale: Value of one integer step
+    :type scale: float
+    """
+
+    def __init__(self, raw, scale: float = 1.0 / SC16_FULL_SCALE):
+        self.raw = np.asarray(raw, dtype=np.int16).reshape(-1, 2)
+        self.scale = scale
+        self.filepath = None
+
+    @classmethod
+    def from_file(cls, filepath: str, sample_offset: int = 0, num_samples: int = None):
+        """Map an sc16 file, nothing is read until samples are accessed"""
+        raw = np.memmap(filepath, dtype=np.int16, mode="r").reshape(-1, 2)
+        stop = None if num_samples is None else sample_offset + num_samples
+        array = cls(raw[sample_offset:stop])
+        array.filepath = filepath
+        return array
+
+    dtype = np.dtype(np.complex64)
+
+    def __len__(self):
+        return len(self.raw)
+
+    @property
+    def num_samples(self):
+        return len(self.raw)
+
+    @property
+    def shape(self):
+        return (len(self.raw),)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return from_sc16(self.raw[key], self.scale)
+        if isinstance(key, (int, np.integer)):
+            i, q = self.raw[key]
+            return np.complex64(complex(i, q) * self.scale)
+        return from_sc16(self.raw[key], self.scale)
+
+    def __array__(self, dtype=None, copy=None):
+        samples = from_sc16(self.raw, self.scale)
+        return samples if dtype is None else samples.astype(dtype)
+
+    def read(self, start: int, count: int):
+        return from_sc16(self.raw[start : start + count], self.scale)
+
+    def iter_chunks(self, start: int = 0, stop: int = None, chunk_size: int = SC16_CHUNK_SIZE):
+        stop = len(self.raw) if stop is None else min(stop, len(self.raw))
+        for chunk_start in range(start, stop, chunk_size):
+            yield self.read(chunk_start, min(chunk_size, stop - chunk_start))
+
+    def peak(self, start: int = 0, stop: int = None):
+        """Largest magnitude in [start, stop), computed on the integers"""
+        stop = len(self.raw) if stop is None else min(stop, len(self.raw))
+        peak_sq = 0
+        for chunk_start in range(start, stop, SC16_CHUNK_SIZE):
+            pairs = self.raw[chunk_start : min(chunk_start + SC16_CHUNK_SIZE, stop)].astype(np.int32)
+            if len(pairs):
+                peak_sq = max(peak_sq, int(np.max(pairs[:, 0] ** 2 + pairs[:, 1] ** 2)))
+        return float(np.sqrt(peak_sq) * self.scale)
+
+    def normalized(self, peak: float = 1.0):
+        """
+        int16 pairs rescaled so the largest magnitude is peak, without going
+        through complex floats
+
+        :param peak: Target peak magnitude
+        :type peak: float
+
+        :return: int16 pairs
+        :rtype: np.ndarray
+        """
+        current = self.peak()
+        if current == 0:
+            return self.raw
+        gain = peak / current
+        if abs(gain - 1.0) < 1.0 / SC16_FULL_SCALE:
+            return self.raw
+        scaled = np.rint(self.raw * np.float32(gain))
+        np.clip(scaled, -SC16_FULL_SCALE - 1, SC16_FULL_SCALE, out=scaled)
+        return scaled.astype(np.int16)
+
+    def tofile(self, filepath: str):
+        self.raw.tofile(filepath)
+
+
+def write_sc16_file(filepath: str, samples):
+    """
+    Write samples as int16 I/Q pairs, at full scale 1.0
+
+    :param filepath: Output file
+    :type filepath: str
+
+    :param samples: Complex samples or an Sc16Array
+    :type samples: np.ndarray or Sc16Array
+    """
+    to_sc16(samples).tofile(filepath)
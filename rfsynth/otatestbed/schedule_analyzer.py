@@ -0,0 +1,356 @@
+"""
+Offline feasibility check of transmit schedules.
+
+The real time transmit loop only finds out that a schedule cannot be played
+while it runs, when it skips energies. This module predicts the outcome ahead
+of time from the tx config and the energy metadata CSVs: which energies are
+dropped under the guard interval, which RF retunes cannot settle before their
+burst, the duty cycle of every channel and the I/O bandwidth needed to load
+the IQ files between bursts. It uses the same :func:`schedule_mask` and
+:class:`RetunePlanner` as the transmit loop, and everything else is computed
+on whole columns, so million row schedules take seconds.
+
+Run it as a script to check a config before a run::
+
+    python -m rfsynth.otatestbed.schedule_analyzer tx_config.json --strict
+"""
+
+import argparse
+from dataclasses import asdict, dataclass, field
+import json
+import logging
+import os
+import sys
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from rfsynth.otatestbed.config_model import SAMPLE_BYTES, load_config
+from rfsynth.otatestbed.retune_planner import (
+    GUARD_INTERVAL_S,
+    RF_RETUNE_LATENCY_S,
+    SHIFT_NCO,
+    TUNE_RF,
+    RetunePlanner,
+    lo_per_burst,
+    schedule_mask,
+)
+
+logger = logging.getLogger(__name__)
+
+NUM_WORST_INTERVALS = 10
+METADATA_COLUMNS = ["time_start", "timeLength_s", "freq_lo", "freq_hi", "tx_radio", "iq_filename"]
+# Optional, bursts cut from a larger file by sample offset
+SEGMENT_COLUMNS = ["iq_offset", "iq_length"]
+
+
+@dataclass
+class ChannelScheduleReport:
+    """Predicted outcome of the schedule of one radio channel"""
+
+    radio_idx: int
+    channel_idx: int
+    metadata: str
+    num_energies: int = 0
+    dropped_rows: List[int] = field(default_factory=list)
+    num_rf_retunes: int = 0
+    late_retune_rows: List[int] = field(default_factory=list)
+    missing_files: List[str] = field(default_factory=list)
+    schedule_span_s: float = 0.0
+    duty_cycle: float = 0.0
+    stream_bytes_per_s: float = 0.0  # samples handed to the radio, averaged over the span
+    load_bytes: int = 0  # IQ file bytes read by the loop over the whole schedule
+    mean_load_bytes_per_s: float = 0.0
+    peak_load_bytes_per_s: float = 0.0  # worst file load over the gap before its burst
+    worst_intervals: List[dict] = field(default_factory=list)
+
+    @property
+    def feasible(self):
+        return not (self.dropped_rows or self.late_retune_rows or self.missing_files)
+
+
+def get_file_sizes(filenames):
+    """
+    Size in bytes of every file, NaN for missing files. Every distinct file is
+    only looked up once.
+
+    :param filenames: IQ file of every energy
+    :type filenames: pd.Series
+
+    :return: File size of every energy
+    :rtype: np.ndarray
+    """
+    unique = pd.unique(filenames)
+    sizes = {
+        name: float(os.path.getsize(name)) if os.path.isfile(name) else np.nan for name in unique
+    }
+    return filenames.map(sizes).to_numpy(dtype=np.float64)
+
+
+def analyze_channel(
+    df,
+    radio_config,
+    radio_idx: int,
+    channel_idx: int,
+    guard_s: float = GUARD_INTERVAL_S,
+    retune_latency_s: float = None,
+    num_worst: int = NUM_WORST_INTERVALS,
+):
+    """
+    Predict how the transmit loop plays the energies of one radio channel
+
+    :param df: Energy metadata, all radios
+    :type df: pd.DataFrame
+
+    :param radio_config: Config of the radio
+    :type radio_config: RadioConfig
+
+    :param radio_idx: Index of the radio in the config
+    :type radio_idx: int
+
+    :param channel_idx: Channel of the radio
+    :type channel_idx: int
+
+    :param guard_s: Guard interval between consecutive energies
+    :type guard_s: float
+
+    :param retune_latency_s: Settling time of an RF retune. Defaults to the
+        radio's retunePolicy.rfRetuneLatencyS or RF_RETUNE_LATENCY_S
+    :type retune_latency_s: float or None
+
+    :param num_worst: Number of worst intervals to report
+    :type num_worst: int
+
+    :return: The channel report
+    :rtype: ChannelScheduleReport
+    """
+    if retune_latency_s is None:
+        retune_latency_s = radio_config.retune_policy.get("rfRetuneLatencyS", RF_RETUNE_LATENCY_S)
+    channel = radio_config.channels[channel_idx]
+    report = ChannelScheduleReport(radio_idx, channel_idx, channel.iq_stream.metadata)
+
+    df = df[df.tx_radio == radio_idx + 1]
+    report.num_energies = len(df)
+    if len(df) == 0:
+        return report
+
+    keep = schedule_mask(df.time_start.to_numpy(), df.timeLength_s.to_numpy(), guard_s)
+    report.dropped_rows = df.index[~keep].tolist()
+    df = df[keep]
+
+    time_start = df.time_start.to_numpy(dtype=np.float64)
+    time_length = df.timeLength_s.to_numpy(dtype=np.float64)
+    time_stop = time_start + time_length
+    freq_lo = df.freq_lo.to_numpy(dtype=np.float64)
+    freq_hi = df.freq_hi.to_numpy(dtype=np.float64)
+
+    # Time the loop has to load a burst's data or retune: the gap after the previous burst
+    gaps = np.empty(len(df))
+    gaps[0] = np.inf
+    gaps[1:] = time_start[1:] - time_stop[:-1]
+
+    # Same plan as the transmit loop
+    planner = RetunePlanner.from_config(radio_config)
+    commands = planner.plan(time_start, time_length, freq_lo, freq_hi, channel.iq_stream.frequency)
+    rf_commands = [cmd for cmd in commands if cmd.action == TUNE_RF]
+    report.num_rf_retunes = len(rf_commands)
+    if rf_commands:
+        # The LO is free to move once the previous burst is done, a retune is
+        # late when it cannot settle within the gap before its burst
+        rf_pos = np.array([cmd.row_pos for cmd in rf_commands])
+        late = gaps[rf_pos] < retune_latency_s
+        report.late_retune_rows = df.index[rf_pos[late]].tolist()
+
+    # The loop reads a file whenever the file or its NCO offset changes
+    filenames = df.iq_filename.astype(str)
+    file_sizes = get_file_sizes(filenames)
+    report.missing_files = sorted(set(filenames[np.isnan(file_sizes)]))
+    if planner.shift_mode == SHIFT_NCO:
+        offsets = (freq_lo + freq_hi) / 2 - lo_per_burst(commands, len(df), channel.iq_stream.frequency)
+    else:
+        offsets = np.zeros(len(df))
+    names = filenames.to_numpy()
+    reload = np.ones(len(df), dtype=bool)
+    reload[1:] = (names[1:] != names[:-1]) | (offsets[1:] != offsets[:-1])
+    read_sizes = np.nan_to_num(file_sizes)
+    if all(col in df.columns for col in SEGMENT_COLUMNS):
+        segment_offsets = df.iq_offset.to_numpy()
+        reload[1:] |= segment_offsets[1:] != segment_offsets[:-1]
+        read_sizes = np.minimum(read_sizes, df.iq_length.to_numpy(dtype=np.float64) * SAMPLE_BYTES)
+    load_bytes = np.where(reload, read_sizes, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        load_rate = np.where(reload, load_bytes / np.maximum(gaps, 0.0), 0.0)
+    load_rate[~np.isfinite(load_rate) & (load_bytes == 0)] = 0.0
+
+    span = time_stop.max() - time_start.min()
+    report.schedule_span_s = float(span)
+    report.duty_cycle = float(time_length.sum() / span) if span > 0 else 0.0
+    report.stream_bytes_per_s = report.duty_cycle * radio_config.sample_rate * SAMPLE_BYTES
+    report.load_bytes = int(load_bytes.sum())
+    report.mean_load_bytes_per_s = float(load_bytes.sum() / span) if span > 0 else 0.0
+    finite = load_rate[np.isfinite(load_rate)]
+    report.peak_load_bytes_per_s = float(finite.max()) if len(finite) else 0.0
+
+    # Worst intervals: highest load rate first, then the shortest gaps
+    order = np.lexsort((gaps, -np.nan_to_num(load_rate, posinf=np.finfo(np.float64).max)))
+    report.worst_intervals = [
+        {
+            "row": int(df.index[pos]),
+            "time_start": float(time_start[pos]),
+            "gap_s": float(gaps[pos]),
+            "load_bytes": int(load_bytes[pos]),
+            "load_bytes_per_s": float(load_rate[pos]),
+        }
+        for pos in order[:num_worst]
+    ]
+    return report
+
+
+def analyze_schedule(
+    config,
+    metadata=None,
+    guard_s: float = GUARD_INTERVAL_S,
+    retune_latency_s: float = None,
+    num_worst: int = NUM_WORST_INTERVALS,
+):
+    """
+    Predict how every radio channel of a tx config plays its schedule
+
+    :param config: Tx config
+    :type config: RadiosConfig
+
+    :param metadata: Metadata CSV used instead of the ones in the config
+    :type metadata: str or None
+
+    :param guard_s: Guard interval between consecutive energies
+    :type guard_s: float
+
+    :param retune_latency_s: Settling time of an RF retune, None for the config's
+    :type retune_latency_s: float or None
+
+    :param num_worst: Number of worst intervals to report per channel
+    :type num_worst: int
+
+    :return: One report per radio channel
+    :rtype: list[ChannelScheduleReport]
+    """
+    frames = {}
+    reports = []
+    for radio_idx, radio_config in enumerate(config.radios):
+        for channel_idx, channel in enumerate(radio_config.channels):
+            meta_file = metadata or channel.iq_stream.metadata
+            if meta_file not in frames:
+                frames[meta_file] = pd.read_csv(
+                    meta_file, usecols=lambda col: col in METADATA_COLUMNS or col in SEGMENT_COLUMNS
+                )
+            report = analyze_channel(
+                frames[meta_file],
+                radio_config,
+                radio_idx,
+                channel_idx,
+                guard_s,
+                retune_latency_s,
+                num_worst,
+            )
+            report.metadata = meta_file
+            reports.append(report)
+    return reports
+
+
+def format_report(report):
+    """Human readable summary of a channel report"""
+    lines = [
+        f"Tx {report.radio_idx}.Chan {report.channel_idx} ({report.metadata}): "
+        f"{'feasible' if report.feasible else 'NOT feasible'}",
+        f"  energies: {report.num_energies}, dropped: {len(report.dropped_rows)}, "
+        f"RF retunes: {report.num_rf_retunes}, late RF retunes: {len(report.late_retune_rows)}",
+        f"  span: {report.schedule_span_s:.3f} s, duty cycle: {100 * report.duty_cycle:.1f} %, "
+        f"stream: {report.stream_bytes_per_s / 1e6:.1f} MB/s",
+        f"  file loads: {report.load_bytes / 1e6:.1f} MB, mean {report.mean_load_bytes_per_s / 1e6:.1f} MB/s, "
+        f"peak {report.peak_load_bytes_per_s / 1e6:.1f} MB/s",
+    ]
+    if report.missing_files:
+        lines.append(f"  missing IQ files: {report.missing_files}")
+    if report.dropped_rows:
+        lines.append(f"  dropped rows: {report.dropped_rows[:NUM_WORST_INTERVALS]}")
+    if report.late_retune_rows:
+        lines.append(f"  late retune rows: {report.late_retune_rows[:NUM_WORST_INTERVALS]}")
+    for interval in report.worst_intervals:
+        lines.append(
+            f"  row {interval['row']} at {interval['time_start']:.6f} s: gap {interval['gap_s']:.6f} s, "
+            f"load {interval['load_bytes'] / 1e6:.2f} MB ({interval['load_bytes_per_s'] / 1e6:.1f} MB/s)"
+        )
+    return "\n".join(lines)
+
+
+def check_schedule(config, max_load_bytes_per_s: float = None, **kwargs):
+    """
+    Pre-flight gate: analyze a tx config and log the reports
+
+    :param config: Tx config or the name of its file
+    :type config: RadiosConfig or str
+
+    :param max_load_bytes_per_s: Storage bandwidth budget, peak file loads above
+        it make the schedule infeasible
+    :type max_load_bytes_per_s: float or None
+
+    :return: Feasibility and the reports
+    :rtype: tuple[bool, list[ChannelScheduleReport]]
+    """
+    if isinstance(config, str):
+        config = load_config(config, check_files=False)
+    reports = analyze_schedule(config, **kwargs)
+    feasible = True
+    for report in reports:
+        over_budget = (
+            max_load_bytes_per_s is not None and report.peak_load_bytes_per_s > max_load_bytes_per_s
+        )
+        feasible &= report.feasible and not over_budget
+        if report.feasible and not over_budget:
+            logger.info(format_report(report))
+        else:
+            logger.warning(format_report(report))
+    return feasible, reports
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Predict dropped energies, late retunes and I/O load of a transmit schedule"
+    )
+    parser.add_argument("txconfig", type=str, help="Tx frontend configuration")
+    parser.add_argument("--metadata", type=str, default=None, help="Energy metadata CSV overriding the config")
+    parser.add_argument("--guard-s", type=float, default=GUARD_INTERVAL_S, help="Guard interval between energies")
+    parser.add_argument(
+        "--retune-latency-s", type=float, default=None, help="RF retune settling time, defaults to the config's"
+    )
+    parser.add_argument(
+        "--max-load-mbps", type=float, default=None, help="Storage bandwidth budget in MB/s"
+    )
+    parser.add_argument("--worst", type=int, default=NUM_WORST_INTERVALS, help="Worst intervals to report")
+    parser.add_argument("--json", type=str, default=None, help="Write the reports to this JSON file")
+    parser.add_argument("--strict", action="store_true", help="Exit with 1 if the schedule is not feasible")
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    max_load = None if args.max_load_mbps is None else args.max_load_mbps * 1e6
+    feasible, reports = check_schedule(
+        args.txconfig,
+        max_load_bytes_per_s=max_load,
+        metadata=args.metadata,
+        guard_s=args.guard_s,
+        retune_latency_s=args.retune_latency_s,
+        num_worst=args.worst,
+    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([dict(asdict(r), feasible=r.feasible) for r in reports], f, indent=4)
+    return 1 if args.strict and not feasible else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""
+Streaming power spectrogram engine for debug plots and QA.
+
+Computes power-only STFT frames chunk by chunk with a cached window and a
+reused frame buffer, instead of full complex spectrograms of whole captures.
+Frames can be averaged in time for display, and spectrograms of files are
+cached on disk by (file, parameters).
+"""
+
+from functools import lru_cache
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+from scipy import fft, signal
+
+CACHE_DIR = "/tmp/rfsynth_cache/spectrograms/"
+
+
+@lru_cache(maxsize=16)
+def get_window(window, nperseg: int):
+    """Cached, read-only analysis window"""
+    win = signal.get_window(window, nperseg).astype(np.float32)
+    win.setflags(write=False)
+    return win
+
+
+class SpectrogramEngine:
+    """
+    Power spectrogram of complex samples, fftshifted, with density scaling.
+
+    :param fs: Sample rate
+    :type fs: float
+
+    :param nperseg: Samples per frame
+    :type nperseg: int
+
+    :param noverlap: Samples shared by consecutive frames
+    :type noverlap: int
+
+    :param nfft: FFT length, at least nperseg
+    :type nfft: int
+
+    :param window: Window name or tuple understood by scipy.signal.get_window
+    :type window: str or tuple
+
+    :param max_frames: Average frames in time so at most this many are returned.
+        None keeps every frame
+    :type max_frames: int or None
+
+    :param chunk_frames: Frames transformed per step
+    :type chunk_frames: int
+
+    :param cache_dir: Directory holding cached spectrograms of files
+    :type cache_dir: str
+    """
+
+    def __init__(
+        self,
+        fs: float,
+        nperseg: int = 256,
+        noverlap: int = 128,
+        nfft: int = 256,
+        window="hamming",
+        max_frames: int = 2048,
+        chunk_frames: int = 4096,
+        cache_dir: str = CACHE_DIR,
+    ):
+        self.fs = fs
+        self.nperseg = nperseg
+        self.hop = nperseg - noverlap
+        self.nfft = max(nfft, nperseg)
+        self.window = window
+        self.max_frames = max_frames
+        self.chunk_frames = chunk_frames
+        self.cache_dir = cache_dir
+
+        self._win = get_window(window, nperseg)
+        self._scale = 1.0 / (fs * np.sum(self._win.astype(np.float64) ** 2))
+        # Reused for every chunk, the zero padding beyond nperseg stays zero
+        self._frames = np.zeros((chunk_frames, self.nfft), dtype=np.complex64)
+
+    def params(self):
+        """Parameters that determine the result, used for cache keys"""
+        return (self.fs, self.nperseg, self.hop, self.nfft, str(self.window), self.max_frames)
+
+    def num_frames(self, num_samples: int):
+        if num_samples < self.nperseg:
+            return 0
+        return (num_samples - self.nperseg) // self.hop + 1
+
+    def get_decimation(self, num_samples: int):
+        num_frames = self.num_frames(num_samples)
+        if self.max_frames is None or num_frames <= self.max_frames:
+            return 1
+        return -(-num_frames // self.max_frames)
+
+    def _power_frames(self, samples, first_frame, num_frames):
+        # Power of frames [first_frame, first_frame + num_frames) of samples
+        start = first_frame * self.hop
+        stop = start + (num_frames - 1) * self.hop + self.nperseg
+        segments = np.lib.stride_tricks.sliding_window_view(samples[start:stop], self.nperseg)[:: self.hop]
+        frames = self._frames[:num_frames]
+        np.multiply(segments, self._win, out=frames[:, : self.nperseg])
+        spectrum = fft.fft(frames, axis=-1, overwrite_x=False)
+        power = spectrum.real**2 + spectrum.imag**2
+        return (power * self._scale).astype(np.float32)
+
+    def compute(self, samples):
+        """
+        Compute the spectrogram of an array of samples
+
+        :param samples: Complex samples
+        :type samples: np.ndarray
+
+        :return: Frequencies (fftshifted), frame center times and power with
+            shape (num_frames, nfft)
+        :rtype: tuple[np.ndarray, np.ndarray, np.ndarray]
+        """
+        num_frames = self.num_frames(len(samples))
+        decimation = self.get_decimation(len(samples))
+        # Whole groups of averaged frames per chunk
+        step = max(decimation, self.chunk_frames // decimation * decimation)
+
+        num_out = -(-num_frames // decimation)
+        power = np.empty((num_out, self.nfft), dtype=np.float32)
+        out_idx = 0
+        for first_frame in range(0, num_frames, step):
+            # Chunks larger than the frame buffer are split further
+            count = min(step, num_frames - first_frame)
+            chunk_power = np.concatenate(
+                [
+                    self._power_frames(samples, first_frame + k, min(self.chunk_frames, count - k))
+                    for k in range(0, count, self.chunk_frames)
+                ]
+            )
+            groups = -(-count // decimation)
+            pad = groups * decimation - count
+            if pad:
+                # The last group may be short, average what is there
+                chunk_power = np.concatenate((chunk_power, np.full((pad, self.nfft), np.nan, dtype=np.float32)))
+            power[out_idx : out_idx + groups] = np.nanmean(
+                chunk_power.reshape(groups, decimation, self.nfft), axis=1
+            )
+            out_idx += groups
+
+        freqs = np.fft.fftshift(np.fft.fftfreq(self.nfft, 1 / self.fs))
+        centers = (np.arange(num_frames) * self.hop + self.nperseg / 2) / self.fs
+        if decimation > 1 and num_frames:
+            group_starts = np.arange(0, num_frames, decimation)
+            counts = np.diff(np.append(group_starts, num_frames))
+            centers = np.add.reduceat(centers, group_starts) / counts
+        return freqs, centers, np.fft.fftshift(power, axes=1)
+
+    def _cache_path(self, filepath):
+        stat = os.stat(filepath)
+        key = f"{os.path.realpath(filepath)}|{stat.st_size}|{stat.st_mtime_ns}|{self.params()}"
+        digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.npz")
+
+    def compute_file(self, filepath: str):
+        """
+        Compute the spectrogram of a complex64 IQ file, reading it in chunks.
+        Results are cached on disk by (file, parameters).
+
+        :param filepath: IQ file
+        :type filepath: str
+
+        :return: Frequencies, frame center times and power, as in compute
+        :rtype: tuple[np.ndarray, np.ndarray, np.ndarray]
+        """
+        cache_path = self._cache_path(filepath)
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                return cached["freqs"], cached["times"], cached["power"]
+
+        samples = np.memmap(filepath, dtype=np.complex64, mode="r")
+        freqs, times, power = self.compute(samples)
+        del samples
+
+        Path(self.cache_dir).mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, freqs=freqs, times=times, power=power)
+        os.replace(tmp_path, cache_path)
+        return freqs, times, power
+
+
+def get_color_bounds(power_db, low_fraction: float = 0.1, margin_db: float = 10):
+    """
+    Color limits for a spectrogram in dB: the mean of its lowest values plus a
+    margin, and its max minus a margin
+
+    :param power_db: Spectrogram in dB
+    :type power_db: np.ndarray
+
+    :param low_fraction: Fraction of the lowest values averaged for the floor
+    :type low_fraction: float
+
+    :param margin_db: Margin applied to both bounds
+    :type margin_db: float
+
+    :return: Lower and upper color bound
+    :rtype: tuple[float, float]
+    """
+    values = np.ravel(power_db)
+    num_min_vals = max(1, int(np.round(low_fraction * len(values))))
+    clo = np.average(np.partition(values, num_min_vals - 1)[:num_min_vals]) + margin_db
+    chi = np.max(values) - margin_db
+    return clo, chi
@@ -0,0 +1,164 @@
+"""
+Fine synchronization estimates from detected preambles.
+
+Preamble detection gives an integer sample index of the correlation peak.
+This module refines it to a fractional-sample delay by parabolic
+interpolation of the peak and its neighbours. It also estimates the carrier
+frequency offset and phase from the phase progression of the preamble
+correlation over short segments. Estimates are computed together for all
+detections in a capture: the template is walked block by block and every
+block is gathered for all detections at once, so memory stays bounded even
+for long preambles.
+"""
+
+import numpy as np
+
+from rfsynth.otatestbed.nco import frequency_shift
+
+DEFAULT_MAX_CFO_HZ = 10e3
+DEFAULT_BLOCK_LEN = 1 << 16
+
+SYNC_ESTIMATE_DTYPE = np.dtype(
+    [
+        ("peak_idx", np.int64),
+        ("frac_delay", np.float64),
+        ("cfo_hz", np.float64),
+        ("phase_rad", np.float64),
+    ]
+)
+
+
+def parabolic_peak_offset(y_left, y_peak, y_right):
+    """
+    Fractional offset of a peak from three equally spaced samples around it
+
+    :param y_left: Magnitudes one sample before the peaks
+    :type y_left: np.ndarray
+
+    :param y_peak: Magnitudes at the peaks
+    :type y_peak: np.ndarray
+
+    :param y_right: Magnitudes one sample after the peaks
+    :type y_right: np.ndarray
+
+    :return: Offsets in samples, within [-0.5, 0.5]
+    :rtype: np.ndarray
+    """
+    y_left, y_peak, y_right = np.broadcast_arrays(y_left, y_peak, y_right)
+    denom = y_left - 2 * y_peak + y_right
+    offset = np.zeros(denom.shape)
+    valid = denom != 0
+    offset[valid] = 0.5 * (y_left[valid] - y_right[valid]) / denom[valid]
+    return np.clip(offset, -0.5, 0.5)
+
+
+def get_cfo_segment_len(fs: float, pn_len: int, max_cfo_hz: float = DEFAULT_MAX_CFO_HZ):
+    """Segment length that keeps phase steps below pi/2 up to max_cfo_hz"""
+    return int(np.clip(fs / (4 * max_cfo_hz), 1, max(1, pn_len // 2)))
+
+
+def estimate_sync(
+    rx_seq,
+    pn_seqs,
+    peak_indices,
+    fs: float,
+    max_cfo_hz: float = DEFAULT_MAX_CFO_HZ,
+    block_len: int = DEFAULT_BLOCK_LEN,
+):
+    """
+    Estimate fractional delay, CFO and phase for detections in one capture
+
+    :param rx_seq: Received samples holding all the detected preambles
+    :type rx_seq: np.ndarray
+
+    :param pn_seqs: Preamble template of each detection, all the same length
+    :type pn_seqs: list[np.ndarray]
+
+    :param peak_indices: Integer correlation peak of each detection
+    :type peak_indices: list[int]
+
+    :param fs: Sample rate
+    :type fs: float
+
+    :param max_cfo_hz: Largest CFO that can be estimated without ambiguity
+    :type max_cfo_hz: float
+
+    :param block_len: Template samples gathered per step for all detections
+    :type block_len: int
+
+    :return: One SYNC_ESTIMATE_DTYPE record per detection. phase_rad is the
+        carrier phase at the first sample of the preamble
+    :rtype: np.ndarray
+    """
+    peak_indices = np.asarray(peak_indices, dtype=np.int64)
+    num_det = len(peak_indices)
+    estimates = np.zeros(num_det, dtype=SYNC_ESTIMATE_DTYPE)
+    estimates["peak_idx"] = peak_indices
+    if num_det == 0:
+        return estimates
+
+    pn_len = len(pn_seqs[0])
+    seg_len = get_cfo_segment_len(fs, pn_len, max_cfo_hz)
+    num_seg = pn_len // seg_len
+    block_len = max(seg_len, block_len // seg_len * seg_len)
+
+    # Samples at lags -1 and +1 may fall outside the capture, treat them as zero
+    pad = np.zeros(1, dtype=rx_seq.dtype)
+    padded = np.concatenate((pad, rx_seq, pad))
+
+    lag_corr = np.zeros((num_det, 3), dtype=np.complex128)
+    seg_corr = np.zeros((num_det, num_seg), dtype=np.complex128)
+    for block_start in range(0, pn_len, block_len):
+        block_stop = min(block_start + block_len, pn_len)
+        template = np.conj(np.stack([pn[block_start:block_stop] for pn in pn_seqs]))
+        # Window covering lags -1..+1, shifted by one for the padding
+        idx = (peak_indices + block_start)[:, None] + np.arange(block_stop - block_start + 2)
+        window = padded[np.clip(idx, 0, len(padded) - 1)]
+        for lag in range(3):
+            lag_corr[:, lag] += np.sum(window[:, lag : lag + block_stop - block_start] * template, axis=1)
+
+        # Segment sums for the CFO, only whole segments are used
+        seg_stop = min(block_stop, num_seg * seg_len)
+        if seg_stop > block_start:
+            products = window[:, 1 : 1 + seg_stop - block_start] * template[:, : seg_stop - block_start]
+            first_seg = block_start // seg_len
+            seg_corr[:, first_seg : seg_stop // seg_len] = products.reshape(num_det, -1, seg_len).sum(axis=2)
+
+    lag_mag = np.abs(lag_corr)
+    estimates["frac_delay"] = parabolic_peak_offset(lag_mag[:, 0], lag_mag[:, 1], lag_mag[:, 2])
+
+    if num_seg > 1:
+        phase_step = np.angle(np.sum(seg_corr[:, 1:] * np.conj(seg_corr[:, :-1]), axis=1))
+        cfo_hz = phase_step * fs / (2 * np.pi * seg_len)
+    else:
+        cfo_hz = np.zeros(num_det)
+    estimates["cfo_hz"] = cfo_hz
+
+    # Remove the CFO rotation of every segment (referenced to its center) before
+    # combining them into the phase at the start of the preamble
+    seg_centers = np.arange(num_seg) * seg_len + (seg_len - 1) / 2
+    derotate = np.exp(-2j * np.pi * cfo_hz[:, None] * seg_centers[None, :] / fs)
+    estimates["phase_rad"] = np.angle(np.sum(seg_corr * derotate, axis=1))
+    return estimates
+
+
+def correct_cfo(samples, cfo_hz: float, phase_rad: float, fs: float):
+    """
+    Remove a CFO and phase from samples in place
+
+    :param samples: Samples to correct, modified in place
+    :type samples: np.ndarray
+
+    :param cfo_hz: CFO of the samples
+    :type cfo_hz: float
+
+    :param phase_rad: Carrier phase at the first sample
+    :type phase_rad: float
+
+    :param fs: Sample rate
+    :type fs: float
+
+    :return: The corrected samples (same buffer)
+    :rtype: np.ndarray
+    """
+    return frequency_shift(samples, -cfo_hz, fs, phase=-phase_rad, out=samples)
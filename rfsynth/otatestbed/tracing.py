@@ -0,0 +1,347 @@
+"""
+Timed spans across processes, written as a Chrome trace.
+
+Spans are opened with :func:`span` (a context manager) or :func:`traced` (a
+decorator for functions of any signature) and can be nested. While tracing
+is off both cost one attribute check. A :class:`TraceCollector` in the
+parent process turns tracing on and drains a multiprocessing queue in a
+background thread. Pool workers get the queue through
+:func:`executor_kwargs`, and workers of workers get it from their parent the
+same way. Spans are buffered per process and shipped when the outermost span
+of the process closes. :meth:`TraceCollector.write` writes the spans of all
+processes as Chrome trace JSON, which chrome://tracing and
+https://ui.perfetto.dev open as one timeline with a row per process.
+
+Stages named in ``profile_stages`` are also sampled by a
+:class:`SamplingProfiler` while their span is open. The most frequent stacks
+are attached to the span's args.
+
+Typical use::
+
+    collector = tracing.start_collector(profile_stages=["load"])
+    try:
+        with ProcessPoolExecutor(**tracing.executor_kwargs()) as executor:
+            ...
+    finally:
+        collector.write("trace.json")
+"""
+
+from collections import Counter
+import contextlib
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATEGORY = "rfsynth"
+DEFAULT_SAMPLE_INTERVAL_S = 0.001
+# Buffered events are shipped once this many are waiting, even inside a span
+FLUSH_EVENTS = 512
+PROFILE_TOP_STACKS = 20
+PROFILE_MAX_DEPTH = 48
+
+
+class _TraceState:
+    # Per process tracing state, set up by start_collector or init_worker
+    def __init__(self):
+        self.enabled = False
+        self.queue = None
+        self.profile_stages = frozenset()
+        self.sample_interval_s = DEFAULT_SAMPLE_INTERVAL_S
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+
+_state = _TraceState()
+_null_span = contextlib.nullcontext()
+
+
+def is_enabled():
+    return _state.enabled
+
+
+def _now_us():
+    # Wall clock, so timestamps of different processes line up
+    return time.time_ns() // 1000
+
+
+def _emit(event):
+    with _state.lock:
+        _state.events.append(event)
+        should_flush = len(_state.events) >= FLUSH_EVENTS
+    if should_flush:
+        flush()
+
+
+def flush():
+    """Ship the buffered events of this process to the collector"""
+    with _state.lock:
+        events, _state.events = _state.events, []
+    if events and _state.queue is not None:
+        _state.queue.put(events)
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread from a background thread
+
+    :param thread_id: Thread to sample, the calling thread by default
+    :type thread_id: int or None
+
+    :param interval_s: Time between samples
+    :type interval_s: float
+    """
+
+    def __init__(self, thread_id: int = None, interval_s: float = DEFAULT_SAMPLE_INTERVAL_S):
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.interval_s = interval_s
+        self.stacks = Counter()
+        self.num_samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            # Outermost frame first, like folded flame graph stacks
+            self.stacks[";".join(reversed(stack))] += 1
+            self.num_samples += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def top(self, num_stacks: int = PROFILE_TOP_STACKS):
+        """Most frequent stacks as folded stack strings with their sample counts"""
+        return dict(self.stacks.most_common(num_stacks))
+
+
+class _Span:
+    __slots__ = ("name", "cat", "args", "_start_us", "_start_ns", "_profiler")
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self._profiler = None
+
+    def __enter__(self):
+        local = _state.local
+        local.depth = getattr(local, "depth", 0) + 1
+        if self.name in _state.profile_stages:
+            self._profiler = SamplingProfiler(interval_s=_state.sample_interval_s).start()
+        self._start_us = _now_us()
+        self._start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        dur_us = (time.perf_counter_ns() - self._start_ns) / 1000
+        if self._profiler is not None:
+            self._profiler.stop()
+            self.args["profile_samples"] = self._profiler.num_samples
+            self.args["profile"] = self._profiler.top()
+        if exc_type is not None:
+            self.args["error"] = repr(exc)
+        _emit(
+            {
+                "name": self.name,
+                "cat": self.cat,
+                "ph": "X",
+                "ts": self._start_us,
+                "dur": dur_us,
+                "pid": os.getpid(),
+                "tid": threading.get_native_id(),
+                "args": self.args,
+            }
+        )
+        local = _state.local
+        local.depth = getattr(local, "depth", 1) - 1
+        if local.depth <= 0:
+            flush()
+        return False
+
+
+def span(name: str, cat: str = DEFAULT_CATEGORY, **args):
+    """
+    Timed span, as a context manager. Extra keyword arguments are stored
+    with the span. Does nothing while tracing is off.
+
+    :param name: Span name, also the stage name for profiling
+    :type name: str
+
+    :param cat: Category of the span
+    :type cat: str
+    """
+    if not _state.enabled:
+        return _null_span
+    return _Span(name, cat, args)
+
+
+def traced(name: str = None, cat: str = DEFAULT_CATEGORY):
+    """
+    Decorator running every call of a function inside a span
+
+    :param name: Span name, the function's qualified name by default
+    :type name: str or None
+
+    :param cat: Category of the span
+    :type cat: str
+    """
+
+    def decorate(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return func(*args, **kwargs)
+            with _Span(span_name, cat, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def instant(name: str, cat: str = DEFAULT_CATEGORY, **args):
+    """Mark a point in time"""
+    if _state.enabled:
+        _emit(
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "i",
+                "s": "t",
+                "ts": _now_us(),
+                "pid": os.getpid(),
+                "tid": threading.get_native_id(),
+                "args": args,
+            }
+        )
+
+
+def set_process_name(name: str):
+    """Label the row of this process in the trace"""
+    if _state.enabled:
+        _emit({"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": name}})
+        flush()
+
+
+def _configure(queue, profile_stages, sample_interval_s):
+    _state.queue = queue
+    _state.profile_stages = frozenset(profile_stages)
+    _state.sample_interval_s = sample_interval_s
+    _state.enabled = queue is not None
+
+
+def init_worker(queue, profile_stages=(), sample_interval_s=DEFAULT_SAMPLE_INTERVAL_S):
+    """Turn tracing on in a worker process, shipping to the given queue"""
+    # A forked worker inherits the span depth and buffered events of the
+    # thread that created the pool. Its own outermost spans start at depth 0
+    # again, and the parent's events are the parent's to ship.
+    _state.lock = threading.Lock()
+    _state.local = threading.local()
+    _state.events = []
+    _configure(queue, profile_stages, sample_interval_s)
+
+
+def executor_kwargs():
+    """
+    Arguments for ProcessPoolExecutor (or multiprocessing.Pool) that carry
+    tracing into its workers, empty while tracing is off
+
+    :rtype: dict
+    """
+    if not _state.enabled:
+        return {}
+    return {
+        "initializer": init_worker,
+        "initargs": (_state.queue, tuple(_state.profile_stages), _state.sample_interval_s),
+    }
+
+
+class TraceCollector:
+    """
+    Receives the spans of all processes. Use start_collector to create one.
+
+    :param queue: Queue the processes ship their events to
+    :type queue: multiprocessing.Queue
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.events = []
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        while True:
+            events = self.queue.get()
+            if events is None:
+                return
+            self.events.extend(events)
+
+    def close(self):
+        """Stop collecting and turn tracing off in this process"""
+        if not self._thread.is_alive():
+            return
+        flush()
+        _state.enabled = False
+        self.queue.put(None)
+        self._thread.join()
+
+    def to_chrome_trace(self):
+        return {"traceEvents": sorted(self.events, key=lambda e: e.get("ts", 0)), "displayTimeUnit": "ms"}
+
+    def write(self, trace_path: str):
+        """
+        Stop collecting and write the Chrome trace JSON
+
+        :param trace_path: Output file
+        :type trace_path: str
+
+        :return: trace_path
+        :rtype: str
+        """
+        self.close()
+        with open(trace_path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+        logger.info(f"Wrote {len(self.events)} trace events to {trace_path}")
+        return trace_path
+
+
+def start_collector(profile_stages=(), sample_interval_s: float = DEFAULT_SAMPLE_INTERVAL_S):
+    """
+    Turn tracing on in this process and collect the spans of it and its workers
+
+    :param profile_stages: Span names to sample with the profiler
+    :type profile_stages: iterable of str
+
+    :param sample_interval_s: Profiler sampling interval
+    :type sample_interval_s: float
+
+    :return: The collector
+    :rtype: TraceCollector
+    """
+    queue = multiprocessing.Queue()
+    _configure(queue, profile_stages, sample_interval_s)
+    return TraceCollector(queue)
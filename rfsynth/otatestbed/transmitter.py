@@ -1,52 +1,111 @@
-from rfsynth.otatestbed.transmitter_flowgraph import transmitter_flowgraph
+from rfsynth.otatestbed.retune_planner import (
+    GUARD_INTERVAL_S,
+    SHIFT_NCO,
+    RetunePlanner,
+    TimedTuneQueue,
+    lo_per_burst,
+    rf_only_commands,
+    schedule_mask,
+)
+from rfsynth.otatestbed.nco import frequency_shift
+from rfsynth.otatestbed.config_model import parse_radio_config
+from rfsynth.otatestbed.clock_discipline import ClockDiscipline
+from rfsynth.otatestbed.exec_policy import ExecutionPolicy
+from rfsynth.otatestbed.impairments import Impairments
+from rfsynth.otatestbed.iq_reader import open_iq_reader
+from rfsynth.otatestbed.iq_codec import IqzReader, is_compressed_iq
+from rfsynth.otatestbed.burst_pack import BurstPack, is_burst_pack
+from rfsynth.otatestbed.sample_format import CPU_SC16, Sc16Array, is_sc16_file
+from rfsynth.otatestbed import tracing
 import numpy as np
 import json
-import pandas as pd
 import logging
-import pdb
 import time
 
 logger = logging.getLogger(__name__)
 
+# Host/device time pairs read right after the device time is set
+INITIAL_CLOCK_SAMPLES = 8
+
 
 class Transmitter:
-    def __init__(self, radio_config_d):
-        # Pull radio settings from the config dictionary
-        self.address = radio_config_d["addrs"][0]
-        self.clock_rate = radio_config_d["masterClockRate"]
-        self.sample_rate = radio_config_d["sampleRate"]
-        self.num_channels = len(radio_config_d["channels"])
-        self.subdev_spec = radio_config_d["subdevSpec"]
-        # self.num_seconds_receive = radio_config_d['numSecondsReceive']
-
-        # Initialze radio flowgraph
-        self.tb = transmitter_flowgraph(
+    def __init__(self, radio_config, flowgraph=None):
+        # Accept the parsed config model or the raw config dictionary
+        if isinstance(radio_config, dict):
+            radio_config = parse_radio_config(radio_config)
+        self.radio_config = radio_config
+
+        # Pull radio settings from the config
+        self.address = radio_config.address
+        self.clock_rate = radio_config.master_clock_rate
+        self.sample_rate = radio_config.sample_rate
+        self.num_channels = len(radio_config.channels)
+        self.subdev_spec = radio_config.subdev_spec
+        self.retune_planner = RetunePlanner.from_config(radio_config)
+        self.tune_batch_size = radio_config.retune_policy.get("batchSize", 8)
+        self.streaming = radio_config.streaming
+        self.cpu_format = radio_config.cpu_format
+        # Impairments are applied to every burst as it is loaded, ranged ones drawn anew each time
+        self.impairments = Impairments.from_config(radio_config)
+        self._stream_peaks = {}
+        self._burst_packs = {}
+        self._resampled_paths = {}
+        # self.num_seconds_receive = radio_config.num_seconds_receive
+
+        # Pin and prioritize this worker before the flowgraph threads are started, they inherit it
+        self.exec_policy = ExecutionPolicy.from_config(radio_config)
+        self.exec_policy.apply(radio_config.name)
+
+        # Initialze radio flowgraph, GNU Radio is only loaded once a radio is used.
+        # Another flowgraph class with the same interface can be passed instead.
+        if flowgraph is None:
+            from rfsynth.otatestbed.transmitter_flowgraph import transmitter_flowgraph as flowgraph
+
+        self.tb = flowgraph(
             address=self.address,
             clock_rate=self.clock_rate,
             sample_rate=self.sample_rate,
             num_channels=self.num_channels,
             subdev_spec=self.subdev_spec,
+            streaming=self.streaming,
+            cpu_format=self.cpu_format,
         )
 
         # Configure individual channels on the flowgraph
         self.filepaths = []
         self.metadata_files = []
-        for channel_num, channel_config_d in enumerate(radio_config_d["channels"]):
-            # Pull antenna settings from the channel config dictionary
-            antenna = channel_config_d["antenna"]
-            gain = channel_config_d["gain"]
-            center_freq = channel_config_d["IQSTREAM_Params"]["frequency"]
+        self.center_freqs = []
+        self.file_sample_rates = []
+        self.bursts = []
+        for channel_num, channel_config in enumerate(radio_config.channels):
+            # Pull antenna settings from the channel config
+            antenna = channel_config.antenna
+            gain = channel_config.gain
+            center_freq = channel_config.iq_stream.frequency
 
             # Configure the channel settings
             self.tb.configure_channel(antenna, gain, center_freq, channel_num)
-            # Set time to host-time
-            self.tb.set_time_now()
 
-            self.filepaths.append(channel_config_d["IQSTREAM_Params"]["file"])
-            self.metadata_files.append(channel_config_d["IQSTREAM_Params"]["metadata"])
+            self.center_freqs.append(center_freq)
+            # IQ files are assumed to be at the radio's rate unless stated otherwise
+            self.file_sample_rates.append(radio_config.file_sample_rate(channel_num))
+            self.filepaths.append(channel_config.iq_stream.file)
+            self.metadata_files.append(channel_config.iq_stream.metadata)
+            self.bursts.append(channel_config.iq_stream.burst)
+
+        # Set time to host-time once for the whole radio, then track how it drifts
+        self.clock = ClockDiscipline.from_config(radio_config)
+        self.set_time_now()
 
     def set_time_now(self):
         self.tb.set_time_now()
+        # Device time was re-based, earlier pairs no longer apply
+        self.clock = ClockDiscipline(self.clock.window, self.clock.sample_interval_s)
+        self.sample_clock(INITIAL_CLOCK_SAMPLES)
+
+    def sample_clock(self, num_samples=1):
+        for _ in range(num_samples):
+            self.clock.add_sample(*self.tb.get_time_pair())
 
     def get_time_difference(self):
         return self.tb.get_time_difference()
@@ -54,8 +113,17 @@ class Transmitter:
     def timed_start(self, time_start):
         self.tb.timed_start(time_start)
 
-    def timed_tune_channel(self, center_freq, cmd_time, channel_idx):
-        self.tb.timed_tune_channel(center_freq, cmd_time, channel_idx)
+    def timed_tune_channel(self, center_freq, cmd_time, channel_idx, lo_freq=None):
+        self.tb.timed_tune_channel(center_freq, cmd_time, channel_idx, lo_freq)
+
+    def timed_tune_batch(self, commands, start_time, channel_idx):
+        self.tb.timed_tune_batch(
+            [
+                (cmd.target_freq, self.clock.to_device(start_time + cmd.cmd_time), cmd.lo_freq)
+                for cmd in commands
+            ],
+            channel_idx,
+        )
 
     def start(self):
         self.tb.start()
@@ -87,74 +155,260 @@ class Transmitter:
         """
         num_tx_es = 0
 
-        # Consider fixing this prev filename thing?
-        prev_filename = ""
-        center_freq_prev = 0
-        prev_time_stop: float = -1
-        for row_idx, row in df.iterrows():
-
-            st_time = time.time()
-            # Check if this is for you
-            if row.tx_radio != transmitter_idx + 1:
-                continue
-
-            # Check if previous transmission is done
-            if prev_time_stop + 0.0070 > row.time_start:
+        with tracing.span("schedule", radio=transmitter_idx, channel=channel_idx):
+            # Drop the energies that overlap the previous one before the loop starts
+            df = df[df.tx_radio == transmitter_idx + 1]
+            keep = schedule_mask(
+                df.time_start.to_numpy(), df.timeLength_s.to_numpy(), GUARD_INTERVAL_S
+            )
+            for row_idx in df.index[~keep]:
+                # Lazy formatting, so the rate limit sees one template for all skips
                 logger.warning(
-                    f"Tx {transmitter_idx}.Chan {channel_idx} Skipping energy {row_idx} because previous energy is still transmitting"
+                    "Tx %d.Chan %d Skipping energy %s because previous energy is still transmitting",
+                    transmitter_idx,
+                    channel_idx,
+                    row_idx,
                 )
-                continue
-
-            center_freq = (row.freq_lo + row.freq_hi) / 2
-            if center_freq_prev != center_freq:
-                self.timed_tune_channel(
-                    center_freq, start_time + row.time_start, channel_idx
+            df = df[keep]
+
+            # Plan all retunes up front and queue them on the radio in batches
+            tune_commands = self.retune_planner.plan(
+                df.time_start.to_numpy(),
+                df.timeLength_s.to_numpy(),
+                df.freq_lo.to_numpy(),
+                df.freq_hi.to_numpy(),
+                current_freq=self.center_freqs[channel_idx],
+            )
+            if self.retune_planner.shift_mode == SHIFT_NCO:
+                # Offsets inside the LO window are mixed into the samples instead
+                burst_offsets = (df.freq_lo.to_numpy() + df.freq_hi.to_numpy()) / 2 - lo_per_burst(
+                    tune_commands, len(df), self.center_freqs[channel_idx]
                 )
-                center_freq_prev = center_freq
+                tune_commands = rf_only_commands(tune_commands)
+            else:
+                burst_offsets = np.zeros(len(df))
+            tune_queue = TimedTuneQueue(
+                tune_commands,
+                lambda batch: self.timed_tune_batch(batch, start_time, channel_idx),
+                self.tune_batch_size,
+            )
+
+        # Consider fixing this prev filename thing?
+        prev_data_key = None
+        has_offsets = "iq_offset" in df.columns and "iq_length" in df.columns
+        for row_pos, (row_idx, row) in enumerate(df.iterrows()):
+
+            st_time = time.time()
+            with tracing.span("tune"):
+                tune_queue.advance(row_pos)
 
             # TODO: configure gain
 
-            # configure file
-            if prev_filename != row.iq_filename:
-                self.set_single_channel_data_from_file(row.iq_filename, channel_idx)
-                prev_filename = row.iq_filename
+            # configure file, bursts may be cut from a larger file by sample offset
+            sample_offset = int(row.iq_offset) if has_offsets else 0
+            num_samples = int(row.iq_length) if has_offsets else None
+            data_key = (row.iq_filename, burst_offsets[row_pos], sample_offset, num_samples)
+            if prev_data_key != data_key:
+                self.set_single_channel_data_from_file(
+                    row.iq_filename,
+                    channel_idx,
+                    burst_offsets[row_pos],
+                    sample_offset,
+                    num_samples,
+                )
+                prev_data_key = data_key
             mid_time = time.time()
             # start and wait
 
-            self.timed_start(start_time + row.time_start)
-            self.wait()
-            self.stop()
-            logger.debug(
-                f"One timed loop: {time.time() - st_time}, mid_time: {mid_time-st_time}"
-            )
-            prev_time_stop = row.time_start + row.timeLength_s
+            # Schedule times are host times, the radio needs its own
+            with tracing.span("start", row=int(row_idx)):
+                self.timed_start(self.clock.to_device(start_time + row.time_start))
+            with tracing.span("wait", row=int(row_idx)):
+                self.wait()
+                self.stop()
+            if self.clock.due():
+                self.sample_clock()
+            logger.debug("One timed loop: %s, mid_time: %s", time.time() - st_time, mid_time - st_time)
 
             num_tx_es += 1
 
         logger.info(
             f"Tx {transmitter_idx}.Chan {channel_idx} Transmitted {num_tx_es} energies"
         )
+        logger.info(f"Tx {transmitter_idx} clock discipline: {self.clock.metrics()}")
+        if self.streaming:
+            logger.info(
+                f"Tx {transmitter_idx}.Chan {channel_idx} stream: {self.tb.get_stream_stats(channel_idx)}"
+            )
 
     def set_all_channel_data(self):
         for channel_num in range(self.num_channels):
             iq_filepath = self.filepaths[channel_num]
-            self.set_single_channel_data_from_file(iq_filepath, channel_num)
+            burst = self.bursts[channel_num]
+            if burst is None:
+                self.set_single_channel_data_from_file(iq_filepath, channel_num)
+                continue
+            # The channel plays a single burst out of a burst pack
+            pack = self.get_burst_pack(iq_filepath)
+            record = pack.index[pack.burst_id(burst)]
+            self.set_single_channel_data_from_file(
+                iq_filepath, channel_num, 0.0, int(record["offset"]), int(record["length"])
+            )
+
+    def get_burst_pack(self, pack_path):
+        # Every pack is mapped once and kept for the whole run
+        if pack_path not in self._burst_packs:
+            self._burst_packs[pack_path] = BurstPack(pack_path)
+        return self._burst_packs[pack_path]
+
+    @tracing.traced("load")
+    def set_single_channel_data_from_file(
+        self, iq_filepath, channel_num, offset_hz=0.0, sample_offset=0, num_samples=None
+    ):
+        # Offsets are given in samples of the file, at the file's sample rate
+        iq_filepath, sample_offset, num_samples = self.get_radio_rate_segment(
+            iq_filepath, channel_num, sample_offset, num_samples
+        )
+
+        if self.streaming:
+            self.set_single_channel_stream(iq_filepath, channel_num, offset_hz, sample_offset, num_samples)
+            return
 
-    def set_single_channel_data_from_file(self, iq_filepath, channel_num):
-        data_to_tx = self.read_from_file(iq_filepath)
+        data_to_tx = self.read_from_file(iq_filepath, None, sample_offset, num_samples)
         logger.warning("Transmit code is normalizing data magnitudes")
+        if isinstance(data_to_tx, Sc16Array):
+            if self.cpu_format == CPU_SC16 and offset_hz == 0 and not self.impairments.enabled:
+                # int16 from file to radio, never converted to floats
+                self.set_single_channel_data(data_to_tx.normalized(1.0), channel_num)
+                return
+            data_to_tx = np.asarray(data_to_tx)
         data_to_tx = data_to_tx / np.max(np.abs(data_to_tx)) * 1
+        if offset_hz != 0:
+            frequency_shift(data_to_tx, offset_hz, self.sample_rate, out=data_to_tx)
+        if self.impairments.enabled:
+            variant = self.impairments.draw()
+            # Back to a peak of 1, IQ imbalance and DC offset would clip at full scale
+            variant.apply(data_to_tx, self.sample_rate, out=data_to_tx, normalize=True)
+            logger.debug("Chan %d impairments: %s", channel_num, variant.to_dict())
         self.set_single_channel_data(data_to_tx, channel_num)
 
+    def get_radio_rate_segment(self, iq_filepath, channel_num, sample_offset=0, num_samples=None):
+        """
+        File, sample offset and length of a segment at the radio's sample rate
+
+        :param iq_filepath: IQ file at the channel's file sample rate
+        :type iq_filepath: str
+
+        :param channel_num: Channel the segment is for
+        :type channel_num: int
+
+        :param sample_offset: First sample of the segment, in samples of the file
+        :type sample_offset: int
+
+        :param num_samples: Length of the segment in samples of the file, None for the rest of the file
+        :type num_samples: int or None
+
+        :return: The file at the radio's rate, the offset and the length in its samples
+        :rtype: tuple[str, int, int or None]
+        """
+        file_sample_rate = self.file_sample_rates[channel_num]
+        if file_sample_rate == self.sample_rate:
+            return iq_filepath, sample_offset, num_samples
+        resampled_path = self.get_resampled_path(iq_filepath, file_sample_rate)
+        if resampled_path == iq_filepath:
+            return iq_filepath, sample_offset, num_samples
+        if is_burst_pack(iq_filepath):
+            # Bursts are resampled one by one into a new pack, found there by id
+            record = self.get_burst_pack(iq_filepath).find(sample_offset)
+            if record is None or (num_samples is not None and num_samples != record["length"]):
+                raise ValueError(
+                    f"{iq_filepath}: only whole bursts of a burst pack can be resampled, "
+                    f"not {num_samples} samples at offset {sample_offset}"
+                )
+            record = self.get_burst_pack(resampled_path).index[record["burst_id"]]
+            return resampled_path, int(record["offset"]), int(record["length"])
+        ratio = self.sample_rate / file_sample_rate
+        sample_offset = int(round(sample_offset * ratio))
+        num_samples = None if num_samples is None else int(round(num_samples * ratio))
+        return resampled_path, sample_offset, num_samples
+
+    def get_resampled_path(self, iq_filepath, file_sample_rate):
+        """
+        Copy of a file at the radio's sample rate, looked up once per file and rate
+
+        :param iq_filepath: IQ file
+        :type iq_filepath: str
+
+        :param file_sample_rate: Sample rate of the file
+        :type file_sample_rate: float
+
+        :return: The file at the radio's rate
+        :rtype: str
+        """
+        key = (iq_filepath, file_sample_rate)
+        if key not in self._resampled_paths:
+            from rfsynth.otatestbed.resampler import get_resampled_file
+
+            self._resampled_paths[key] = get_resampled_file(iq_filepath, file_sample_rate, self.sample_rate)
+        return self._resampled_paths[key]
+
+    def set_single_channel_stream(self, iq_filepath, channel_num, offset_hz=0.0, sample_offset=0, num_samples=None):
+        # The segment is at the radio's rate already, see get_radio_rate_segment
+        # Normalize the same way as loaded data, the peak is found chunk by chunk once per segment
+        peak_key = (iq_filepath, sample_offset, num_samples)
+        if peak_key not in self._stream_peaks:
+            record = None
+            if is_burst_pack(iq_filepath):
+                record = self.get_burst_pack(iq_filepath).find(sample_offset)
+            if record is not None and record["length"] == num_samples:
+                # Burst packs keep the peak of every burst in their index
+                self._stream_peaks[peak_key] = float(record["peak"])
+            else:
+                stop = None if num_samples is None else sample_offset + num_samples
+                self._stream_peaks[peak_key] = open_iq_reader(iq_filepath).peak(sample_offset, stop)
+        peak = self._stream_peaks[peak_key]
+        scale = 1.0 / peak if peak > 0 else 1.0
+        impairments = None
+        if self.impairments.enabled:
+            variant = self.impairments.draw()
+            # The impaired peak is only known once streamed, back off by its bound instead
+            headroom = variant.peak_gain()
+            scale /= headroom
+            impairments = variant.stream(self.sample_rate, amplitude=1.0 / headroom)
+            logger.debug("Chan %d impairments: %s", channel_num, variant.to_dict())
+        self.tb.set_stream_segment(
+            iq_filepath,
+            channel_num,
+            sample_offset,
+            num_samples,
+            scale,
+            offset_hz,
+            impairments,
+        )
+
     def set_single_channel_data(self, data, channel_num):
         self.tb.set_vector_source_data(data, channel_num)
         return
 
-    def read_from_file(self, filepath):
-        data = np.fromfile(filepath, np.complex64).astype(np.complex128)
+    def read_from_file(self, filepath, file_sample_rate=None, sample_offset=0, num_samples=None):
+        if file_sample_rate is not None and file_sample_rate != self.sample_rate:
+            filepath = self.get_resampled_path(filepath, file_sample_rate)
+        if is_burst_pack(filepath):
+            return np.array(self.get_burst_pack(filepath).read(sample_offset, num_samples))
+        if is_compressed_iq(filepath):
+            return IqzReader(filepath).read(sample_offset, num_samples)
+        if is_sc16_file(filepath):
+            # Scaled lazily, only when the samples are needed as floats
+            return Sc16Array.from_file(filepath, sample_offset, num_samples)
+        count = -1 if num_samples is None else num_samples
+        data = np.fromfile(
+            filepath, np.complex64, count=count, offset=sample_offset * np.dtype(np.complex64).itemsize
+        )
         return data
 
     def read_meta_file(self, meta_file):
+        import pandas as pd
+
         df = pd.read_csv(meta_file)
         return df
 
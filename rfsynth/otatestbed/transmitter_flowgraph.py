@@ -19,10 +19,67 @@ from gnuradio import eng_notation
 from gnuradio import uhd
 import time
 import logging
+import numpy as np
+
+from rfsynth.otatestbed.iq_reader import (
+    DEFAULT_CAPACITY,
+    DEFAULT_CHUNK_SIZE,
+    StreamingIqSource,
+)
+from rfsynth.otatestbed.sample_format import CPU_FC32, CPU_SC16, to_sc16
+
+
+class mmap_iq_source(gr.sync_block):
+    """
+    Source streaming a segment of an IQ file through a bounded ring buffer,
+    instead of holding the samples in a vector_source_c
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, chunk_size=DEFAULT_CHUNK_SIZE, cpu_format=CPU_FC32):
+        out_sig = [(np.int16, 2)] if cpu_format == CPU_SC16 else [np.complex64]
+        gr.sync_block.__init__(self, name="mmap_iq_source", in_sig=None, out_sig=out_sig)
+        self.source = StreamingIqSource(capacity, chunk_size)
+        self.cpu_format = cpu_format
+        self._scratch = np.zeros(0, dtype=np.complex64)
+
+    def set_segment(
+        self, filepath, sample_offset=0, length=None, scale=1.0, offset_hz=0.0, sample_rate=1.0, impairments=None
+    ):
+        self.source.open(filepath)
+        self.source.seek(sample_offset, length, scale, offset_hz, sample_rate, impairments)
+
+    def rewind(self):
+        self.source.rewind()
+
+    def stats(self):
+        return self.source.stats()
+
+    def work(self, input_items, output_items):
+        out = output_items[0]
+        if self.cpu_format == CPU_SC16:
+            # Samples are scaled to int16 pairs on the way out
+            if len(self._scratch) < len(out):
+                self._scratch = np.zeros(len(out), dtype=np.complex64)
+            num_read = self.source.read(self._scratch[: len(out)])
+            to_sc16(self._scratch[:num_read], out=out[:num_read])
+        else:
+            num_read = self.source.read(out)
+        if num_read == 0:
+            return -1  # WORK_DONE, the segment was sent
+        return num_read
 
 
 class transmitter_flowgraph(gr.top_block):
-    def __init__(self, address, clock_rate, sample_rate, num_channels, subdev_spec):
+    def __init__(
+        self,
+        address,
+        clock_rate,
+        sample_rate,
+        num_channels,
+        subdev_spec,
+        streaming=False,
+        cpu_format=CPU_FC32,
+    ):
         gr.top_block.__init__(self, "Not titled yet")
 
         # Radio settings
@@ -31,12 +88,16 @@ class transmitter_flowgraph(gr.top_block):
         self.sample_rate = sample_rate
         self.num_channels = num_channels
         self.subdev_spec = subdev_spec
+        # Stream samples from file through mmap_iq_source instead of vector sources
+        self.streaming = streaming
+        # fc32 hands complex64 to UHD, sc16 int16 pairs
+        self.cpu_format = cpu_format
 
         # Instantiate sink block
         self.uhd_usrp_sink = uhd.usrp_sink(
             ",".join((str(address), "", "master_clock_rate=" + str(clock_rate))),
             uhd.stream_args(
-                cpu_format="fc32",
+                cpu_format=cpu_format,
                 args="",
                 channels=list(range(0, num_channels)),
             ),
@@ -57,7 +118,12 @@ class transmitter_flowgraph(gr.top_block):
         self.uhd_usrp_sink.set_center_freq(center_freq, channel_num)
 
         # Create vector source blocks
-        vector_source_block = blocks.vector_source_c((0, 0, 0), False, 1, [])
+        if self.streaming:
+            vector_source_block = mmap_iq_source(cpu_format=self.cpu_format)
+        elif self.cpu_format == CPU_SC16:
+            vector_source_block = blocks.vector_source_s((0, 0), False, 2, [])
+        else:
+            vector_source_block = blocks.vector_source_c((0, 0, 0), False, 1, [])
 
         # Head block: Not neeeded?
         # tx_head_block = blocks.head(gr.sizeof_gr_complex*1, int(100000))
@@ -72,6 +138,9 @@ class transmitter_flowgraph(gr.top_block):
         return
 
     def set_vector_source_data(self, data, channel_num):
+        if self.cpu_format == CPU_SC16:
+            # int16 pairs, flattened to the interleaved I/Q the vector source expects
+            data = to_sc16(data).ravel()
         self.vector_source_blocks[channel_num].set_data(data)
 
         # self.tx_head_blocks[channel_num].reset()
@@ -80,6 +149,16 @@ class transmitter_flowgraph(gr.top_block):
 
         return
 
+    def set_stream_segment(
+        self, filepath, channel_num, sample_offset=0, length=None, scale=1.0, offset_hz=0.0, impairments=None
+    ):
+        self.vector_source_blocks[channel_num].set_segment(
+            filepath, sample_offset, length, scale, offset_hz, self.sample_rate, impairments
+        )
+
+    def get_stream_stats(self, channel_num):
+        return self.vector_source_blocks[channel_num].stats()
+
     def reset_flowgraph(self):
         # Purge items in USRP buffer
         # TODO: check if this is needed for vector source
@@ -107,15 +186,39 @@ class transmitter_flowgraph(gr.top_block):
         cpu_time = time.time()
         return cpu_time - time_now.get_real_secs()
 
+    def get_time_pair(self):
+        # Device time read, stamped with the middle of the host side read
+        host_before = time.time()
+        device_time = self.uhd_usrp_sink.get_time_now().get_real_secs()
+        host_after = time.time()
+        return (host_before + host_after) / 2, device_time, host_after - host_before
+
     def timed_start(self, time_start):
         self.uhd_usrp_sink.set_start_time(uhd.time_spec_t(time_start))
         self.start()
 
-    def timed_tune_channel(self, center_freq, cmd_time, channel_idx):
+    def timed_tune_channel(self, center_freq, cmd_time, channel_idx, lo_freq=None):
         self.uhd_usrp_sink.set_command_time(uhd.time_spec(cmd_time))
-        self.uhd_usrp_sink.set_center_freq(center_freq, channel_idx)
+        self.uhd_usrp_sink.set_center_freq(
+            self.get_tune_request(center_freq, lo_freq), channel_idx
+        )
         self.uhd_usrp_sink.clear_command_time()
 
+    def timed_tune_batch(self, commands, channel_idx):
+        # commands: iterable of (center_freq, cmd_time, lo_freq)
+        for center_freq, cmd_time, lo_freq in commands:
+            self.timed_tune_channel(center_freq, cmd_time, channel_idx, lo_freq)
+
+    def get_tune_request(self, center_freq, lo_freq=None):
+        if lo_freq is None:
+            return uhd.tune_request(center_freq)
+        # Keep the LO where it is and reach center_freq with the DUC only
+        tune_request = uhd.tune_request(center_freq)
+        tune_request.rf_freq = lo_freq
+        tune_request.rf_freq_policy = uhd.tune_request.POLICY_MANUAL
+        tune_request.dsp_freq_policy = uhd.tune_request.POLICY_AUTO
+        return tune_request
+
     def print_radio_settings(self):
         print("Radio Settings:")
         print("IP Address:", self.address)
@@ -0,0 +1,329 @@
+"""
+Content-addressed cache of extracted data packages.
+
+A data package (the zip written by the compressed engine) is extracted once
+into ``<root>/objects/<sha256 of the zip>`` and reused by every later run of
+the same package. Each run gets its own directory under ``<root>/runs`` with
+hard links to the extracted files, so concurrent runs never overwrite each
+other's files. The energy metadata CSV is the only file a run gets its own
+copy of, with every ``iq_filename`` pointing into the run directory.
+
+Runs hold a reference on the package they use. A package nobody references
+is evicted, least recently used first, once the cache grows beyond its size
+bound. The index of packages, sizes and references is shared by all
+processes through a lock file. References of processes that died without
+releasing them are dropped.
+
+Typical use::
+
+    cache = PackageCache()
+    with cache.acquire("/data/scenario.zip") as run:
+        real_time_transmit(start_time, tx_config_file, run.metadata_file, run.directory)
+"""
+
+import csv
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+
+from rfsynth.file_ops import atomic_write_json, unlink_later
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROOT = os.path.join(tempfile.gettempdir(), "rfsynth_cache")
+DEFAULT_MAX_BYTES = 16 * 2**30
+HASH_CHUNK_BYTES = 1 << 20
+INDEX_FILE = "index.json"
+LOCK_FILE = ".lock"
+
+
+def file_sha256(filepath: str):
+    """
+    SHA-256 of a file, read in chunks
+
+    :param filepath: File to hash
+    :type filepath: str
+
+    :return: Hex digest
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _pid_alive(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _dir_size(directory: str):
+    return sum(
+        os.path.getsize(os.path.join(dirpath, name))
+        for dirpath, _, names in os.walk(directory)
+        for name in names
+    )
+
+
+class PackageRun:
+    """
+    A run's view of an extracted package. Release it, or use it as a context
+    manager, when the run is done.
+
+    :param cache: The cache the run belongs to
+    :type cache: PackageCache
+
+    :param package_hash: SHA-256 of the package
+    :type package_hash: str
+
+    :param run_id: Name of the run directory
+    :type run_id: str
+
+    :param files: Paths of the package files in the run directory
+    :type files: list[str]
+
+    :param metadata_file: Energy metadata CSV of the run, None when the package has none
+    :type metadata_file: str or None
+    """
+
+    def __init__(self, cache, package_hash: str, run_id: str, files, metadata_file):
+        self.cache = cache
+        self.package_hash = package_hash
+        self.run_id = run_id
+        self.files = files
+        self.metadata_file = metadata_file
+        self.released = False
+
+    @property
+    def directory(self):
+        return os.path.join(self.cache.runs_dir, self.run_id)
+
+    def release(self):
+        """Drop the run directory and the run's reference on the package"""
+        if not self.released:
+            self.released = True
+            self.cache.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class PackageCache:
+    """
+    Extraction cache shared by all runs on a host
+
+    :param root: Cache directory
+    :type root: str
+
+    :param max_bytes: Size of the extracted packages above which unreferenced ones are evicted
+    :type max_bytes: int
+    """
+
+    def __init__(self, root: str = DEFAULT_ROOT, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, "objects")
+        self.runs_dir = os.path.join(root, "runs")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.runs_dir, exist_ok=True)
+        self._index_path = os.path.join(root, INDEX_FILE)
+        self._lock_path = os.path.join(root, LOCK_FILE)
+        self._lock_fd = None
+
+    def _lock(self):
+        # Exclusive across processes, every index update happens under it
+        self._lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        os.close(self._lock_fd)
+        self._lock_fd = None
+
+    def _read_index(self):
+        try:
+            with open(self._index_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"packages": {}, "hashes": {}}
+
+    def _write_index(self, index):
+        atomic_write_json(self._index_path, index, indent=1)
+
+    def package_hash(self, zip_path: str, index: dict):
+        """SHA-256 of a package, remembered by path, size and modification time"""
+        real_path = os.path.realpath(zip_path)
+        stat = os.stat(real_path)
+        known = index["hashes"].get(real_path)
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        package_hash = file_sha256(real_path)
+        index["hashes"][real_path] = [stat.st_size, stat.st_mtime_ns, package_hash]
+        return package_hash
+
+    def _extract(self, zip_path: str, package_hash: str):
+        # Extracted next to the final directory and renamed, readers never see a partial package
+        object_dir = os.path.join(self.objects_dir, package_hash)
+        tmp_dir = tempfile.mkdtemp(prefix=f"{package_hash}.", dir=self.objects_dir)
+        try:
+            with zipfile.ZipFile(zip_path) as zip_file:
+                zip_file.extractall(tmp_dir)
+            # A directory the index does not know of is left over from a lost index
+            shutil.rmtree(object_dir, ignore_errors=True)
+            os.replace(tmp_dir, object_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        logger.info("Extracted %s to %s", zip_path, object_dir)
+        return _dir_size(object_dir)
+
+    def acquire(self, zip_path: str):
+        """
+        Extract a package unless it is cached, and set up a run directory for it
+
+        :param zip_path: Data package
+        :type zip_path: str
+
+        :return: The run
+        :rtype: PackageRun
+        """
+        run_id = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        self._lock()
+        try:
+            index = self._read_index()
+            package_hash = self.package_hash(zip_path, index)
+            entry = index["packages"].get(package_hash)
+            object_dir = os.path.join(self.objects_dir, package_hash)
+            if entry is None or not os.path.isdir(object_dir):
+                entry = {"size": self._extract(zip_path, package_hash), "refs": {}}
+                index["packages"][package_hash] = entry
+            else:
+                logger.info("Reusing %s extracted in %s", zip_path, object_dir)
+            entry["refs"][run_id] = os.getpid()
+            entry["last_used"] = time.time()
+            self._evict(index)
+            self._write_index(index)
+        finally:
+            self._unlock()
+        try:
+            return self._make_run(package_hash, run_id)
+        except BaseException:
+            self.release(PackageRun(self, package_hash, run_id, [], None))
+            raise
+
+    def _make_run(self, package_hash: str, run_id: str):
+        object_dir = os.path.join(self.objects_dir, package_hash)
+        run_dir = os.path.join(self.runs_dir, run_id)
+        files = []
+        metadata_file = None
+        for dirpath, _, names in os.walk(object_dir):
+            target_dir = os.path.normpath(os.path.join(run_dir, os.path.relpath(dirpath, object_dir)))
+            os.makedirs(target_dir, exist_ok=True)
+            for name in sorted(names):
+                source = os.path.join(dirpath, name)
+                target = os.path.join(target_dir, name)
+                if name.endswith(".csv"):
+                    self._rewrite_metadata(source, target, run_dir)
+                    metadata_file = metadata_file or target
+                else:
+                    try:
+                        os.link(source, target)
+                    except OSError:
+                        # Another file system, or links are not supported
+                        shutil.copy2(source, target)
+                files.append(target)
+        return PackageRun(self, package_hash, run_id, files, metadata_file)
+
+    @staticmethod
+    def _rewrite_metadata(source: str, target: str, run_dir: str):
+        # IQ files are looked up in the run directory, wherever the engine wrote them
+        with open(source, newline="") as f:
+            reader = csv.DictReader(f)
+            fieldnames = reader.fieldnames or []
+            rows = list(reader)
+        if "iq_filename" in fieldnames:
+            for row in rows:
+                row["iq_filename"] = os.path.join(run_dir, os.path.basename(row["iq_filename"]))
+        with open(target, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames, lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def release(self, run: PackageRun):
+        """
+        Remove a run directory and drop its reference
+
+        :param run: The run
+        :type run: PackageRun
+        """
+        # The links are deleted in the background, the package stays in the cache
+        unlink_later([run.directory])
+        self._lock()
+        try:
+            index = self._read_index()
+            entry = index["packages"].get(run.package_hash)
+            if entry is not None:
+                entry["refs"].pop(run.run_id, None)
+                entry["last_used"] = time.time()
+            self._evict(index)
+            self._write_index(index)
+        finally:
+            self._unlock()
+
+    def _evict(self, index: dict):
+        # Called under the lock: drop dead references, then unreferenced packages until within bounds
+        packages = index["packages"]
+        for entry in packages.values():
+            for run_id, pid in list(entry["refs"].items()):
+                if not _pid_alive(pid):
+                    logger.warning("Dropping run %s of exited process %d", run_id, pid)
+                    entry["refs"].pop(run_id)
+                    shutil.rmtree(os.path.join(self.runs_dir, run_id), ignore_errors=True)
+        for name in os.listdir(self.objects_dir):
+            if name not in packages:
+                # Leftovers of an interrupted extraction, extractions only run under the lock
+                shutil.rmtree(os.path.join(self.objects_dir, name), ignore_errors=True)
+        total = sum(entry["size"] for entry in packages.values())
+        for package_hash in sorted(packages, key=lambda key: packages[key].get("last_used", 0)):
+            if total <= self.max_bytes:
+                break
+            entry = packages[package_hash]
+            if entry["refs"]:
+                continue
+            shutil.rmtree(os.path.join(self.objects_dir, package_hash), ignore_errors=True)
+            total -= entry["size"]
+            del packages[package_hash]
+            logger.info("Evicted package %s (%d bytes)", package_hash, entry["size"])
+        index["hashes"] = {
+            path: known for path, known in index["hashes"].items() if known[2] in packages
+        }
+
+    def clear(self):
+        """Evict every unreferenced package"""
+        max_bytes, self.max_bytes = self.max_bytes, -1
+        self._lock()
+        try:
+            index = self._read_index()
+            self._evict(index)
+            self._write_index(index)
+        finally:
+            self._unlock()
+            self.max_bytes = max_bytes
@@ -12,11 +12,11 @@ import zmq
 from rfsynth.utils import (
     real_time_transmit,
     setup_logger,
-    setup_compressedE,
     offset_and_upload_ground_truth,
     replace_files,
-    run_command,
 )
+from rfsynth.otatestbed import log_queue, tracing
+from rfsynth.package_cache import DEFAULT_MAX_BYTES, DEFAULT_ROOT, PackageCache
 
 __author__ = "Raghav Subbaraman"
 __copyright__ = "Copyright 2022, Regents of the University of California"
@@ -57,6 +57,37 @@ def get_parser():
         default="/tmp/ground_truth_print.json",
         help="Path to save",
     )
+    parser.add_argument(
+        "--preflight",
+        type=str,
+        choices=["off", "warn", "strict"],
+        default="warn",
+        help="Check the schedule for dropped energies and late retunes before transmitting",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=DEFAULT_ROOT,
+        help="Directory of the extracted data package cache",
+    )
+    parser.add_argument(
+        "--cache-size-gb",
+        type=float,
+        default=DEFAULT_MAX_BYTES / 2**30,
+        help="Size above which unused extracted packages are evicted",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="Write a Chrome trace of the run, all radios included, to this file",
+    )
+    parser.add_argument(
+        "--profile-stages",
+        type=str,
+        default="",
+        help="Comma separated trace stages to sample with the profiler, e.g. load,schedule",
+    )
     parser.add_argument(
         "-v",
         "--version",
@@ -147,45 +178,61 @@ def main():
 
     setup_logger(file_name="compressedE_test.log")
 
-    # Reason for looping over keys: To allow for multiple compressedE files to be
-    # transmitted simultaneously
-    for key in get_config_keys(args.config):
-        # This is the same reason for using this process pool executor
-        with concurrent.futures.ProcessPoolExecutor() as process_pool:
-            output_filenames = setup_compressedE(args.data)
-            # Print the compressedE frontend configuration for debugging
-            logging.debug("frontend cfg", args.txconfig)
-
-            # Make the start time 5 seconds from now
-            start_time = time.time() + 5
-            # create a process to transmit the compressedE file
-            compressedE_proc = process_pool.submit(
-                real_time_transmit, start_time, args.txconfig
-            )
-
-            # loop over the output filenames and upload the ground truth
-            for filename in output_filenames:
-                if filename[-4:] == "json":
-                    gt_report, gt_dict = offset_and_upload_ground_truth(
-                        filename, start_time, "PLRD_TEST", args.index
-                    )
-                    replace_files(gt_report, args.path)
-
-            # put energy_broadcaster into a process
-            energy_broadcaster_proc = process_pool.submit(energy_broadcaster, gt_dict)
-
-            # Print the process info
-            # ERROR: This is blocking! TODO: Should put in an array and print later
-            logging.debug(f"Process info: {compressedE_proc.result()}")
-
-            # Wait till energy broadcaster is done
-            logging.debug(f"Process info: {energy_broadcaster_proc.result()}")
-
-            for file_n in output_filenames:
-                if file_n[-4:] == "32cf":
-                    logging.info(f"removing {file_n}")
-                    rm_command = ["rm", file_n]
-                    run_command(rm_command, "./")
+    collector = None
+    if args.trace:
+        collector = tracing.start_collector([stage for stage in args.profile_stages.split(",") if stage])
+    cache = PackageCache(args.cache_dir, int(args.cache_size_gb * 2**30))
+
+    try:
+        # Reason for looping over keys: To allow for multiple compressedE files to be
+        # transmitted simultaneously
+        for key in get_config_keys(args.config):
+            # This is the same reason for using this process pool executor
+            # Extracted once per package, every run gets its own directory and metadata
+            with tracing.span("unzip"):
+                run = cache.acquire(args.data)
+            with run, concurrent.futures.ProcessPoolExecutor(**log_queue.executor_kwargs()) as process_pool:
+                output_filenames = run.files
+                # Print the compressedE frontend configuration for debugging
+                logging.debug("frontend cfg", args.txconfig)
+
+                # Predict dropped energies and late retunes before any radio is touched
+                if args.preflight != "off":
+                    from rfsynth.otatestbed.schedule_analyzer import check_schedule
+
+                    feasible, _ = check_schedule(args.txconfig, metadata=run.metadata_file)
+                    if not feasible and args.preflight == "strict":
+                        logging.error(f"Schedule for {key} is not feasible, not transmitting")
+                        continue
+
+                # Make the start time 5 seconds from now
+                start_time = time.time() + 5
+                # create a process to transmit the compressedE file
+                compressedE_proc = process_pool.submit(
+                    real_time_transmit, start_time, args.txconfig, run.metadata_file, run.directory
+                )
+
+                # loop over the output filenames and upload the ground truth
+                for filename in output_filenames:
+                    if filename[-4:] == "json":
+                        gt_report, gt_dict = offset_and_upload_ground_truth(
+                            filename, start_time, "PLRD_TEST", args.index
+                        )
+                        replace_files(gt_report, args.path)
+
+                # put energy_broadcaster into a process
+                energy_broadcaster_proc = process_pool.submit(energy_broadcaster, gt_dict)
+
+                # Print the process info
+                # ERROR: This is blocking! TODO: Should put in an array and print later
+                logging.debug(f"Process info: {compressedE_proc.result()}")
+
+                # Wait till energy broadcaster is done
+                logging.debug(f"Process info: {energy_broadcaster_proc.result()}")
+    finally:
+        if collector is not None:
+            collector.write(args.trace)
+        log_queue.stop_logging()
 
 
 if __name__ == "__main__":
@@ -5,13 +5,11 @@ Utils module for the rfsynth package. This module contains helper functions
 import logging
 import concurrent.futures
 import os
-import sys
-from pathlib import Path
 import json
-import shutil
-import subprocess
 
-from rfsynth.otatestbed.realTimeTestbed import real_time_tx_loop, load_config_json
+from rfsynth.file_ops import atomic_write_json, copy_file, extract_zip, move_file
+from rfsynth.otatestbed.config_model import load_config
+from rfsynth.otatestbed import log_queue, tracing
 from rfsynth.otatestbed.report_utils import (
     offset_ground_truth,
     translate_modulation,
@@ -24,7 +22,8 @@ def setup_logger(
 ):
     """
     Sets up an instance of the logger for the rfsynth package. This logger will
-    be used by all the modules in the package.
+    be used by all the modules in the package, and by the radio workers started
+    with log_queue.executor_kwargs(). Calling it again does not add handlers.
 
     :param log_path: Optional path to the directory where the log file will be stored.
     :type log_path: str or "./logs"
@@ -38,26 +37,11 @@ def setup_logger(
     :return: None
 
     """
-    logFormatter = logging.Formatter(
-        "%(asctime)s [%(threadName)-12.12s] [%(name)s] [%(levelname)-5.5s] \
-        %(message)s"
-    )
-    rootLogger = logging.getLogger()
-    rootLogger.setLevel(loglevel)
+    # Records go through a queue, written by one listener thread for all processes
+    log_queue.start_logging(log_path, file_name, loglevel)
 
-    # Make directory if it does not exist.
-    Path(f"{log_path}").mkdir(parents=True, exist_ok=True)
 
-    fileHandler = logging.FileHandler("{0}/{1}".format(log_path, file_name))
-    fileHandler.setFormatter(logFormatter)
-    rootLogger.addHandler(fileHandler)
-
-    consoleHandler = logging.StreamHandler(stream=sys.stdout)
-    consoleHandler.setFormatter(logFormatter)
-    rootLogger.addHandler(consoleHandler)
-
-
-def real_time_transmit(start_time: float, tx_config_file: str):
+def real_time_transmit(start_time: float, tx_config_file: str, metadata: str = None, data_dir: str = None):
     """
     Performs a real time transmission of the data provided by the config file.
     The transmission starts when the system time equals start_time
@@ -68,17 +52,27 @@ def real_time_transmit(start_time: float, tx_config_file: str):
     :param tx_config_file: The name of the config file
     :type tx_config_file: str
 
+    :param metadata: Optional energy metadata file replacing the one in the config
+    :type metadata: str or None
+
+    :param data_dir: Optional directory of the IQ files, replacing the one in the config
+    :type data_dir: str or None
+
     :return: None
 
     """
-    config_json = load_config_json(tx_config_file)
-    num_transmitters = len(config_json["radios"])
+    # Imported here so report and setup helpers do not load the radio stack
+    from rfsynth.otatestbed.realTimeTestbed import real_time_tx_loop
+
+    # Validate the config, IQ files and metadata once, workers get the parsed radios
+    tx_config = load_config(tx_config_file, metadata=metadata, data_dir=data_dir)
+    num_transmitters = len(tx_config.radios)
     logging.info(f"Starting with {num_transmitters} radios")
 
-    with concurrent.futures.ProcessPoolExecutor() as executor:
+    with concurrent.futures.ProcessPoolExecutor(**log_queue.executor_kwargs()) as executor:
         futures = list()
-        for idx in range(num_transmitters):
-            p = executor.submit(real_time_tx_loop, tx_config_file, idx, 0, start_time)
+        for idx, radio_config in enumerate(tx_config.radios):
+            p = executor.submit(real_time_tx_loop, radio_config, idx, 0, start_time)
             futures.append(p)
 
         for future in concurrent.futures.as_completed(futures):
@@ -106,25 +100,31 @@ def get_config_dicts(json_file: str):
     return cnfg_dict
 
 
+@tracing.traced("unzip")
 def setup_compressedE(data_file: str, folder: str = "/tmp/"):
-    unzip_command = ["unzip", "-o", data_file, "-d", folder]
-    proc_hdl = run_command(unzip_command, os.path.abspath("./"))
-    logging.info("Data loaded")
+    """
+    Extract a data package and move its energy metadata CSV to the fixed
+    name the tx configs refer to
+
+    :param data_file: Data package zip
+    :type data_file: str
 
+    :param folder: Destination directory
+    :type folder: str
+
+    :return: Paths of the extracted files
+    :rtype: list
+    """
     output_list = list()
-    for k in proc_hdl.stdout.split():
-        print("unzip output", k)
+    for k in extract_zip(data_file, folder):
         if k[-3:] == "csv":
             # Move CSV to default name
-            fixed_compressedE_file = f"{folder}compressedE_auto_energy_meta.csv"
-
-            mv_command = ["mv", k, fixed_compressedE_file]
-            proc_hdl = run_command(mv_command, os.path.abspath("../"))
+            fixed_compressedE_file = os.path.join(folder, "compressedE_auto_energy_meta.csv")
+            move_file(k, fixed_compressedE_file)
             output_list.append(fixed_compressedE_file)
-            print("k", output_list)
-        elif k[-1] != ":":
+        else:
             output_list.append(k)
-            print("k", output_list)
+    logging.info("Data loaded")
     return output_list
 
 
@@ -170,8 +170,8 @@ def offset_and_upload_ground_truth(gt_filename: str, offset_time, commit_hash, i
     # Dump gt
     gt_filename = f"compressedE_gt_{commit_hash}_test_{idx+1}.json"
     gt_path = "/tmp/"
-    with open(f"{gt_path}{gt_filename}", "w") as outfile:
-        json.dump(gt_dict, outfile, indent=4)
+    # Published by rename, readers never see a partial file
+    atomic_write_json(f"{gt_path}{gt_filename}", gt_dict, indent=4)
     # upload gt
     try:
         return f"/tmp/{gt_filename}", gt_dict
@@ -180,7 +180,7 @@ def offset_and_upload_ground_truth(gt_filename: str, offset_time, commit_hash, i
 
 
 def replace_files(filename1: str, filename2: str):
-    """Copy contents filename1 into filename2. Overwrites filename2
+    """Copy contents filename1 into filename2. Atomically replaces filename2
 
     :param filename1: The name of the file to copy
     :type filename1: str
@@ -195,38 +195,5 @@ def replace_files(filename1: str, filename2: str):
     if filename1 == filename2:
         return 0
 
-    with open(filename1, "+rb") as input, open(filename2, "+wb") as output:
-        shutil.copyfileobj(input, output)
-
-
-def run_command(
-    command: list, cwd: str = None, stdoutp=subprocess.PIPE, sterrp=subprocess.PIPE
-):
-    """
-    Run a command and return the process handle
-
-    :param command: The command to run
-    :type command: list
-
-    :param cwd: The current working directory
-    :type cwd: str
-
-    :param stdoutp: The stdout pipe
-    :type stdoutp: subprocess.PIPE
-
-    :param sterrp: The stderr pipe
-    :type sterrp: subprocess.PIPE
-
-    :return: The process handle
-    :rtype: int
-    """
-    # proc_hdl = subprocess.run(command,capture_output=True, text=True, cwd = cwd, check=True)
-    proc_hdl = subprocess.run(
-        command,
-        stdout=stdoutp,
-        stderr=sterrp,
-        universal_newlines=True,
-        cwd=cwd,
-        check=True,
-    )
-    return proc_hdl
+    # Written next to filename2 and renamed over it
+    copy_file(filename1, filename2)
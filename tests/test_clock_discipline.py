@@ -0,0 +1,58 @@
+import numpy as np
+
+from rfsynth.otatestbed.clock_discipline import ClockDiscipline, SimulatedDriftingClock
+
+OFFSET_S = 2.5e-3
+DRIFT_PPM = 3.0
+JITTER_S = 5e-6
+T0 = 1.7e9  # epoch sized host times, as from time.time()
+
+
+def discipline(clock, num_samples, window=64):
+    estimator = ClockDiscipline(window=window)
+    for idx in range(num_samples):
+        estimator.add_sample(*clock.get_time_pair(T0 + idx))
+    return estimator
+
+
+def test_recovers_offset_and_drift():
+    clock = SimulatedDriftingClock(OFFSET_S, DRIFT_PPM, JITTER_S, seed=0)
+    estimator = discipline(clock, 100)
+    metrics = estimator.metrics()
+    assert abs(metrics["drift_ppm"] - DRIFT_PPM) < 0.05
+    # The fitted offset is the one at the reference time
+    expected_offset = clock.device_time(estimator.t_ref) - estimator.t_ref
+    assert abs(metrics["offset_s"] - expected_offset) < 1e-5
+    assert metrics["num_samples"] == 64
+    assert metrics["rms_residual_s"] < JITTER_S
+    assert metrics["max_residual_s"] < 5 * JITTER_S
+
+    host_times = T0 + np.array([0.0, 50.0, 150.0, 300.0])
+    np.testing.assert_allclose(estimator.to_device(host_times), clock.device_time(host_times), rtol=0, atol=1e-5)
+
+
+def test_round_trip():
+    estimator = discipline(SimulatedDriftingClock(OFFSET_S, DRIFT_PPM, JITTER_S, seed=1), 20)
+    host_times = T0 + np.linspace(0.0, 1000.0, 11)
+    np.testing.assert_allclose(estimator.to_host(estimator.to_device(host_times)), host_times, rtol=0, atol=1e-6)
+    device_times = estimator.to_device(host_times)
+    np.testing.assert_allclose(estimator.to_device(estimator.to_host(device_times)), device_times, rtol=0, atol=1e-6)
+
+
+def test_slow_reads_are_not_fitted():
+    clock = SimulatedDriftingClock(OFFSET_S, DRIFT_PPM, seed=2)
+    estimator = discipline(clock, 20)
+    drift = estimator.drift
+    # A read that took 10 ms and returned a stale device time
+    estimator.add_sample(T0 + 20, clock.device_time(T0 + 20) - 5e-3, round_trip=1e-2)
+    assert abs(estimator.drift - drift) < 1e-9
+    assert abs(estimator.residuals[-1]) > 4e-3
+
+
+def test_single_pair_gives_the_offset():
+    estimator = ClockDiscipline()
+    assert estimator.to_device(T0) == T0
+    host_time, device_time, _ = SimulatedDriftingClock(OFFSET_S, DRIFT_PPM).get_time_pair(T0)
+    estimator.add_sample(host_time, device_time)
+    assert estimator.drift == 0.0
+    assert abs(estimator.to_device(T0) - device_time) < 1e-6
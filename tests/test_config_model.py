@@ -0,0 +1,176 @@
+import logging
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from rfsynth.otatestbed.config_model import RadioConfig, RadiosConfig, _Errors, parse_config
+
+SAMPLE_RATE = 1e6
+IQ_SAMPLES = 2000
+
+
+def make_metadata(tmp_path, iq_file, **columns):
+    rows = {
+        "time_start": [0.0, 0.01, 0.0, 0.02],
+        "freq_lo": [2.40e9, 2.41e9, 2.42e9, 2.40e9],
+        "freq_hi": [2.41e9, 2.42e9, 2.43e9, 2.41e9],
+        "timeLength_s": [IQ_SAMPLES / SAMPLE_RATE] * 4,
+        "tx_radio": [1, 1, 2, 1],
+        "iq_filename": [iq_file] * 4,
+    }
+    rows.update(columns)
+    meta_file = str(tmp_path / "energies.csv")
+    pd.DataFrame(rows).to_csv(meta_file, index=False)
+    return meta_file
+
+
+def make_config(tmp_path, **columns):
+    iq_file = str(tmp_path / "burst.32cf")
+    np.zeros(IQ_SAMPLES, dtype=np.complex64).tofile(iq_file)
+    meta_file = make_metadata(tmp_path, iq_file, **columns)
+    return {
+        "radios": [
+            {
+                "model": "USRP_X410",
+                "name": f"R{idx}",
+                "addrs": [f"addr=192.168.0.{idx + 2}"],
+                "sampleRate": SAMPLE_RATE,
+                "masterClockRate": 4 * SAMPLE_RATE,
+                "subdevSpec": "A:0",
+                "channels": [
+                    {
+                        "name": "CH0",
+                        "antenna": "TX/RX",
+                        "gain": 0.5,
+                        "IQSTREAM_Params": {"frequency": 2.4e9, "file": iq_file, "metadata": meta_file},
+                    }
+                ],
+            }
+            for idx in range(2)
+        ]
+    }
+
+
+def problems(config_d, **kwargs):
+    with pytest.raises(ValueError) as excinfo:
+        parse_config(config_d, **kwargs)
+    return str(excinfo.value).splitlines()[1:]
+
+
+def test_errors_collect_failed_checks():
+    errors = _Errors()
+    assert errors.check(True, "kept out")
+    assert not errors.check(False, "first")
+    errors.check(False, "second")
+    assert errors == ["first", "second"]
+
+
+def test_valid_config_builds_the_model(tmp_path):
+    config = parse_config(make_config(tmp_path))
+    assert isinstance(config, RadiosConfig)
+    assert [radio.name for radio in config.radios] == ["R0", "R1"]
+    radio = config.radios[0]
+    assert isinstance(radio, RadioConfig)
+    assert radio.address == "addr=192.168.0.2"
+    assert radio.file_sample_rate(0) == SAMPLE_RATE
+    assert radio.channels[0].iq_stream.frequency == 2.4e9
+    # Workers get the model, not the JSON
+    assert pickle.loads(pickle.dumps(config)) == config
+
+
+def test_all_problems_are_reported_together(tmp_path):
+    config_d = make_config(tmp_path)
+    radio_d = config_d["radios"][0]
+    del radio_d["sampleRate"]
+    channel_d = radio_d["channels"][0]
+    channel_d["antenna"] = "RX1"
+    channel_d["gain"] = 1.5
+    channel_d["IQSTREAM_Params"]["sampleRate"] = -1.0
+    config_d["radios"][1]["channels"][0]["IQSTREAM_Params"]["file"] = str(tmp_path / "missing.32cf")
+    found = problems(config_d)
+    assert len(found) == 5
+    assert "radios[0]: missing 'sampleRate'" in found
+    assert any(problem.startswith("radios[0].channels[0]: invalid antenna type (RX1)") for problem in found)
+    assert any(problem.startswith("radios[0].channels[0]: invalid gain (1.5)") for problem in found)
+    assert any(problem.startswith("radios[0].channels[0]: invalid IQ file sample rate (-1.0)") for problem in found)
+    assert f"radios[1].channels[0]: IQ file {tmp_path / 'missing.32cf'} does not exist" in found
+
+
+def test_iq_file_must_hold_whole_samples(tmp_path):
+    config_d = make_config(tmp_path)
+    iq_file = config_d["radios"][0]["channels"][0]["IQSTREAM_Params"]["file"]
+    with open(iq_file, "ab") as f:
+        f.write(b"\0" * 3)
+    found = problems(config_d)
+    # The file is checked once, however many channels and rows refer to it
+    assert found == [
+        f"radios[0].channels[0]: IQ file {iq_file} has {8 * IQ_SAMPLES + 3} bytes, not a whole number of samples"
+    ]
+
+
+def test_metadata_must_exist_and_have_the_columns(tmp_path):
+    config_d = make_config(tmp_path)
+    meta_file = config_d["radios"][0]["channels"][0]["IQSTREAM_Params"]["metadata"]
+    config_d["radios"][1]["channels"][0]["IQSTREAM_Params"]["metadata"] = str(tmp_path / "missing.csv")
+    pd.read_csv(meta_file).drop(columns=["freq_hi"]).to_csv(meta_file, index=False)
+    found = problems(config_d)
+    assert found == [
+        f"radios[0].channels[0]: metadata file {meta_file} is missing columns ['freq_hi']",
+        f"radios[1].channels[0]: metadata file {tmp_path / 'missing.csv'} does not exist",
+    ]
+
+
+def test_files_are_not_checked_on_request(tmp_path):
+    config_d = make_config(tmp_path)
+    config_d["radios"][0]["channels"][0]["IQSTREAM_Params"]["file"] = str(tmp_path / "missing.32cf")
+    assert len(parse_config(config_d, check_files=False).radios) == 2
+
+
+def test_metadata_rows_out_of_bounds_are_rejected(tmp_path):
+    config_d = make_config(
+        tmp_path,
+        time_start=[0.0, -0.01, 0.0, 0.02],
+        timeLength_s=[IQ_SAMPLES / SAMPLE_RATE, IQ_SAMPLES / SAMPLE_RATE, 0.0, IQ_SAMPLES / SAMPLE_RATE],
+        freq_lo=[2.40e9, 2.41e9, 2.42e9, 2.42e9],
+    )
+    meta_file = config_d["radios"][0]["channels"][0]["IQSTREAM_Params"]["metadata"]
+    found = problems(config_d)
+    assert found == [
+        f"{meta_file} row 1: time_start is not a time >= 0",
+        f"{meta_file} row 2: timeLength_s is not a duration > 0",
+        f"{meta_file} row 3: freq_lo is above freq_hi",
+        f"{meta_file} row 1: time_start is before the previous energy of its tx_radio",
+    ]
+
+
+def test_energies_of_a_radio_must_be_in_time_order(tmp_path):
+    # Radio 2 may start before radio 1's last energy, radio 1 may not go back in time
+    config_d = make_config(tmp_path, time_start=[0.0, 0.02, 0.01, 0.01])
+    meta_file = config_d["radios"][0]["channels"][0]["IQSTREAM_Params"]["metadata"]
+    assert problems(config_d) == [f"{meta_file} row 3: time_start is before the previous energy of its tx_radio"]
+
+    # Equal start times are not out of order
+    iq_file = config_d["radios"][0]["channels"][0]["IQSTREAM_Params"]["file"]
+    make_metadata(tmp_path, iq_file, time_start=[0.0, 0.01, 0.0, 0.01])
+    parse_config(config_d)
+
+
+def test_segments_must_be_inside_the_file(tmp_path):
+    config_d = make_config(
+        tmp_path,
+        iq_offset=[0, 1000, 1500, 0],
+        iq_length=[1000, 1000, 1000, 1000],
+        timeLength_s=[1e-3] * 4,
+    )
+    meta_file = config_d["radios"][0]["channels"][0]["IQSTREAM_Params"]["metadata"]
+    assert problems(config_d) == [f"{meta_file} row 2: iq_offset + iq_length is past the end of the IQ file"]
+
+
+def test_duration_mismatch_is_only_a_warning(tmp_path, caplog):
+    config_d = make_config(tmp_path, timeLength_s=[IQ_SAMPLES / SAMPLE_RATE, 1.0, IQ_SAMPLES / SAMPLE_RATE, 1.0])
+    with caplog.at_level(logging.WARNING, logger="rfsynth.otatestbed.config_model"):
+        parse_config(config_d)
+    mismatches = [record.getMessage() for record in caplog.records if "IQ file lasts" in record.getMessage()]
+    assert [message.split(":")[0].rsplit(" ", 1)[1] for message in mismatches] == ["1", "3"]
@@ -0,0 +1,43 @@
+import numpy as np
+
+from rfsynth.otatestbed.impairments import Impairments, iq_imbalance_coefficients
+
+FS = 1e6
+
+
+def make_signal(num_samples, seed=0):
+    rng = np.random.default_rng(seed)
+    samples = rng.standard_normal(num_samples) + 1j * rng.standard_normal(num_samples)
+    return (samples / np.abs(samples).max()).astype(np.complex64)
+
+
+def test_matches_closed_form():
+    impairments = Impairments(cfo_hz=1234.5, iq_gain=0.05, iq_phase=0.03, dc_gain=0.02, dc_phase=0.7)
+    x = make_signal(200000)
+    alpha, beta = iq_imbalance_coefficients(0.05, 0.03)
+    dc = 0.02 * np.exp(1j * 0.7)
+    n = np.arange(len(x))
+    expected = (alpha * x + beta * np.conj(x) + dc) * np.exp(2j * np.pi * 1234.5 * n / FS)
+    np.testing.assert_allclose(impairments.apply(x, FS), expected, atol=1e-5)
+
+
+def test_chunks_match_whole_signal():
+    x = make_signal(10000)
+    params = dict(cfo_hz=-300.0, iq_gain=0.01, dc_gain=0.01, phase_noise_hz=100.0)
+    # Same seed, so the phase noise walks are the same
+    whole = Impairments(seed=3, **params).apply(x, FS)
+    stream = Impairments(seed=3, **params).stream(FS, chunk_size=333)
+    out = np.empty_like(x)
+    for start in range(0, len(x), 1000):
+        stream.process(x[start : start + 1000], out[start : start + 1000])
+    np.testing.assert_allclose(out, whole, atol=1e-5)
+
+
+def test_peak_gain_bounds_the_impaired_signal():
+    impairments = Impairments(cfo_hz=500.0, iq_gain=0.1, iq_phase=0.05, dc_gain=0.05, dc_phase=1.0)
+    x = make_signal(50000, seed=1)
+    out = impairments.apply(x, FS)
+    assert np.abs(out).max() <= impairments.peak_gain() + 1e-6
+    assert np.abs(out).max() > 1.0
+    normalized = impairments.apply(x, FS, normalize=True)
+    assert np.isclose(np.abs(normalized).max(), 1.0)
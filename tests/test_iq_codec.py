@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from rfsynth.otatestbed.iq_codec import INT_MAX, IqzReader, _pack_int12, _unpack_int12, encode_file
+from rfsynth.otatestbed.resampler import resample, resample_file
+
+BLOCK_SIZE = 1000
+NUM_SAMPLES = 3 * BLOCK_SIZE + 457  # not a whole number of blocks
+
+
+@pytest.fixture
+def signal(tmp_path):
+    rng = np.random.default_rng(0)
+    samples = (rng.standard_normal(NUM_SAMPLES) + 1j * rng.standard_normal(NUM_SAMPLES)).astype(np.complex64)
+    # Negative full scale peaks, in I of one block and in Q of another
+    samples[10] = complex(-np.abs(samples[:BLOCK_SIZE].view(np.float32)).max() - 1, 0.5)
+    second_block = samples[BLOCK_SIZE : 2 * BLOCK_SIZE].view(np.float32)
+    samples[BLOCK_SIZE + 5] = complex(0.5, -np.abs(second_block).max() - 1)
+    src_path = str(tmp_path / "signal.32cf")
+    samples.tofile(src_path)
+    return src_path, samples
+
+
+def encode(signal, tmp_path, codec):
+    src_path, _ = signal
+    return encode_file(src_path, str(tmp_path / f"signal_{codec}.iqz"), codec, block_size=BLOCK_SIZE)
+
+
+def test_int12_packing_round_trips_every_value():
+    values = np.arange(-2048, 2048, dtype=np.int16)
+    packed = _pack_int12(values)
+    assert packed.shape == (len(values) // 2, 3)
+    np.testing.assert_array_equal(_unpack_int12(packed.tobytes()), values)
+
+
+@pytest.mark.parametrize("codec", ["raw", "zlib", "lzma"])
+def test_lossless_round_trip(signal, tmp_path, codec):
+    reader = IqzReader(encode(signal, tmp_path, codec))
+    assert reader.num_samples == NUM_SAMPLES
+    assert len(reader.table) == 4
+    np.testing.assert_array_equal(reader.read(), signal[1])
+
+
+@pytest.mark.parametrize("codec", ["int16", "int12"])
+def test_lossy_round_trip_error_is_bounded(signal, tmp_path, codec):
+    _, samples = signal
+    reader = IqzReader(encode(signal, tmp_path, codec))
+    decoded = reader.read()
+    for block_idx, start in enumerate(range(0, NUM_SAMPLES, BLOCK_SIZE)):
+        block = samples[start : start + BLOCK_SIZE].view(np.float32)
+        peak = np.abs(block).max()
+        # The per block scale maps the peak onto the largest integer
+        assert np.isclose(reader.table[block_idx]["scale"], peak / INT_MAX[codec])
+        error = np.abs(decoded[start : start + BLOCK_SIZE].view(np.float32) - block)
+        # Half a quantization step, plus the float32 rounding of the decoded value
+        assert error.max() <= 0.5 * peak / INT_MAX[codec] + 2 * np.spacing(peak)
+    # Negative full scale keeps its sign and magnitude
+    assert np.isclose(decoded[10].real, samples[10].real, rtol=1e-6)
+    assert np.isclose(decoded[BLOCK_SIZE + 5].imag, samples[BLOCK_SIZE + 5].imag, rtol=1e-6)
+
+
+@pytest.mark.parametrize("codec", ["zlib", "int12"])
+def test_random_access_across_blocks(signal, tmp_path, codec):
+    reader = IqzReader(encode(signal, tmp_path, codec))
+    whole = reader.read()
+    ranges = [(0, 1), (BLOCK_SIZE - 3, 7), (BLOCK_SIZE, BLOCK_SIZE), (500, 2 * BLOCK_SIZE + 10), (3400, 1000)]
+    for start, count in ranges:
+        np.testing.assert_array_equal(reader.read(start, count), whole[start : start + count])
+    assert len(reader.read(NUM_SAMPLES + 10, 5)) == 0
+
+    chunks = list(reader.iter_chunks(250, NUM_SAMPLES - 1))
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 1000, 206]
+    np.testing.assert_array_equal(np.concatenate(chunks), whole[250:-1])
+    assert reader.peak(BLOCK_SIZE, 2 * BLOCK_SIZE) == np.abs(whole[BLOCK_SIZE : 2 * BLOCK_SIZE]).max()
+
+
+def test_resampler_reads_through_the_codec(signal, tmp_path):
+    iqz_path = encode(signal, tmp_path, "int16")
+    dst_path = str(tmp_path / "resampled.32cf")
+    resample_file(iqz_path, dst_path, 1e6, 1.5e6)
+    expected = resample(IqzReader(iqz_path).read(), 1e6, 1.5e6)
+    np.testing.assert_allclose(np.fromfile(dst_path, np.complex64), expected, atol=1e-5)
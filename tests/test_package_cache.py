@@ -0,0 +1,91 @@
+import csv
+import os
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+from rfsynth.file_ops import wait_unlinked
+from rfsynth.package_cache import PackageCache
+
+PACKAGE_BYTES = 4000
+
+
+def make_package(tmp_path, name):
+    zip_path = tmp_path / f"{name}.zip"
+    with zipfile.ZipFile(zip_path, "w") as zip_file:
+        zip_file.writestr(f"{name}.32cf", os.urandom(PACKAGE_BYTES))
+        zip_file.writestr("energies.csv", f"time_start,iq_filename\n0.0,/engine/out/{name}.32cf\n")
+    return str(zip_path)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = PackageCache(str(tmp_path / "cache"), max_bytes=2 * PACKAGE_BYTES + 1000)
+    extracted = []
+    extract = cache._extract
+
+    def counting_extract(zip_path, package_hash):
+        extracted.append(package_hash)
+        return extract(zip_path, package_hash)
+
+    monkeypatch.setattr(cache, "_extract", counting_extract)
+    cache.extracted = extracted
+    yield cache
+    wait_unlinked()
+
+
+def cached_packages(cache):
+    return set(cache._read_index()["packages"])
+
+
+def test_reuse_skips_extraction(tmp_path, cache):
+    zip_path = make_package(tmp_path, "a")
+    with cache.acquire(zip_path) as first, cache.acquire(zip_path) as second:
+        assert len(cache.extracted) == 1
+        assert first.directory != second.directory
+        with open(second.metadata_file, newline="") as f:
+            row = next(csv.DictReader(f))
+        assert row["iq_filename"] == os.path.join(second.directory, "a.32cf")
+        assert os.path.samefile(os.path.join(first.directory, "a.32cf"), os.path.join(second.directory, "a.32cf"))
+    wait_unlinked()
+    assert not os.path.exists(first.directory)
+    with cache.acquire(zip_path):
+        assert len(cache.extracted) == 1
+
+
+def test_evicts_least_recently_used(tmp_path, cache):
+    zips = [make_package(tmp_path, name) for name in "abc"]
+    hashes = []
+    for zip_path in zips:
+        with cache.acquire(zip_path) as run:
+            hashes.append(run.package_hash)
+    assert cached_packages(cache) == set(hashes[1:])
+    assert not os.path.exists(os.path.join(cache.objects_dir, hashes[0]))
+
+
+def test_keeps_referenced_packages(tmp_path, cache):
+    zips = [make_package(tmp_path, name) for name in "abc"]
+    with cache.acquire(zips[0]) as kept:
+        for zip_path in zips[1:]:
+            with cache.acquire(zip_path):
+                pass
+        assert kept.package_hash in cached_packages(cache)
+        assert os.path.isfile(os.path.join(kept.directory, "a.32cf"))
+    cache.clear()
+    assert cached_packages(cache) == set()
+
+
+def test_drops_references_of_exited_processes(tmp_path, cache):
+    zip_path = make_package(tmp_path, "a")
+    run = cache.acquire(zip_path)
+    index = cache._read_index()
+    # Hand the reference over to a process that is gone
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    index["packages"][run.package_hash]["refs"][run.run_id] = dead.pid
+    cache._write_index(index)
+    cache.clear()
+    assert cached_packages(cache) == set()
+    assert not os.path.exists(run.directory)
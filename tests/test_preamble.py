@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from rfsynth.otatestbed.preamble import Preamble
+
+FS = 1e6
+CFO_HZ = 200.0
+PHASE_RAD = 0.3
+DELAY = 100000
+
+
+@pytest.fixture
+def capture():
+    rng = np.random.default_rng(1)
+    preamble = Preamble(preamble_on_time_ms=1, seed=7, fs=FS, tx_rx_id=(0, 0, 0, 0))
+    data = (rng.standard_normal(20000) + 1j * rng.standard_normal(20000)) * 0.3
+    tx = preamble.insert(data)
+    rx = np.concatenate((np.zeros(DELAY), tx, np.zeros(DELAY)))
+    rx = rx * np.exp(1j * (2 * np.pi * CFO_HZ * np.arange(len(rx)) / FS + PHASE_RAD))
+    rx = rx + 1e-4 * (rng.standard_normal(len(rx)) + 1j * rng.standard_normal(len(rx)))
+    return preamble, data, rx
+
+
+def test_detects_delay_cfo_and_phase(capture):
+    preamble, data, rx = capture
+    sliced = preamble.remove(rx)
+    assert preamble.start_idx == DELAY + len(preamble._pn_seq)
+    assert len(sliced) == len(data)
+    assert abs(preamble.cfo_est - CFO_HZ) < 1.0
+    assert abs(preamble.phase_est - PHASE_RAD) < 1e-2
+
+
+def test_correction_leaves_received_sequence_alone(capture):
+    preamble, data, rx = capture
+    received = rx.copy()
+    sliced = preamble.remove(rx, correct=True)
+    np.testing.assert_array_equal(preamble.rx_seq, received)
+    np.testing.assert_allclose(sliced, data, atol=1e-2)
+
+
+def test_correlation_is_only_kept_on_request(capture):
+    preamble, _, rx = capture
+    preamble.remove(rx)
+    assert preamble._xcorr is None
+    preamble.keep_xcorr = True
+    preamble.remove(rx)
+    assert len(preamble._xcorr) == len(rx) - len(preamble._pn_seq) + 1
+    assert np.isclose(np.abs(preamble._xcorr).max(), preamble._peak_val)
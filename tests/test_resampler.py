@@ -0,0 +1,112 @@
+import os
+
+import numpy as np
+import pytest
+
+from rfsynth.otatestbed import resampler
+from rfsynth.otatestbed.burst_pack import BurstPack, BurstPackWriter
+from rfsynth.otatestbed.resampler import get_resampled_file, resample
+from rfsynth.otatestbed.transmitter import Transmitter
+
+LENGTHS = (1000, 3333, 50)
+
+
+class RecordingFlowgraph:
+    # Just enough of the flowgraph interface to load data into channels
+    def __init__(self, **kwargs):
+        self.data = {}
+
+    def configure_channel(self, antenna, gain, center_freq, channel_num):
+        pass
+
+    def set_vector_source_data(self, data, channel_num):
+        self.data[channel_num] = np.array(data)
+
+    def set_time_now(self):
+        pass
+
+    def get_time_pair(self):
+        return 0.0, 0.0
+
+
+@pytest.fixture
+def pack(tmp_path):
+    rng = np.random.default_rng(0)
+    bursts = [(rng.standard_normal(n) + 1j * rng.standard_normal(n)).astype(np.complex64) for n in LENGTHS]
+    pack_path = str(tmp_path / "bursts.bpk")
+    with BurstPackWriter(pack_path, 1e6) as writer:
+        for idx, burst in enumerate(bursts):
+            writer.add(f"burst{idx}.32cf", burst, 2.4e9 + idx * 1e6, 1e5)
+    return pack_path, bursts
+
+
+def test_burst_pack_is_resampled_burst_by_burst(pack, tmp_path):
+    pack_path, bursts = pack
+    resampled = BurstPack(get_resampled_file(pack_path, 1e6, 1.5e6, str(tmp_path / "cache")))
+    assert resampled.sample_rate == 1.5e6
+    assert resampled.names == BurstPack(pack_path).names
+    for idx, burst in enumerate(bursts):
+        expected = resample(burst, 1e6, 1.5e6)
+        record = resampled.index[idx]
+        assert record["length"] == len(expected)
+        assert record["center_freq"] == 2.4e9 + idx * 1e6
+        assert np.isclose(record["peak"], np.abs(expected).max())
+        np.testing.assert_allclose(resampled[idx], expected, atol=1e-5)
+
+
+def make_radio(iq_file):
+    return {
+        "model": "USRP_X410",
+        "name": "R0",
+        "addrs": ["addr=192.168.0.2"],
+        "sampleRate": 1.5e6,
+        "masterClockRate": 3e6,
+        "subdevSpec": "A:0",
+        "channels": [
+            {
+                "name": "CH0",
+                "antenna": "TX/RX",
+                "gain": 0.8,
+                "IQSTREAM_Params": {"frequency": 2.4e9, "file": iq_file, "metadata": "", "sampleRate": 1e6},
+            }
+        ],
+    }
+
+
+def test_transmitter_loads_resampled_pack_burst(pack):
+    pack_path, bursts = pack
+    transmitter = Transmitter(make_radio(pack_path), flowgraph=RecordingFlowgraph)
+    record = BurstPack(pack_path).index[1]
+    transmitter.set_single_channel_data_from_file(pack_path, 0, 0.0, int(record["offset"]), int(record["length"]))
+    expected = resample(bursts[1], 1e6, 1.5e6)
+    np.testing.assert_allclose(transmitter.tb.data[0], expected / np.abs(expected).max(), atol=1e-5)
+
+    # Part of a burst has no counterpart in the resampled pack
+    with pytest.raises(ValueError, match="whole bursts"):
+        transmitter.set_single_channel_data_from_file(pack_path, 0, 0.0, int(record["offset"]), 10)
+
+
+def test_files_are_hashed_once(pack, monkeypatch):
+    pack_path, _ = pack
+    hashed = []
+    file_digest = resampler.file_digest
+
+    def counting_digest(filepath):
+        hashed.append(filepath)
+        return file_digest(filepath)
+
+    monkeypatch.setattr(resampler, "file_digest", counting_digest)
+    resampler._get_file_digest.cache_clear()
+    transmitter = Transmitter(make_radio(pack_path), flowgraph=RecordingFlowgraph)
+    for record in BurstPack(pack_path).index:
+        transmitter.set_single_channel_data_from_file(pack_path, 0, 0.0, int(record["offset"]), int(record["length"]))
+    assert len(hashed) == 1
+
+    # Another run hashes the file again only once it changed
+    for _ in range(2):
+        resampler.get_file_digest(pack_path)
+    assert len(hashed) == 1
+    stat = os.stat(pack_path)
+    os.utime(pack_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    resampler.get_file_digest(pack_path)
+    assert len(hashed) == 2
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+from rfsynth.otatestbed.config_model import ChannelConfig, IqStreamParams, RadioConfig, RadiosConfig
+from rfsynth.otatestbed.retune_planner import RetunePlanner
+from rfsynth.otatestbed.schedule_analyzer import analyze_channel, check_schedule
+
+
+def make_radio(tmp_path, retune_policy=None):
+    iq_file = tmp_path / "burst.bin"
+    np.zeros(1000, dtype=np.complex64).tofile(iq_file)
+    channel = ChannelConfig(
+        name="A",
+        antenna="TX/RX",
+        gain=0.5,
+        iq_stream=IqStreamParams(frequency=2.4e9, file=str(iq_file), metadata=str(tmp_path / "meta.csv")),
+    )
+    radio = RadioConfig(
+        model="b210",
+        name="tx0",
+        addrs=["192.168.10.2"],
+        sample_rate=1e6,
+        master_clock_rate=20e6,
+        subdev_spec="A:A",
+        channels=[channel],
+        retune_policy=retune_policy or {},
+    )
+    return radio, str(iq_file)
+
+
+def make_schedule(iq_file, gap_s, freqs):
+    # 1 ms bursts, each at its own band far enough apart to need an RF retune
+    time_start = np.arange(len(freqs)) * (0.001 + gap_s)
+    return pd.DataFrame(
+        {
+            "time_start": time_start,
+            "timeLength_s": 0.001,
+            "freq_lo": np.asarray(freqs) - 1e5,
+            "freq_hi": np.asarray(freqs) + 1e5,
+            "tx_radio": 1,
+            "iq_filename": iq_file,
+        }
+    )
+
+
+def test_retunes_with_enough_gap_are_feasible(tmp_path):
+    radio, iq_file = make_radio(tmp_path)
+    df = make_schedule(iq_file, 0.010, [2.4e9, 2.5e9, 2.6e9, 2.5e9])
+    report = analyze_channel(df, radio, 0, 0)
+    # The channel starts out tuned to the first burst
+    assert report.num_rf_retunes == 3
+    assert report.late_retune_rows == []
+    assert report.dropped_rows == []
+    assert report.feasible
+
+
+def test_retunes_within_short_gap_are_late(tmp_path):
+    radio, iq_file = make_radio(tmp_path, {"rfRetuneLatencyS": 0.02})
+    df = make_schedule(iq_file, 0.010, [2.4e9, 2.5e9, 2.6e9])
+    report = analyze_channel(df, radio, 0, 0)
+    assert report.late_retune_rows == [1, 2]
+    assert not report.feasible
+
+
+def test_overlapping_energies_are_dropped(tmp_path):
+    radio, iq_file = make_radio(tmp_path)
+    df = make_schedule(iq_file, 0.010, [2.4e9, 2.4e9, 2.4e9])
+    df.loc[1, "time_start"] = df.loc[0, "time_start"] + 0.0005
+    report = analyze_channel(df, radio, 0, 0)
+    assert report.dropped_rows == [1]
+    assert report.num_rf_retunes == 0
+
+
+def test_preflight_passes_feasible_schedule(tmp_path):
+    radio, iq_file = make_radio(tmp_path)
+    make_schedule(iq_file, 0.010, [2.4e9, 2.5e9, 2.6e9]).to_csv(tmp_path / "meta.csv", index=False)
+    feasible, reports = check_schedule(RadiosConfig([radio]))
+    assert feasible
+    assert len(reports) == 1
+    # The same file is only loaded once
+    assert reports[0].load_bytes == 8000
+
+
+def test_planner_leads_rf_retunes_by_latency(tmp_path):
+    radio, iq_file = make_radio(tmp_path)
+    df = make_schedule(iq_file, 0.010, [2.4e9, 2.5e9])
+    planner = RetunePlanner.from_config(radio)
+    (command,) = planner.plan(df.time_start, df.timeLength_s, df.freq_lo, df.freq_hi, 2.4e9)
+    assert np.isclose(df.time_start[1] - command.cmd_time, 0.005)
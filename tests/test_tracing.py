@@ -0,0 +1,39 @@
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+
+from rfsynth.otatestbed import tracing
+
+
+def work(idx):
+    with tracing.span("work", idx=idx):
+        with tracing.span("inner"):
+            pass
+    return idx
+
+
+def test_worker_spans_of_pool_created_inside_a_span(tmp_path):
+    collector = tracing.start_collector()
+    trace_path = str(tmp_path / "trace.json")
+    try:
+        # Forked workers inherit the open "outer" span of this thread
+        with tracing.span("outer"):
+            context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(2, mp_context=context, **tracing.executor_kwargs()) as executor:
+                assert sorted(executor.map(work, range(4))) == [0, 1, 2, 3]
+    finally:
+        collector.write(trace_path)
+    with open(trace_path) as f:
+        events = json.load(f)["traceEvents"]
+    names = [event["name"] for event in events]
+    assert names.count("work") == 4
+    assert names.count("inner") == 4
+    assert names.count("outer") == 1
+    assert sorted(event["args"]["idx"] for event in events if event["name"] == "work") == [0, 1, 2, 3]
+    assert not tracing.is_enabled()
+
+
+def test_spans_are_free_while_tracing_is_off():
+    assert not tracing.is_enabled()
+    assert tracing.span("idle") is tracing.span("other")
+    assert tracing.traced()(work)(3) == 3